@@ -0,0 +1 @@
+"""TEMPO pipeline 效能基準測試"""
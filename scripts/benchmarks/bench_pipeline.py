@@ -0,0 +1,162 @@
+"""以合成 TEMPO granule 離線量測 pipeline 各階段，並與基準結果比較
+
+不需要 Earthdata 帳號或網路：先以 benchmarks.synthetic 產生與真實檔案結構相同的
+NetCDF，再分別量測 convert_nc_to_geotiff、create_colored_geotiff、generate_tiles
+(以及記憶體內的 process_granule_fused)，各階段取多次執行的中位數。
+與 baseline.json 比較，wall time 超過基準 (1 + tolerance) 倍的階段視為退步，結束代碼為 1。
+
+在 scripts/ 目錄下執行:
+    python -m benchmarks.bench_pipeline --size medium --repeat 3
+    python -m benchmarks.bench_pipeline --size full --save-baseline
+"""
+import argparse
+import json
+import shutil
+import statistics
+import sys
+import tempfile
+from pathlib import Path
+
+import tempo_metrics
+from benchmarks.synthetic import SIZES, parse_shape, write_synthetic_granule
+from fetch_tempo_no2 import (
+    convert_nc_to_geotiff,
+    create_colored_geotiff,
+    generate_tiles,
+    process_granule_fused,
+)
+
+BASELINE_FILE = Path(__file__).with_name("baseline.json")
+# 合成檔名需符合 TEMPO 命名，觀測時間等解析才會與實際流程相同
+GRANULE_NAME = "TEMPO_NO2_L3_NRT_V02_20251002T133140Z_S004.nc"
+
+
+def _size_key(shape):
+    return next((name for name, value in SIZES.items() if value == shape), f"{shape[0]}x{shape[1]}")
+
+
+def _stage_record(name, since):
+    """取出 since 之後最後一筆名為 name 的量測結果"""
+    matches = [r for r in tempo_metrics.records()[since:] if r["stage"] == name]
+    return matches[-1] if matches else None
+
+
+def run_once(nc_path, work_dir, max_zoom, processes, fused):
+    """執行一次完整流程，回傳 {階段: 量測結果}"""
+    results = {}
+    geotiff_dir = work_dir / "geotiff"
+
+    start = len(tempo_metrics.records())
+    geotiff = convert_nc_to_geotiff(str(nc_path), str(geotiff_dir), stations_path=None)
+    results["convert"] = _stage_record("convert", start)
+    if geotiff is None:
+        return results
+
+    start = len(tempo_metrics.records())
+    colored = create_colored_geotiff(geotiff, str(geotiff_dir))
+    results["colorize"] = _stage_record("colorize", start)
+
+    start = len(tempo_metrics.records())
+    generate_tiles(colored, tiles_dir=str(work_dir / "tiles"), max_zoom=max_zoom,
+                   processes=processes, incremental=False)
+    results["tiling"] = _stage_record("tiling", start)
+
+    if fused:
+        start = len(tempo_metrics.records())
+        process_granule_fused(str(nc_path), tiles_dir=str(work_dir / "fused_tiles"), max_zoom=max_zoom,
+                              processes=processes, incremental=False, stations_path=None)
+        results["fused"] = _stage_record("fused", start)
+    return results
+
+
+def summarize(runs):
+    """各階段取中位數"""
+    summary = {}
+    for stage in runs[0]:
+        records = [run[stage] for run in runs if run.get(stage)]
+        if not records:
+            continue
+        summary[stage] = {
+            "wall_s": round(statistics.median(r["wall_s"] for r in records), 4),
+            "cpu_s": round(statistics.median(r["cpu_s"] + r["children_cpu_s"] for r in records), 4),
+            "peak_rss_mb": max(r["peak_rss_mb"] for r in records),
+            "ok": all(r["ok"] for r in records),
+        }
+    return summary
+
+
+def compare(summary, baseline, tolerance):
+    """印出與基準的比較，回傳退步的階段"""
+    regressions = []
+    print("\n" + "=" * 60)
+    print(f"{'stage':<10}{'wall (s)':>10}{'baseline':>10}{'ratio':>8}{'CPU (s)':>10}{'RSS MB':>9}")
+    for stage, result in summary.items():
+        base = (baseline or {}).get(stage)
+        line = f"{stage:<10}{result['wall_s']:>10.3f}"
+        if base:
+            ratio = result["wall_s"] / max(base["wall_s"], 1e-9)
+            flag = ""
+            if ratio > 1 + tolerance:
+                regressions.append(stage)
+                flag = "  ← 退步"
+            line += f"{base['wall_s']:>10.3f}{ratio:>8.2f}"
+        else:
+            line += f"{'-':>10}{'-':>8}"
+            flag = ""
+        line += f"{result['cpu_s']:>10.2f}{result['peak_rss_mb']:>9.0f}"
+        if not result["ok"]:
+            line += "  (失敗)"
+        print(line + flag)
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the TEMPO pipeline on a synthetic granule.")
+    ap.add_argument("--size", type=parse_shape, default=SIZES["small"],
+                    help=f"{' / '.join(SIZES)} 或 <高>x<寬>")
+    ap.add_argument("--repeat", type=int, default=3, help="重複次數 (取中位數)")
+    ap.add_argument("--max-zoom", type=int, default=8)
+    ap.add_argument("--processes", type=int, default=None, help="tiling 的 process 數量")
+    ap.add_argument("--fused", action="store_true", help="另外量測記憶體內的 process_granule_fused")
+    ap.add_argument("--baseline", type=Path, default=BASELINE_FILE, help="基準結果檔")
+    ap.add_argument("--tolerance", type=float, default=0.2, help="容許比基準慢的比例")
+    ap.add_argument("--save-baseline", action="store_true", help="把本次結果寫入基準檔")
+    args = ap.parse_args()
+
+    size_key = _size_key(args.size)
+    tmp_dir = Path(tempfile.mkdtemp(prefix="bench_pipeline_"))
+    try:
+        nc_path = tmp_dir / GRANULE_NAME
+        write_synthetic_granule(nc_path, args.size)
+        print(f"合成 granule: {args.size[0]}x{args.size[1]} ({nc_path.stat().st_size / 1e6:.1f}MB)")
+
+        runs = []
+        for i in range(args.repeat):
+            print(f"\n--- 第 {i + 1}/{args.repeat} 次 ---")
+            work_dir = tmp_dir / f"run{i}"
+            runs.append(run_once(nc_path, work_dir, args.max_zoom, args.processes, args.fused))
+            shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    summary = summarize(runs)
+    try:
+        baselines = json.loads(args.baseline.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        baselines = {}
+    if size_key not in baselines:
+        print(f"\n⚠ {args.baseline} 沒有 {size_key} 的基準，使用 --save-baseline 建立")
+
+    regressions = compare(summary, baselines.get(size_key), args.tolerance)
+
+    if args.save_baseline:
+        baselines[size_key] = summary
+        args.baseline.write_text(json.dumps(baselines, indent=2) + "\n", encoding="utf-8")
+        print(f"\n✓ 基準已更新: {args.baseline} [{size_key}]")
+    elif regressions:
+        print(f"\n✗ 比基準慢超過 {args.tolerance:.0%} 的階段: {', '.join(regressions)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
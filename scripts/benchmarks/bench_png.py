@@ -0,0 +1,141 @@
+"""比較 tile PNG 編碼方式的大小與速度
+
+以合成 granule (或 --geotiff 指定的著色 GeoTIFF) 實際產生的 tile 為樣本：
+
+- pil-rgba：原本的輸出 (調色盤展開成 RGBA，再以 Pillow 預設設定編碼)
+- pil-p：Pillow 的索引色 PNG (參考)
+- png-*：tempo_png 的索引色 PNG，各種濾波 / zlib 等級 / 策略的組合
+- data 組：數值編碼 tile (RGBA) 的 Pillow 與 tempo_png 比較
+
+在 scripts/ 目錄下執行:
+    python -m benchmarks.bench_png --size medium --zoom 5 7
+    python -m benchmarks.bench_png --geotiff ../public/tempo/geotiff/<granule>_NO2_colored.tif
+"""
+import argparse
+import io
+import itertools
+import time
+
+import numpy as np
+from PIL import Image
+
+import tempo_colorize
+import tempo_png
+import tempo_tiler
+from benchmarks.synthetic import LAT_RANGE, LON_RANGE, SIZES, parse_shape, synthetic_no2
+
+
+def load_source(args):
+    """回傳 (北→南數值格網或 None, 索引格網, bounds, 調色盤)"""
+    if args.geotiff:
+        import rasterio
+        with rasterio.open(args.geotiff) as src:
+            index = src.read(1)
+            palette = tempo_tiler.palette_from_colormap(src.colormap(1))
+            return None, index, tuple(src.bounds), palette
+    values = synthetic_no2(args.size, seed=args.seed)[::-1]
+    bounds = (LON_RANGE[0], LAT_RANGE[0], LON_RANGE[1], LAT_RANGE[1])
+    return values, tempo_colorize.colorize(values, 0, 5e15), bounds, tempo_colorize.color_ramp_lut()
+
+
+def sample_tiles(values, index, bounds, zooms, limit):
+    """回傳各 zoom 含資料的 tile：[(索引 tile, 數值 tile 或 None)]"""
+    index_source = tempo_tiler.GridSource(np.where(index == 0, np.nan, index).astype(np.float32), bounds)
+    value_source = tempo_tiler.GridSource(values, bounds) if values is not None else None
+    tiles = []
+    for zoom in zooms:
+        footprint = tempo_tiler.Footprint(index_source, zoom, zoom)
+        x_min, x_max, y_min, y_max = tempo_tiler.tile_range(bounds, zoom)
+        keys = [(x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)
+                if footprint.covers(zoom, x, y)]
+        step = max(1, len(keys) // max(1, limit // len(zooms)))
+        for x, y in keys[::step]:
+            tile_index = tempo_tiler.to_palette_index(index_source.sample_tile(zoom, x, y))
+            if not tile_index.any():
+                continue
+            data = (tempo_tiler.encode_data_tile(value_source.sample_tile(zoom, x, y))
+                    if value_source is not None else None)
+            tiles.append((tile_index, data))
+    return tiles
+
+
+def pil_png(image, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', **options)
+    return buffer.getvalue()
+
+
+def measure(name, encode, items, baseline=None):
+    started = time.perf_counter()
+    sizes = [len(encode(item)) for item in items]
+    elapsed = time.perf_counter() - started
+    result = {
+        'name': name,
+        'bytes': sum(sizes) / len(sizes),
+        'ms': elapsed / len(items) * 1000,
+    }
+    result['ratio'] = baseline['bytes'] / result['bytes'] if baseline else 1.0
+    return result
+
+
+def print_table(title, results):
+    print(f"\n{title}")
+    print(f"{'encoder':<30}{'bytes/tile':>12}{'ms/tile':>10}{'vs 原本':>9}")
+    for r in sorted(results, key=lambda r: r['bytes']):
+        print(f"{r['name']:<30}{r['bytes']:>12,.0f}{r['ms']:>10.2f}{r['ratio']:>8.2f}×")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark PNG encoders for colored and data tiles.")
+    ap.add_argument("--size", type=parse_shape, default=SIZES["medium"],
+                    help=f"合成格網大小: {' / '.join(SIZES)} 或 <高>x<寬>")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--geotiff", help="改用既有的著色 GeoTIFF (只比較著色 tile)")
+    ap.add_argument("--zoom", type=int, nargs="+", default=[5, 7], help="取樣的 zoom")
+    ap.add_argument("--tiles", type=int, default=200, help="樣本 tile 數上限")
+    ap.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9], help="比較的 zlib 等級")
+    args = ap.parse_args()
+
+    values, index, bounds, palette = load_source(args)
+    tiles = sample_tiles(values, index, bounds, args.zoom, args.tiles)
+    print(f"樣本: {len(tiles)} 張 tile (zoom {', '.join(map(str, args.zoom))})")
+
+    indexes = [t[0] for t in tiles]
+    baseline = measure('pil-rgba (原本)', lambda i: pil_png(Image.fromarray(palette[i], 'RGBA')), indexes)
+    results = [baseline]
+
+    def pil_indexed(i):
+        image = Image.fromarray(i, 'P')
+        image.putpalette(palette[:, :3].tobytes())
+        return pil_png(image, transparency=palette[:, 3].tobytes())
+    results.append(measure('pil-p', pil_indexed, indexes, baseline))
+
+    for filter_method, level, strategy in itertools.product(
+            list(tempo_png.FILTERS) + ['adaptive'], args.levels, ['default', 'rle', 'filtered']):
+        results.append(measure(
+            f"png {filter_method}/{level}/{strategy}",
+            lambda i: tempo_png.encode_indexed(i, palette, level, filter_method, strategy),
+            indexes, baseline))
+    results.append(measure(
+        f"png 預設 ({tempo_png.PNG_FILTER}/{tempo_png.PNG_COMPRESS_LEVEL}/{tempo_png.PNG_STRATEGY})",
+        lambda i: tempo_png.encode_indexed(i, palette), indexes, baseline))
+    print_table("著色 tile", results)
+
+    data = [t[1] for t in tiles if t[1] is not None]
+    if data:
+        data_baseline = measure('pil-rgba (原本)', lambda d: pil_png(Image.fromarray(d, 'RGBA')), data)
+        data_results = [data_baseline]
+        for filter_method, level, strategy in itertools.product(
+                list(tempo_png.FILTERS) + ['adaptive'], args.levels, ['default', 'rle', 'filtered']):
+            data_results.append(measure(
+                f"png {filter_method}/{level}/{strategy}",
+                lambda d: tempo_png.encode_rgba(d, level, filter_method, strategy),
+                data, data_baseline))
+        data_results.append(measure(
+            f"png 預設 ({tempo_png.PNG_RGBA_FILTER}/{tempo_png.PNG_COMPRESS_LEVEL}/{tempo_png.PNG_RGBA_STRATEGY})",
+            tempo_png.encode_rgba, data, data_baseline))
+        print_table("數值 tile (RGBA)", data_results)
+
+
+if __name__ == "__main__":
+    main()
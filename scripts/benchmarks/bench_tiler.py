@@ -0,0 +1,74 @@
+"""比較 tempo_tiler 與原本 GDAL (gdal_translate + gdal2tiles.py) 的 tiling 效能
+
+在 scripts/ 目錄下執行:
+    python -m benchmarks.bench_tiler ../public/tempo/geotiff/<granule>_NO2_colored.tif
+"""
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from fetch_tempo_no2 import generate_tiles, generate_tiles_gdal
+
+
+def summarize_tiles(tiles_dir):
+    """統計 tile 數量與總大小 (只計算 .png)。"""
+    pngs = list(Path(tiles_dir).rglob("*.png"))
+    return len(pngs), sum(p.stat().st_size for p in pngs)
+
+
+def run_case(name, func):
+    tmp_dir = tempfile.mkdtemp(prefix=f"bench_{name}_")
+    tiles_dir = os.path.join(tmp_dir, "tiles")
+    try:
+        started = time.perf_counter()
+        result = func(tiles_dir)
+        elapsed = time.perf_counter() - started
+        if result is None:
+            return {"name": name, "ok": False, "seconds": elapsed, "tiles": 0, "bytes": 0}
+        count, size = summarize_tiles(tiles_dir)
+        return {"name": name, "ok": True, "seconds": elapsed, "tiles": count, "bytes": size}
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark tempo_tiler against the GDAL tiling path.")
+    ap.add_argument("colored_geotiff", help="create_colored_geotiff 產生的著色 GeoTIFF")
+    ap.add_argument("--processes", type=int, default=None, help="tempo_tiler 的 process 數量")
+    ap.add_argument("--min-zoom", type=int, default=2)
+    ap.add_argument("--max-zoom", type=int, default=8)
+    ap.add_argument("--skip-gdal", action="store_true", help="不執行 GDAL 基準 (例如本機未安裝 GDAL)")
+    args = ap.parse_args()
+
+    cases = [
+        ("tempo_tiler", lambda out: generate_tiles(
+            args.colored_geotiff, tiles_dir=out, min_zoom=args.min_zoom,
+            max_zoom=args.max_zoom, processes=args.processes)),
+    ]
+    if not args.skip_gdal:
+        if shutil.which("gdal2tiles.py") and shutil.which("gdal_translate"):
+            cases.append(("gdal2tiles", lambda out: generate_tiles_gdal(args.colored_geotiff, tiles_dir=out)))
+        else:
+            print("⚠ 找不到 gdal2tiles.py / gdal_translate，略過 GDAL 基準")
+
+    results = [run_case(name, func) for name, func in cases]
+
+    print("\n" + "=" * 50)
+    print(f"{'engine':<14}{'seconds':>10}{'tiles':>10}{'MB':>10}{'tiles/s':>10}")
+    for r in results:
+        if not r["ok"]:
+            print(f"{r['name']:<14}{r['seconds']:>10.2f}{'FAILED':>10}")
+            continue
+        rate = r["tiles"] / max(r["seconds"], 1e-9)
+        print(f"{r['name']:<14}{r['seconds']:>10.2f}{r['tiles']:>10}{r['bytes'] / 1e6:>10.1f}{rate:>10.0f}")
+
+    if len(results) == 2 and all(r["ok"] for r in results):
+        speedup = results[1]["seconds"] / max(results[0]["seconds"], 1e-9)
+        print(f"\ntempo_tiler 相對 gdal2tiles 加速: {speedup:.1f}×")
+
+
+if __name__ == "__main__":
+    main()
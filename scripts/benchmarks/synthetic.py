@@ -0,0 +1,126 @@
+"""產生與 TEMPO NO2 L3 檔案結構相同的合成 NetCDF granule
+
+根層有 time / latitude / longitude 座標，product 與 support_data 兩個 group 內有
+vertical_column_troposphere 等變數 (time, latitude, longitude)，緯度由南到北遞增，
+與實際檔案一樣以 HDF5 chunk + gzip 儲存、無資料以 _FillValue 表示。
+數值為平滑背景 + 城市熱點 + 雲遮 (NaN) 的合成場，壓縮率與 tiling 成本接近真實資料。
+
+在 scripts/ 目錄下執行:
+    python -m benchmarks.synthetic /tmp/TEMPO_NO2_L3_SYNTH.nc --size full
+"""
+import argparse
+
+import h5netcdf
+import numpy as np
+
+# 實際 TEMPO L3 格網為 0.02° (2950 × 7750)
+FULL_SHAPE = (2950, 7750)
+SIZES = {
+    "small": (295, 775),
+    "medium": (1475, 3875),
+    "full": FULL_SHAPE,
+}
+LAT_RANGE = (14.01, 72.99)
+LON_RANGE = (-167.99, -13.01)
+FILL_VALUE = -1.0e30
+CHUNKS = (1, 256, 512)
+
+
+def parse_shape(text):
+    """'small' / 'medium' / 'full' 或 '<高>x<寬>'"""
+    if text in SIZES:
+        return SIZES[text]
+    height, width = (int(v) for v in text.lower().split("x"))
+    if not (0 < height <= FULL_SHAPE[0] and 0 < width <= FULL_SHAPE[1]):
+        raise argparse.ArgumentTypeError(f"大小需介於 1x1 與 {FULL_SHAPE[0]}x{FULL_SHAPE[1]}")
+    return height, width
+
+
+def _smooth_noise(rng, shape, cell):
+    """低解析度均勻雜訊以雙線性內插放大成平滑場 (0-1)"""
+    height, width = shape
+    coarse = rng.random((height // cell + 2, width // cell + 2))
+    y = np.linspace(0, coarse.shape[0] - 1.001, height)
+    x = np.linspace(0, coarse.shape[1] - 1.001, width)
+    y0, x0 = y.astype(int), x.astype(int)
+    wy, wx = (y - y0)[:, None], (x - x0)[None, :]
+    rows = coarse[y0] * (1 - wy) + coarse[y0 + 1] * wy
+    return rows[:, x0] * (1 - wx) + rows[:, x0 + 1] * wx
+
+
+def synthetic_no2(shape, seed=0, nan_fraction=0.3, hotspots=60):
+    """合成的對流層 NO2 柱濃度 (molecules/cm²)，南→北排列，雲遮處為 NaN"""
+    rng = np.random.default_rng(seed)
+    height, width = shape
+    field = 1.0e15 + 2.0e15 * _smooth_noise(rng, shape, max(4, width // 60))
+
+    # 城市熱點：高斯分布，只在局部視窗內計算
+    radius = max(2, width // 150)
+    for _ in range(hotspots):
+        cy, cx = rng.integers(0, height), rng.integers(0, width)
+        peak = rng.uniform(3e15, 2e16)
+        y0, y1 = max(0, cy - 3 * radius), min(height, cy + 3 * radius + 1)
+        x0, x1 = max(0, cx - 3 * radius), min(width, cx + 3 * radius + 1)
+        yy, xx = np.ogrid[y0:y1, x0:x1]
+        field[y0:y1, x0:x1] += peak * np.exp(-((yy - cy) ** 2 + (xx - cx) ** 2) / (2 * radius ** 2))
+
+    field *= 1 + 0.1 * rng.standard_normal(shape)
+    if nan_fraction > 0:
+        clouds = _smooth_noise(rng, shape, max(4, width // 120))
+        field[clouds < np.quantile(clouds, nan_fraction)] = np.nan
+    return field
+
+
+def write_synthetic_granule(path, shape=SIZES["small"], seed=0, nan_fraction=0.3):
+    """寫出合成 granule，回傳 NO2 陣列 (南→北) 供比對"""
+    height, width = shape
+    no2 = synthetic_no2(shape, seed=seed, nan_fraction=nan_fraction)
+    chunks = (1, min(height, CHUNKS[1]), min(width, CHUNKS[2]))
+
+    with h5netcdf.File(path, "w") as f:
+        f.dimensions = {"time": 1, "latitude": height, "longitude": width}
+        lat = f.create_variable("latitude", ("latitude",), "f4")
+        lat[:] = np.linspace(*LAT_RANGE, height)
+        lat.attrs["units"] = "degrees_north"
+        lon = f.create_variable("longitude", ("longitude",), "f4")
+        lon[:] = np.linspace(*LON_RANGE, width)
+        lon.attrs["units"] = "degrees_east"
+        time_var = f.create_variable("time", ("time",), "f8")
+        time_var[:] = [0.0]
+        time_var.attrs["units"] = "seconds since 1980-01-06T00:00:00Z"
+
+        def column(group, name, values):
+            var = group.create_variable(name, ("time", "latitude", "longitude"), "f8",
+                                        chunks=chunks, compression="gzip", fillvalue=FILL_VALUE)
+            var[0] = np.where(np.isnan(values), FILL_VALUE, values)
+            var.attrs["units"] = "molecules/cm^2"
+            return var
+
+        product = f.create_group("product")
+        column(product, "vertical_column_troposphere", no2)
+        column(product, "vertical_column_troposphere_uncertainty", no2 * 0.2)
+        flags = product.create_variable("main_data_quality_flag", ("time", "latitude", "longitude"), "i2",
+                                        chunks=chunks, compression="gzip")
+        flags[0] = np.where(np.isnan(no2), 1, 0).astype(np.int16)
+
+        support = f.create_group("support_data")
+        column(support, "vertical_column_total", no2 * 1.3)
+
+    return no2
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Write a synthetic TEMPO NO2 L3 granule.")
+    ap.add_argument("output", help="輸出的 .nc 路徑")
+    ap.add_argument("--size", type=parse_shape, default=SIZES["small"],
+                    help=f"{' / '.join(SIZES)} 或 <高>x<寬> (最大 {FULL_SHAPE[0]}x{FULL_SHAPE[1]})")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--nan-fraction", type=float, default=0.3, help="雲遮 (無資料) 比例")
+    args = ap.parse_args()
+
+    write_synthetic_granule(args.output, args.size, seed=args.seed, nan_fraction=args.nan_fraction)
+    print(f"✓ 合成 granule: {args.output} ({args.size[0]}x{args.size[1]})")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,22 @@
 import requests
 import json
+import math
 import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-
-API_URL = "https://api.openaq.org/v3/locations"
-API_KEY = "f842213920405091f23318ca1a7880636ac843b7cb81f8e3985c41b17deb19f2"  # 你的 API Key
+from email.utils import parsedate_to_datetime
+
+API_URL = os.environ.get("OPENAQ_API_URL", "https://api.openaq.org/v3/locations")
+API_KEY = os.environ.get("OPENAQ_API_KEY", "f842213920405091f23318ca1a7880636ac843b7cb81f8e3985c41b17deb19f2")  # 你的 API Key
+PAGE_LIMIT = 1000
+# 同時抓取的頁數 (OpenAQ 以 API Key 計算速率限制，不宜太大)
+CONCURRENCY = int(os.environ.get("OPENAQ_CONCURRENCY", 4))
+# 429 / 5xx / 連線錯誤的重試次數與起始退避秒數 (每次加倍)
+MAX_RETRIES = int(os.environ.get("OPENAQ_MAX_RETRIES", 5))
+RETRY_BACKOFF = float(os.environ.get("OPENAQ_RETRY_BACKOFF", 1.0))
+TIMEOUT = 60
 
 # 獲取專案根目錄的 data 資料夾路徑
 script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -12,123 +24,226 @@ project_root = os.path.dirname(script_dir)
 data_dir = os.path.join(project_root, "public", "data")
 OUTPUT_FILE = os.path.join(data_dir, "openaq-us-stations.geojson")
 
+session = requests.Session()
+session.headers.update({"x-api-key": API_KEY})
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=CONCURRENCY))
+
 def is_recent_data(datetime_last, days=5):
     """檢查 datetime_last 是否在指定天數內"""
     if not datetime_last or not datetime_last.get("utc"):
         return False
-    
+
     try:
         # 解析 UTC 時間
         last_update = datetime.fromisoformat(datetime_last["utc"].replace("Z", "+00:00"))
         # 計算 N 天前的時間
         cutoff_date = datetime.now().astimezone() - timedelta(days=days)
-        
+
         return last_update.astimezone() > cutoff_date
     except (ValueError, TypeError) as e:
         print(f"Error parsing datetime: {datetime_last}, error: {e}")
         return False
 
-def fetch_us_stations():
-    page = 1
-    limit = 1000
+def retry_delay(resp, attempt):
+    """下次重試前等待的秒數：優先採用 Retry-After / x-ratelimit-reset，否則指數退避"""
+    if resp is not None:
+        for header in ("Retry-After", "x-ratelimit-reset"):
+            value = resp.headers.get(header)
+            if not value:
+                continue
+            try:
+                return max(0.0, float(value))
+            except ValueError:
+                pass
+            try:
+                return max(0.0, (parsedate_to_datetime(value) - datetime.now().astimezone()).total_seconds())
+            except (TypeError, ValueError):
+                pass
+    return RETRY_BACKOFF * 2 ** attempt
+
+def fetch_page(page, limit=PAGE_LIMIT):
+    """抓取 /v3/locations 的一頁，429 / 5xx / 連線錯誤時退避重試"""
+    for attempt in range(MAX_RETRIES + 1):
+        resp = None
+        try:
+            resp = session.get(
+                API_URL,
+                params={"countries_id": 155, "limit": limit, "page": page},
+                timeout=TIMEOUT,
+            )
+        except (requests.ConnectionError, requests.Timeout) as e:
+            error = f"{type(e).__name__}: {e}"
+        else:
+            if resp.status_code == 200:
+                return resp.json()
+            error = f"{resp.status_code} {resp.text[:200]}"
+            if resp.status_code != 429 and resp.status_code < 500:
+                break
+        if attempt == MAX_RETRIES:
+            break
+        delay = retry_delay(resp, attempt)
+        print(f"Page {page}: {error}, retrying in {delay:.1f}s ({attempt + 1}/{MAX_RETRIES})")
+        time.sleep(delay)
+    raise Exception(f"API error on page {page}: {error}")
+
+def fetch_locations(concurrency=CONCURRENCY, limit=PAGE_LIMIT):
+    """回傳所有測站 (依 API 的頁序)
+
+    第一頁的 meta.found 給出總數後，其餘頁面並行抓取；found 不是確切數字
+    (例如 ">1000") 時，改為每次並行抓 concurrency 頁，直到出現不滿一頁的結果。
+    """
+    print("Fetching page 1...")
+    first = fetch_page(1, limit)
+    results = first.get("results", [])
+    if len(results) < limit:
+        return results
+
+    found = first.get("meta", {}).get("found")
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        if isinstance(found, int):
+            pages = range(2, math.ceil(found / limit) + 1)
+            print(f"{found} locations, fetching pages 2-{pages.stop - 1} ({concurrency} at a time)...")
+            for data in pool.map(lambda p: fetch_page(p, limit), pages):
+                results.extend(data.get("results", []))
+            return results
+
+        page = 2
+        while True:
+            pages = range(page, page + max(1, concurrency))
+            print(f"Fetching pages {pages.start}-{pages.stop - 1}...")
+            for data in pool.map(lambda p: fetch_page(p, limit), pages):
+                page_results = data.get("results", [])
+                results.extend(page_results)
+                # 如果少於 limit，表示到最後一頁
+                if len(page_results) < limit:
+                    return results
+            page = pages.stop
+
+def station_feature(station):
+    """OpenAQ location → GeoJSON feature"""
+    coords = station["coordinates"]
+
+    # 提取 sensors 資訊
+    sensors = []
+    for sensor in station.get("sensors", []):
+        parameter = sensor.get("parameter", {})
+        sensors.append({
+            "id": sensor.get("id"),
+            "name": sensor.get("name"),
+            "parameter_id": parameter.get("id"),
+            "parameter_name": parameter.get("name"),
+            "parameter_units": parameter.get("units"),
+            "parameter_display_name": parameter.get("displayName")
+        })
+
+    return {
+        "type": "Feature",
+        "properties": {
+            "id": station["id"],
+            "name": station["name"],
+            "provider": station.get("provider", {}).get("name"),
+            "provider_id": station.get("provider", {}).get("id"),
+            "timezone": station.get("timezone"),
+            "country": station.get("country", {}).get("name"),
+            "country_id": station.get("country", {}).get("id"),
+            "country_code": station.get("country", {}).get("code"),
+            "owner": station.get("owner", {}).get("name"),
+            "owner_id": station.get("owner", {}).get("id"),
+            "is_mobile": station.get("isMobile", False),
+            "is_monitor": station.get("isMonitor", False),
+            "sensors": sensors,
+            "sensor_count": len(sensors),
+            "datetime_first": station.get("datetimeFirst"),
+            "datetime_last": station.get("datetimeLast")
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [
+                coords["longitude"],
+                coords["latitude"]
+            ]
+        }
+    }
+
+def load_existing(path):
+    """既有 GeoJSON 的 {測站 id: feature}"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            features = json.load(f).get("features", [])
+    except (OSError, ValueError):
+        return {}
+    return {f["properties"]["id"]: f for f in features}
+
+def fetch_us_stations(output=OUTPUT_FILE, concurrency=CONCURRENCY, incremental=False):
+    started = time.monotonic()
+    stations = fetch_locations(concurrency)
+
+    # 增量模式：datetimeLast 沒變的測站沿用既有 feature
+    existing = load_existing(output) if incremental else {}
     features = []
     total_stations = 0
     filtered_stations = 0
+    reused = 0
 
-    while True:
-        print(f"Fetching page {page}...")
-        resp = requests.get(
-            API_URL,
-            headers={"x-api-key": API_KEY},
-            params={"countries_id": 155, "limit": limit, "page": page}
-        )
-        if resp.status_code != 200:
-            raise Exception(f"API error: {resp.status_code} {resp.text}")
+    for station in stations:
+        total_stations += 1
+        coords = station.get("coordinates")
+        datetime_last = station.get("datetimeLast")
 
-        data = resp.json()
-        results = data.get("results", [])
+        # 檢查是否有座標和最近的資料
+        if not coords:
+            continue
 
-        if not results:
-            break
+        # 過濾掉不是最近5天內的資料
+        if not is_recent_data(datetime_last, days=5):
+            filtered_stations += 1
+            continue
 
-        for station in results:
-            total_stations += 1
-            coords = station.get("coordinates")
-            datetime_last = station.get("datetimeLast")
-            
-            # 檢查是否有座標和最近的資料
-            if not coords:
-                continue
-                
-            # 過濾掉不是最近5天內的資料
-            if not is_recent_data(datetime_last, days=5):
-                filtered_stations += 1
-                continue
-            
-            # 提取 sensors 資訊
-            sensors = []
-            for sensor in station.get("sensors", []):
-                parameter = sensor.get("parameter", {})
-                sensors.append({
-                    "id": sensor.get("id"),
-                    "name": sensor.get("name"),
-                    "parameter_id": parameter.get("id"),
-                    "parameter_name": parameter.get("name"),
-                    "parameter_units": parameter.get("units"),
-                    "parameter_display_name": parameter.get("displayName")
-                })
-
-            features.append({
-                "type": "Feature",
-                "properties": {
-                    "id": station["id"],
-                    "name": station["name"],
-                    "provider": station.get("provider", {}).get("name"),
-                    "provider_id": station.get("provider", {}).get("id"),
-                    "timezone": station.get("timezone"),
-                    "country": station.get("country", {}).get("name"),
-                    "country_id": station.get("country", {}).get("id"),
-                    "country_code": station.get("country", {}).get("code"),
-                    "owner": station.get("owner", {}).get("name"),
-                    "owner_id": station.get("owner", {}).get("id"),
-                    "is_mobile": station.get("isMobile", False),
-                    "is_monitor": station.get("isMonitor", False),
-                    "sensors": sensors,
-                    "sensor_count": len(sensors),
-                    "datetime_first": station.get("datetimeFirst"),
-                    "datetime_last": station.get("datetimeLast")
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": [
-                        coords["longitude"],
-                        coords["latitude"]
-                    ]
-                }
-            })
-
-        # 如果少於 limit，表示到最後一頁
-        if len(results) < limit:
-            break
-
-        page += 1
+        previous = existing.get(station["id"])
+        if previous and previous["properties"].get("datetime_last") == datetime_last:
+            features.append(previous)
+            reused += 1
+        else:
+            features.append(station_feature(station))
 
     geojson = {
         "type": "FeatureCollection",
         "features": features
     }
 
+    print(f"Total stations processed: {total_stations}")
+    print(f"Stations filtered out (older than 5 days): {filtered_stations}")
+    print(f"Active stations: {len(features)}")
+    if incremental:
+        ids = {f["properties"]["id"] for f in features}
+        print(f"Unchanged: {reused}, new or updated: {len(features) - reused}, "
+              f"removed: {len(set(existing) - ids)}")
+        if reused == len(features) == len(existing):
+            print(f"Nothing changed, {output} left as is ({time.monotonic() - started:.1f}s)")
+            return
+
     # 確保 data 資料夾存在
-    os.makedirs(data_dir, exist_ok=True)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
 
-    with open(OUTPUT_FILE, "w") as f:
-        json.dump(geojson, f, indent=2)
+    # 前端直接讀取，不需要縮排；先寫暫存檔再換名，避免前端讀到寫到一半的檔案
+    tmp_path = output + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(geojson, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, output)
 
-    print(f"Total stations processed: {total_stations}")
-    print(f"Stations filtered out (older than 5 days): {filtered_stations}")
-    print(f"Active stations saved: {len(features)}")
-    print(f"Saved to {OUTPUT_FILE}")
+    print(f"Saved to {output} ({time.monotonic() - started:.1f}s)")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Fetch active OpenAQ locations in the US as GeoJSON.")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                    help=f"同時抓取的頁數 (預設 {CONCURRENCY})")
+    ap.add_argument("--incremental", action="store_true",
+                    help="只更新 datetimeLast 有變的測站，沒有任何變更時不重寫輸出檔")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="輸出的 GeoJSON 路徑")
+    args = ap.parse_args()
+    fetch_us_stations(args.output, args.concurrency, args.incremental)
 
 
 if __name__ == "__main__":
-    fetch_us_stations()
\ No newline at end of file
+    main()
@@ -1,180 +1,368 @@
-import re
-import time
-import json
-import os
-from urllib.parse import urljoin
-import requests
-from bs4 import BeautifulSoup
-
-BASE = "https://data.hetzner.pandonia-global-network.org/"
-ROOT = BASE
-
-session = requests.Session()
-session.headers.update({"User-Agent": "pandora-l2-geojson/1.0"})
-TIMEOUT = 30
-
-# Setting the output file path
-script_dir = os.path.dirname(os.path.abspath(__file__))
-project_root = os.path.dirname(script_dir)
-data_dir = os.path.join(project_root, "public", "data")
-OUTPUT_FILE = os.path.join(data_dir, "pandora-us-stations.geojson")
-
-# Regular expressions to extract latitude and longitude
-LAT_PATS = [
-    re.compile(r"(?i)\blat(?:itude)?\s*[:=]\s*([+-]?\d+(?:\.\d+)?)"),
-]
-LON_PATS = [
-    re.compile(r"(?i)\blon(?:g(?:itude)?)?\s*[:=]\s*([+-]?\d+(?:\.\d+)?)"),
-]
-PAIR_PATS = [
-    re.compile(r"(?i)location[^0-9+-]*([+-]?\d+(?:\.\d+)?)\s*[, ]\s*([+-]?\d+(?:\.\d+)?)"),
-    re.compile(r"(?i)latitude[^0-9+-]*([+-]?\d+(?:\.\d+)?).{0,40}?longitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)"),
-]
-
-# Fetch and parse HTML from a URL
-def get_soup(url):
-    r = session.get(url, timeout=TIMEOUT)
-    r.raise_for_status()
-    return BeautifulSoup(r.text, "html.parser")
-
-# Get list of directories from a URL
-def list_dirs(url):
-    soup = get_soup(url)
-    dirs = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href in ("../", "./"):
-            continue
-        if href.endswith("/"):
-            dirs.append(urljoin(url, href))    
-    return dirs
-
-# Get list of files with a specific suffix from a URL
-def list_files(url, suffix=".txt"):
-    soup = get_soup(url)
-    files = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-        if href.endswith(suffix):
-            files.append(urljoin(url, href))
-    return files
-
-# Fetch the beginning of a text file (up to max_bytes)
-def fetch_text_head(url, max_bytes=100_000):
-    r = session.get(url, timeout=TIMEOUT, stream=True)
-    r.raise_for_status()
-    data = r.raw.read(max_bytes, decode_content=True)
-    try:
-        return data.decode("utf-8", errors="ignore")
-    except:
-        return data.decode("latin-1", errors="ignore")
-
-# Parse latitude and longitude from text
-def parse_latlon(text):
-    for pat in PAIR_PATS:
-        m = pat.search(text)
-        if m:
-            return float(m.group(1)), float(m.group(2)), "PAIR"
-    lat = lon = None
-    for pat in LAT_PATS:
-        m = pat.search(text)
-        if m:
-            lat = float(m.group(1)); break
-    for pat in LON_PATS:
-        m = pat.search(text)
-        if m:
-            lon = float(m.group(1)); break
-    if lat is not None and lon is not None:
-        return lat, lon, "SINGLE_FIELDS"
-    header = "\n".join(text.splitlines()[:200])
-    m1 = re.search(r"(?i)Latitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)", header)
-    m2 = re.search(r"(?i)Longitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)", header)
-    if m1 and m2:
-        return float(m1.group(1)), float(m2.group(1)), "HEADER_FIELDS"
-    return None, None, "NOT_FOUND"
-
-# Output name 
-def station_name_from_url(u):
-    return u.strip("/").split("/")[-1]
-
-# Output instrument name
-def instrument_name_from_url(u):
-    return u.strip("/").split("/")[-1]
-
-# Check if coordinates are in North America
-def is_north_america(lat, lon):
-    return 5 <= lat <= 83 and -170 <= lon <= -50
-
-def main():
-    # List all station directories
-    station_dirs = list_dirs(ROOT)
-
-    # Iterate over stations and their Pandora instruments
-    features = []
-    skipped = []
-    for sdir in sorted(station_dirs):
-        station = station_name_from_url(sdir)
-        try:
-            subdirs = list_dirs(sdir)
-            pandora_dirs = [d for d in subdirs if re.search(r"/Pandora\d+(?:s\d+)?/$", d)]
-            if not pandora_dirs:
-                skipped.append((station, "", "NO_PANDORA_DIR"))
-                continue
-
-            for pdir in sorted(pandora_dirs):
-                l2_dir = urljoin(pdir, "L2/")
-                try:
-                    l2_files = list_files(l2_dir, suffix=".txt")
-                except requests.HTTPError:
-                    skipped.append((station, instrument_name_from_url(pdir), "NO_L2_DIR"))
-                    continue
-
-                if not l2_files:
-                    skipped.append((station, instrument_name_from_url(pdir), "NO_TXT_IN_L2"))
-                    continue
-
-                first_txt = sorted(l2_files)[0]
-                head = fetch_text_head(first_txt)
-                lat, lon, how = parse_latlon(head)
-
-                # Validate coordinates
-                if lat is None or lon is None:
-                    skipped.append((station, instrument_name_from_url(pdir), "NOT_FOUND"))
-                    continue
-                
-                # Check if in North America
-                if not is_north_america(lat, lon):
-                    skipped.append((station, instrument_name_from_url(pdir), "OUTSIDE_NA"))
-                    continue
-
-                feat = {
-                    "type": "Feature",
-                    "geometry": {
-                        "type": "Point",
-                        "coordinates": [float(lon), float(lat)]  # GeoJSON: [lon, lat]
-                    },
-                    "properties": {
-                        "station": station,
-                        "instrument": instrument_name_from_url(pdir),
-                    }
-                }
-                features.append(feat)
-                time.sleep(0.15)  # 禮貌性延遲
-
-        except requests.HTTPError as e:
-            skipped.append((station, "", f"HTTP_ERROR:{e.response.status_code}"))
-        except Exception as e:
-            skipped.append((station, "", f"ERROR:{e}"))
-
-    geojson_obj = {
-        "type": "FeatureCollection",
-        "features": features
-    }
-
-    # Output GeoJSON file
-    OUT_GEOJSON = OUTPUT_FILE
-    with open(OUT_GEOJSON, "w", encoding="utf-8") as f:
-        json.dump(geojson_obj, f, ensure_ascii=False, indent=2)
-
-if __name__ == "__main__":
-    main()
+import re
+import time
+import json
+import os
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin, urlparse
+import requests
+from bs4 import BeautifulSoup
+
+BASE = os.environ.get("PANDORA_BASE_URL", "https://data.hetzner.pandonia-global-network.org/")
+ROOT = BASE
+
+# Number of directory listings / file heads fetched at the same time
+CONCURRENCY = int(os.environ.get("PANDORA_CONCURRENCY", 8))
+# Politeness limit per host: sustained requests per second and burst size (0 = unlimited)
+RATE_LIMIT = float(os.environ.get("PANDORA_RATE_LIMIT", 10))
+RATE_BURST = int(os.environ.get("PANDORA_RATE_BURST", 10))
+
+session = requests.Session()
+session.headers.update({"User-Agent": "pandora-l2-geojson/1.0"})
+# Keep one pooled connection per worker thread
+session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=CONCURRENCY))
+session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=CONCURRENCY))
+TIMEOUT = 30
+
+# Setting the output file path
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+data_dir = os.path.join(project_root, "public", "data")
+OUTPUT_FILE = os.path.join(data_dir, "pandora-us-stations.geojson")
+# Parsed coordinates of each L2 file, revalidated with ETag / Last-Modified on the next run
+CACHE_FILE = os.environ.get("PANDORA_CACHE_FILE", os.path.join(project_root, ".cache", "pandora", "coords.json"))
+
+# Regular expressions to extract latitude and longitude
+# The L2 header spells out the location as "Location latitude [deg]: 40.0375"
+HEADER_PATS = (
+    re.compile(r"(?im)^Location latitude \[deg\]:\s*([+-]?\d+(?:\.\d+)?)"),
+    re.compile(r"(?im)^Location longitude \[deg\]:\s*([+-]?\d+(?:\.\d+)?)"),
+)
+# The header ends at the first line of dashes (column descriptions and data follow)
+HEADER_END = re.compile(rb"^-{5,}\s*$")
+LAT_PATS = [
+    re.compile(r"(?i)\blat(?:itude)?\s*[:=]\s*([+-]?\d+(?:\.\d+)?)"),
+]
+LON_PATS = [
+    re.compile(r"(?i)\blon(?:g(?:itude)?)?\s*[:=]\s*([+-]?\d+(?:\.\d+)?)"),
+]
+PAIR_PATS = [
+    re.compile(r"(?i)location[^0-9+-]*([+-]?\d+(?:\.\d+)?)\s*[, ]\s*([+-]?\d+(?:\.\d+)?)"),
+    re.compile(r"(?i)latitude[^0-9+-]*([+-]?\d+(?:\.\d+)?).{0,40}?longitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)"),
+]
+
+# Token bucket shared by all threads talking to one host
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    # Block until a request may be sent
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+# Wait for the per-host rate limiter before requesting url
+def throttle(url):
+    host = urlparse(url).netloc
+    with _buckets_lock:
+        bucket = _buckets.get(host)
+        if bucket is None:
+            bucket = _buckets[host] = TokenBucket(RATE_LIMIT, RATE_BURST)
+    bucket.acquire()
+
+# Fetch and parse HTML from a URL
+def get_soup(url):
+    throttle(url)
+    r = session.get(url, timeout=TIMEOUT)
+    r.raise_for_status()
+    return BeautifulSoup(r.text, "html.parser")
+
+# Get list of directories from a URL
+def list_dirs(url):
+    soup = get_soup(url)
+    dirs = []
+    for a in soup.find_all("a", href=True):
+        href = a["href"]
+        if href in ("../", "./"):
+            continue
+        if href.endswith("/"):
+            dirs.append(urljoin(url, href))    
+    return dirs
+
+# Get list of files with a specific suffix from a URL
+def list_files(url, suffix=".txt"):
+    soup = get_soup(url)
+    files = []
+    for a in soup.find_all("a", href=True):
+        href = a["href"]
+        if href.endswith(suffix):
+            files.append(urljoin(url, href))
+    return files
+
+# Decode header bytes
+def decode_text(data):
+    try:
+        return data.decode("utf-8", errors="ignore")
+    except:
+        return data.decode("latin-1", errors="ignore")
+
+# Stream an L2 file only up to its header separator line (at most max_bytes)
+# cached: previous cache entry; its ETag / Last-Modified make the request conditional
+# Returns (header text or None when unchanged (304), validators, bytes read)
+def fetch_l2_header(url, cached=None, max_bytes=100_000, chunk_size=2048):
+    headers = {}
+    if cached and cached.get("etag"):
+        headers["If-None-Match"] = cached["etag"]
+    if cached and cached.get("last_modified"):
+        headers["If-Modified-Since"] = cached["last_modified"]
+    throttle(url)
+    with session.get(url, headers=headers, timeout=TIMEOUT, stream=True) as r:
+        if r.status_code == 304:
+            return None, cached, 0
+        r.raise_for_status()
+        validators = {"etag": r.headers.get("ETag"), "last_modified": r.headers.get("Last-Modified")}
+        buf = b""
+        lines = []
+        nread = 0
+        # Closing the response before the body is exhausted drops the rest of the file
+        for chunk in r.iter_content(chunk_size=chunk_size):
+            nread += len(chunk)
+            *complete, buf = (buf + chunk).split(b"\n")
+            for line in complete:
+                if HEADER_END.match(line):
+                    return decode_text(b"\n".join(lines)), validators, nread
+                lines.append(line)
+            if nread >= max_bytes:
+                break
+    # No separator within max_bytes: fall back to whatever was read
+    return decode_text(b"\n".join(lines + [buf])), validators, nread
+
+# Parse latitude and longitude from text
+def parse_latlon(text):
+    m1, m2 = (pat.search(text) for pat in HEADER_PATS)
+    if m1 and m2:
+        return float(m1.group(1)), float(m2.group(1)), "L2_HEADER"
+    for pat in PAIR_PATS:
+        m = pat.search(text)
+        if m:
+            return float(m.group(1)), float(m.group(2)), "PAIR"
+    lat = lon = None
+    for pat in LAT_PATS:
+        m = pat.search(text)
+        if m:
+            lat = float(m.group(1)); break
+    for pat in LON_PATS:
+        m = pat.search(text)
+        if m:
+            lon = float(m.group(1)); break
+    if lat is not None and lon is not None:
+        return lat, lon, "SINGLE_FIELDS"
+    header = "\n".join(text.splitlines()[:200])
+    m1 = re.search(r"(?i)Latitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)", header)
+    m2 = re.search(r"(?i)Longitude[^0-9+-]*([+-]?\d+(?:\.\d+)?)", header)
+    if m1 and m2:
+        return float(m1.group(1)), float(m2.group(1)), "HEADER_FIELDS"
+    return None, None, "NOT_FOUND"
+
+# Output name 
+def station_name_from_url(u):
+    return u.strip("/").split("/")[-1]
+
+# Output instrument name
+def instrument_name_from_url(u):
+    return u.strip("/").split("/")[-1]
+
+# Check if coordinates are in North America
+def is_north_america(lat, lon):
+    return 5 <= lat <= 83 and -170 <= lon <= -50
+
+# List the Pandora instrument directories of one station
+def crawl_station(sdir):
+    station = station_name_from_url(sdir)
+    try:
+        subdirs = list_dirs(sdir)
+    except requests.HTTPError as e:
+        return station, [], (station, "", f"HTTP_ERROR:{e.response.status_code}")
+    except Exception as e:
+        return station, [], (station, "", f"ERROR:{e}")
+    pandora_dirs = [d for d in subdirs if re.search(r"/Pandora\d+(?:s\d+)?/$", d)]
+    if not pandora_dirs:
+        return station, [], (station, "", "NO_PANDORA_DIR")
+    return station, sorted(pandora_dirs), None
+
+# On-disk cache of parsed coordinates:
+# {"files": {L2 file URL: {etag, last_modified, lat, lon, how}}, "instruments": {L2 dir URL: first L2 file URL}}
+def load_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        cache = {}
+    return {"files": cache.get("files", {}), "instruments": cache.get("instruments", {})}
+
+def save_cache(path, cache):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+# Read (or revalidate) the header of one L2 file
+# Returns (cache entry, "cached" when the server answered 304 else "fetched", header bytes read)
+def read_l2_coords(url, cached=None):
+    text, validators, nread = fetch_l2_header(url, cached)
+    if text is None:
+        return cached, "cached", 0
+    lat, lon, how = parse_latlon(text)
+    return dict(validators, lat=lat, lon=lon, how=how), "fetched", nread
+
+# Read the coordinates of one instrument from the header of its first L2 file
+# Returns (feature, None, stats) or (None, skipped entry, stats)
+# stats = (L2 dir, file url, cache entry, "cached" / "fetched", header bytes read) or None
+def crawl_instrument(station, pdir, cache):
+    instrument = instrument_name_from_url(pdir)
+    l2_dir = urljoin(pdir, "L2/")
+    try:
+        first_txt = cache["instruments"].get(l2_dir)
+        result = None
+        if first_txt in cache["files"]:
+            # Known instrument: revalidate its file directly instead of listing L2/ again
+            try:
+                result = read_l2_coords(first_txt, cache["files"][first_txt])
+            except requests.HTTPError:
+                # The file is gone: fall back to listing the directory
+                pass
+
+        if result is None:
+            try:
+                l2_files = list_files(l2_dir, suffix=".txt")
+            except requests.HTTPError:
+                return None, (station, instrument, "NO_L2_DIR"), None
+
+            if not l2_files:
+                return None, (station, instrument, "NO_TXT_IN_L2"), None
+
+            first_txt = sorted(l2_files)[0]
+            result = read_l2_coords(first_txt, cache["files"].get(first_txt))
+    except requests.HTTPError as e:
+        return None, (station, instrument, f"HTTP_ERROR:{e.response.status_code}"), None
+    except Exception as e:
+        return None, (station, instrument, f"ERROR:{e}"), None
+    entry, how, nread = result
+    stats = (l2_dir, first_txt, entry, how, nread)
+    lat, lon = entry["lat"], entry["lon"]
+
+    # Validate coordinates
+    if lat is None or lon is None:
+        return None, (station, instrument, "NOT_FOUND"), stats
+
+    # Check if in North America
+    if not is_north_america(lat, lon):
+        return None, (station, instrument, "OUTSIDE_NA"), stats
+
+    feat = {
+        "type": "Feature",
+        "geometry": {
+            "type": "Point",
+            "coordinates": [float(lon), float(lat)]  # GeoJSON: [lon, lat]
+        },
+        "properties": {
+            "station": station,
+            "instrument": instrument,
+        }
+    }
+    return feat, None, stats
+
+# Crawl all stations with a bounded thread pool; requests to each host go through its token bucket
+# Returns the features, the skipped entries, counts and the cache rebuilt from the files this crawl saw
+def crawl(root=ROOT, concurrency=CONCURRENCY, cache=None):
+    cache = cache or {"files": {}, "instruments": {}}
+    # List all station directories
+    station_dirs = sorted(list_dirs(root))
+
+    features = []
+    skipped = []
+    counts = {"stations": len(station_dirs), "instruments": 0, "cached": 0, "fetched": 0, "bytes": 0}
+    # Removed instruments drop out of the cache
+    fresh = {"files": {}, "instruments": {}}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        # Station listings in parallel, then every Pandora instrument in parallel
+        instruments = []
+        for station, pandora_dirs, skip in pool.map(crawl_station, station_dirs):
+            if skip:
+                skipped.append(skip)
+            instruments.extend((station, pdir) for pdir in pandora_dirs)
+        counts["instruments"] = len(instruments)
+
+        # map keeps the sequential (station, instrument) order in the output
+        for feat, skip, stats in pool.map(lambda item: crawl_instrument(*item, cache), instruments):
+            if feat:
+                features.append(feat)
+            else:
+                skipped.append(skip)
+            if stats:
+                l2_dir, first_txt, entry, how, nread = stats
+                fresh["instruments"][l2_dir] = first_txt
+                fresh["files"][first_txt] = entry
+                counts[how] += 1
+                counts["bytes"] += nread
+    return features, skipped, counts, fresh
+
+def main():
+    global RATE_LIMIT, RATE_BURST
+    ap = argparse.ArgumentParser(description="Crawl Pandora L2 directories and export North American stations as GeoJSON.")
+    ap.add_argument("--base", default=ROOT,
+                    help="目錄清單的根網址 (可指向本機替身，例如 pandora_mock_server.py)")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY,
+                    help=f"同時進行的請求數 (預設 {CONCURRENCY})")
+    ap.add_argument("--rate", type=float, default=RATE_LIMIT,
+                    help=f"每個主機每秒最多請求數 (預設 {RATE_LIMIT:g}，0 表示不限制)")
+    ap.add_argument("--burst", type=int, default=RATE_BURST,
+                    help=f"每個主機可連續送出的請求數 (預設 {RATE_BURST})")
+    ap.add_argument("--output", default=OUTPUT_FILE, help="輸出的 GeoJSON 路徑")
+    ap.add_argument("--cache", default=CACHE_FILE, help="座標快取檔 (依 ETag / Last-Modified 重新驗證)")
+    ap.add_argument("--no-cache", action="store_true", help="忽略既有快取，重新讀取每個 L2 檔頭")
+    args = ap.parse_args()
+    RATE_LIMIT, RATE_BURST = args.rate, args.burst
+
+    cache = None if args.no_cache else load_cache(args.cache)
+    started = time.monotonic()
+    features, skipped, counts, cache = crawl(args.base, args.concurrency, cache)
+    elapsed = time.monotonic() - started
+    save_cache(args.cache, cache)
+
+    geojson_obj = {
+        "type": "FeatureCollection",
+        "features": features
+    }
+
+    # Output GeoJSON file
+    OUT_GEOJSON = args.output
+    os.makedirs(os.path.dirname(os.path.abspath(OUT_GEOJSON)), exist_ok=True)
+    with open(OUT_GEOJSON, "w", encoding="utf-8") as f:
+        json.dump(geojson_obj, f, ensure_ascii=False, indent=2)
+
+    print(f"✔ 完成：{OUT_GEOJSON}（{counts['stations']} 個測站、{counts['instruments']} 台儀器，features: {len(features)}，"
+          f"略過 {len(skipped)}，耗時 {elapsed:.1f}s）")
+    print(f"  L2 檔頭：快取未變更 {counts['cached']}，重新讀取 {counts['fetched']}（{counts['bytes'] / 1024:.1f} KB）")
+
+if __name__ == "__main__":
+    main()
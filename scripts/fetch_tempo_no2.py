@@ -1,43 +1,58 @@
 import requests
 import os
+import argparse
+import json
+import re
+import sys
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from datetime import datetime, timezone
+from queue import Queue
 from pathlib import Path
 from urllib.parse import urlparse
 import getpass
 import xarray as xr
 import rasterio
+import rasterio.shutil
 from rasterio.transform import from_bounds
 from rasterio.crs import CRS
+from rasterio.windows import Window
 import numpy as np
 import subprocess
 
+import tempo_colorize
+import tempo_auth
+import tempo_composite
+import tempo_contours
+import tempo_download
+import tempo_metrics
+import tempo_products
+import tempo_state
+import tempo_stations
+import tempo_tiler
 
-def _build_color_ramp():
-    """建立 0-255 的平滑顏色表 (RGBA)。"""
-    anchors = [
-        (0, (0, 0, 0, 0)),            # 透明背景
-        (1, (0, 0, 140, 255)),        # 深藍
-        (64, (0, 120, 255, 255)),     # 藍
-        (128, (0, 255, 170, 255)),    # 綠
-        (192, (255, 255, 0, 255)),    # 黃
-        (255, (255, 0, 0, 255)),      # 紅
-    ]
-
-    ramp = {}
-    for (start_idx, start_col), (end_idx, end_col) in zip(anchors[:-1], anchors[1:]):
-        span = max(end_idx - start_idx, 1)
-        for i in range(span):
-            t = i / span
-            rgba = tuple(
-                int(round(start_col[channel] + t * (end_col[channel] - start_col[channel])))
-                for channel in range(4)
-            )
-            ramp[start_idx + i] = rgba
-    ramp[anchors[-1][0]] = anchors[-1][1]
-    return ramp
 
 # 允許透過環境變數覆寫 NetCDF 引擎，預設沿用 h5netcdf 以支援 NetCDF4 群組
 NETCDF_ENGINE = os.environ.get("TEMPO_NETCDF_ENGINE", "h5netcdf")
 
+# 跨次執行的快取目錄 (檔案結構探測結果等)
+CACHE_DIR = Path(os.environ.get("TEMPO_CACHE_DIR", "../.cache/tempo"))
+
+# --tile-archive 未指定路徑時的 PMTiles 輸出位置
+DEFAULT_TILE_ARCHIVE = "../public/tempo/tempo_no2.pmtiles"
+# --data-tiles 未指定路徑時的數值編碼 tile 目錄
+DEFAULT_DATA_TILES_DIR = "../public/tempo/data-tiles"
+# 每個 granule 在所有測站取樣的 NO2 數值
+DEFAULT_STATION_SAMPLES = "../public/tempo/stations.json"
+# --composites 未指定路徑時 rolling mean / max 合成 tiles 的輸出位置
+DEFAULT_COMPOSITES_DIR = "../public/tempo/composites"
+# --contours 未指定路徑時等值帶向量圖層 (各 zoom 的 GeoJSON) 的輸出位置
+DEFAULT_CONTOURS_DIR = "../public/tempo/contours"
+# 各階段量測結果 (JSON lines) 與 --profile 的 cProfile 輸出位置
+DEFAULT_METRICS_FILE = CACHE_DIR / "metrics.jsonl"
+DEFAULT_PROFILE_DIR = CACHE_DIR / "profiles"
+
 # 載入 .env 檔案的簡單實作
 def load_env_file():
     """簡單的 .env 檔案載入器"""
@@ -64,196 +79,170 @@ def load_env_file():
 # 載入環境變數
 load_env_file()
 
-CMR_URL = "https://cmr.earthdata.nasa.gov/search/granules.json"
+# CMR 搜尋服務的位置 (可指向 tempo_mock_server.py 在無網路環境下測試)
+CMR_SEARCH_URL = os.environ.get("TEMPO_CMR_URL", "https://cmr.earthdata.nasa.gov/search").rstrip("/")
+CMR_URL = f"{CMR_SEARCH_URL}/granules.json"
+CMR_UMM_URL = f"{CMR_SEARCH_URL}/granules.umm_json"
+GRANULE_TIME_RE = re.compile(r"(\d{8}T\d{6}Z)")
+NO2 = tempo_products.PRODUCTS["no2"]
 PARAMS = {
-    "echo_collection_id": "C3685668637-LARC_CLOUD",  # TEMPO NO2 Gridded 新集合
+    "echo_collection_id": NO2.collection_id,  # TEMPO NO2 Gridded 新集合
     "sort_key": "-start_date",
     "page_size": 1,  # 只要最新一筆
 }
 
 # NASA Earthdata 認證
-def get_earthdata_session():
-    """取得已認證的 requests session，處理 NASA Earthdata 的重定向認證流程"""
-    session = requests.Session()
-    
+@tempo_metrics.instrument("auth")
+def get_earthdata_session(pool_size=None):
+    """取得已認證的 session (tempo_auth.EarthdataSession)
+
+    token 或 URS cookie 快取在 CACHE_DIR，之後的執行直接沿用，只有收到 401 才重新認證。
+    pool_size 為連線池大小，須容納所有同時進行的下載連線 (tempo_download.pool_size)。
+    """
     # 1. 先嘗試從環境變數讀取
     username = os.getenv('EARTHDATA_USERNAME')
     password = os.getenv('EARTHDATA_PASSWORD')
-    
+    session = tempo_auth.EarthdataSession(username, password, cache_dir=CACHE_DIR,
+                                          pool_size=pool_size or tempo_download.pool_size())
+
     if username and password:
         print("使用環境變數中的 Earthdata 認證")
-    else:
+    elif session.credentials:
         # 2. 檢查是否有 .netrc 檔案
-        netrc_file = Path.home() / '.netrc'
-        
-        if netrc_file.exists():
-            print("找到 .netrc 檔案，使用現有認證")
-            # 如果有 .netrc，requests 會自動使用它
-        else:
-            # 3. 如果都沒有，提示用戶輸入帳號密碼
-            print("需要 NASA Earthdata 登入資訊")
-            print("請到 https://urs.earthdata.nasa.gov/ 註冊帳號")
-            print("或在 .env 檔案中設定 EARTHDATA_USERNAME 和 EARTHDATA_PASSWORD")
-            
-            username = input("輸入 Earthdata 用戶名: ")
-            password = getpass.getpass("輸入 Earthdata 密碼: ")
-    
-    # 設定認證到 URS (Earthdata 認證系統)
-    if username and password:
-        session.auth = (username, password)
-    
-    # 重要：讓 session 自動處理重定向和 cookies
-    session.max_redirects = 10
-    
-    # 設定 User-Agent，某些服務需要
-    session.headers.update({
-        'User-Agent': 'Aircast/1.0 (Python requests)'
-    })
-    
-    # 測試認證是否有效
-    test_url = "https://urs.earthdata.nasa.gov/profile"
-    try:
-        response = session.get(test_url, timeout=30)
-        if response.status_code == 200:
-            print("✓ Earthdata 認證成功")
-        else:
-            print(f"⚠ Earthdata 認證可能有問題 (狀態碼: {response.status_code})")
-    except Exception as e:
-        print(f"⚠ 測試認證時發生錯誤: {e}")
-    
-    return session
+        print("找到 .netrc 檔案，使用現有認證")
+    elif not session.has_cached_token():
+        # 3. 如果都沒有 (也沒有快取的 token)，提示用戶輸入帳號密碼
+        print("需要 NASA Earthdata 登入資訊")
+        print("請到 https://urs.earthdata.nasa.gov/ 註冊帳號")
+        print("或在 .env 檔案中設定 EARTHDATA_USERNAME 和 EARTHDATA_PASSWORD")
 
-def convert_nc_to_geotiff(nc_file_path, output_dir="../public/tempo/geotiff"):
-    """將 NetCDF 檔案轉換為 GeoTIFF"""
-    
-    print(f"\n開始轉換 NetCDF 到 GeoTIFF...")
-    print(f"輸入檔案: {nc_file_path}")
-    
-    # 創建輸出目錄
-    output_path = Path(output_dir)
-    output_path.mkdir(parents=True, exist_ok=True)
-    
-    try:
-        # 先從根層取得座標資訊
-        with xr.open_dataset(nc_file_path, engine=NETCDF_ENGINE) as root_ds:
-            print(f"根層變數: {list(root_ds.variables.keys())}")
-
-            if 'latitude' in root_ds and 'longitude' in root_ds:
-                lat_name, lon_name = 'latitude', 'longitude'
-            elif 'lat' in root_ds and 'lon' in root_ds:
-                lat_name, lon_name = 'lat', 'lon'
-            else:
-                print(f"可用座標: {list(root_ds.variables.keys())}")
-                raise ValueError("找不到緯度和經度座標")
-
-            lats = root_ds[lat_name].values
-            lons = root_ds[lon_name].values
-
-        # 依序嘗試候選的 NO2 變數 (group, variable)
-        candidate_vars = [
-            ('product', 'vertical_column_troposphere'),
-            ('support_data', 'vertical_column_total'),
-            (None, 'vertical_column_troposphere'),
-            (None, 'vertical_column_total'),
-            ('product', 'vertical_column_troposphere_uncertainty'),
-            ('support_data', 'fitted_slant_column'),
-        ]
+        username = input("輸入 Earthdata 用戶名: ")
+        password = getpass.getpass("輸入 Earthdata 密碼: ")
+        session.credentials = (username, password)
 
-        data = None
-        for group_name, var_name in candidate_vars:
+    return session.login()
+
+# 依序嘗試候選的 NO2 變數 (group, variable)；其他產品見 tempo_products
+NO2_CANDIDATE_VARS = NO2.candidate_vars
+
+# 依 collection ID 快取 NetCDF 的結構 (NO2 所在 group/變數與經緯度名稱)
+LAYOUT_CACHE_FILE = CACHE_DIR / "nc_layouts.json"
+_layout_cache = None
+
+def _load_layout_cache():
+    global _layout_cache
+    if _layout_cache is None:
+        _layout_cache = {}
+        if LAYOUT_CACHE_FILE.exists():
             try:
-                if group_name is None:
-                    group_ds = xr.open_dataset(
-                        nc_file_path,
-                        engine=NETCDF_ENGINE,
-                    )
-                else:
-                    group_ds = xr.open_dataset(
-                        nc_file_path,
-                        group=group_name,
-                        engine=NETCDF_ENGINE,
-                    )
-            except OSError:
-                continue
+                _layout_cache = json.loads(LAYOUT_CACHE_FILE.read_text())
+            except (OSError, ValueError) as e:
+                print(f"⚠ 無法讀取結構快取，重新探測: {e}")
+    return _layout_cache
 
-            if var_name in group_ds.data_vars:
-                data = group_ds[var_name].load()
-                print(f"使用 NO2 變數: {var_name} (group='{group_name}')")
-                group_ds.close()
-                break
+def _save_layout_cache():
+    # --products 時每個產品的 worker process 各有一份快取：先合併磁碟上其他 process 寫入的結構，
+    # 再以暫存檔 + os.replace 寫入，避免最後完成的產品蓋掉其他產品的結構或留下寫到一半的檔案
+    try:
+        merged = json.loads(LAYOUT_CACHE_FILE.read_text()) if LAYOUT_CACHE_FILE.exists() else {}
+    except (OSError, ValueError):
+        merged = {}
+    merged.update(_layout_cache)
+    _layout_cache.update(merged)
+    try:
+        LAYOUT_CACHE_FILE.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = LAYOUT_CACHE_FILE.with_name(f"{LAYOUT_CACHE_FILE.name}.{os.getpid()}.tmp")
+        tmp_path.write_text(json.dumps(merged, indent=2))
+        os.replace(tmp_path, LAYOUT_CACHE_FILE)
+    except OSError as e:
+        print(f"⚠ 無法寫入結構快取: {e}")
 
-            group_ds.close()
+def _layout_matches(tree, layout):
+    """確認快取的結構在這個檔案中仍然成立"""
+    group_name = layout['group']
+    if group_name and group_name not in tree.children:
+        return False
+    node = tree[group_name] if group_name else tree
+    return (layout['variable'] in node.data_vars
+            and layout['lat'] in tree.variables
+            and layout['lon'] in tree.variables)
 
-        if data is None:
-            raise ValueError("找不到可用的 NO2 變數，請檢查 NetCDF 檔案內容")
+def probe_nc_layout(tree, candidate_vars=None):
+    """在已開啟的 DataTree 中找出資料變數 (預設 NO2) 所在的 group 與經緯度座標名稱"""
+    if 'latitude' in tree.variables and 'longitude' in tree.variables:
+        lat_name, lon_name = 'latitude', 'longitude'
+    elif 'lat' in tree.variables and 'lon' in tree.variables:
+        lat_name, lon_name = 'lat', 'lon'
+    else:
+        print(f"可用座標: {list(tree.variables.keys())}")
+        raise ValueError("找不到緯度和經度座標")
 
-        print(f"數據形狀: {data.shape}")
-        print(f"數據維度: {data.dims}")
+    for group_name, var_name in candidate_vars or NO2_CANDIDATE_VARS:
+        if group_name is not None and group_name not in tree.children:
+            continue
+        node = tree[group_name] if group_name else tree
+        if var_name in node.data_vars:
+            return {'group': group_name, 'variable': var_name, 'lat': lat_name, 'lon': lon_name}
 
-        # 如果數據有時間維度，取第一個時間點
-        if 'time' in data.dims:
-            data = data.isel(time=0)
-            print("選擇第一個時間點")
-        
-        # 如果還有其他維度，取第一個
-        while len(data.dims) > 2:
-            dim_to_remove = [d for d in data.dims if d not in ['latitude', 'longitude', 'lat', 'lon']][0]
-            data = data.isel({dim_to_remove: 0})
-            print(f"移除維度: {dim_to_remove}")
-        
-        # 獲取數據數值
-        data_values = data.values
-        
-        # 處理無效值
-        data_values = np.where(np.isfinite(data_values), data_values, np.nan)
-        
-        # 確保維度順序正確 (lat, lon)
-        if data.dims[0] == 'longitude' or data.dims[0] == 'lon':
-            data_values = data_values.T
-            lats, lons = lons, lats
-        
-        print(f"最終數據形狀: {data_values.shape}")
-        print(f"緯度範圍: {np.nanmin(lats):.3f} 到 {np.nanmax(lats):.3f}")
-        print(f"經度範圍: {np.nanmin(lons):.3f} 到 {np.nanmax(lons):.3f}")
-        
-        # 檢查緯度是否遞增（南到北），如果是則需要翻轉
-        if len(lats.shape) == 1:  # 1D 緯度陣列
-            lat_ascending = np.all(np.diff(lats) > 0)
-        else:  # 2D 緯度陣列
-            lat_ascending = np.all(np.diff(lats, axis=0) > 0)
-        
-        print(f"緯度是否遞增 (南→北): {lat_ascending}")
-        
-        if lat_ascending:
-            print("翻轉資料使其符合地圖投影 (北→南)")
-            data_values = np.flipud(data_values)
-            # 注意：翻轉數據後，不要翻轉座標陣列
-            # 因為我們需要保持座標的原始範圍來正確計算邊界
-        
-        # 計算地理邊界 - 確保 min_lat < max_lat
-        min_lon, max_lon = float(np.nanmin(lons)), float(np.nanmax(lons))
-        min_lat, max_lat = float(np.nanmin(lats)), float(np.nanmax(lats))
-        
-        # 如果我們翻轉了數據，需要確保 transform 矩陣正確
-        # 對於翻轉的數據，我們需要使用正確的像素高度方向
-        height, width = data_values.shape
-        
-        if lat_ascending:
-            # 如果原始數據是南→北遞增，翻轉後應該是北→南
-            # 使用負的像素高度來指示數據從北到南
-            transform = from_bounds(min_lon, min_lat, max_lon, max_lat, width, height)
-            print(f"使用翻轉後的變換矩陣 (北→南)")
-        else:
-            # 原始數據已經是北→南，直接使用
-            transform = from_bounds(min_lon, min_lat, max_lon, max_lat, width, height)
-            print(f"使用原始變換矩陣 (北→南)")
-        
-        # 設定輸出檔案名稱
-        nc_filename = Path(nc_file_path).stem
-        geotiff_filename = f"{nc_filename}_NO2.tif"
-        geotiff_path = output_path / geotiff_filename
-        
-        # 寫入 GeoTIFF
+    raise ValueError("找不到可用的資料變數，請檢查 NetCDF 檔案內容")
+
+def get_nc_layout(tree, collection_id, candidate_vars=None):
+    """取得檔案結構；同一個 collection 之後的 granule 直接使用快取"""
+    cache = _load_layout_cache()
+    layout = cache.get(collection_id)
+    if layout and _layout_matches(tree, layout):
+        print(f"使用快取的檔案結構 ({collection_id})")
+        return layout
+
+    print(f"根層變數: {list(tree.variables.keys())}")
+    layout = probe_nc_layout(tree, candidate_vars)
+    cache[collection_id] = layout
+    _save_layout_cache()
+    return layout
+
+# 串流模式的 GeoTIFF 內部 tile 大小
+STREAM_BLOCK_SIZE = 256
+# 每個緯度帶在記憶體中同時存在的份數 (讀取緩衝 + 寫入前的轉置/型別轉換)
+STREAM_BAND_COPIES = 2
+
+def parse_size(text):
+    """解析記憶體大小，例如 '512M'、'2G'；純數字視為 MB"""
+    text = str(text).strip().upper().rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text) * units['M'])
+
+def _chunk_rows(data, lat_name):
+    """取得變數在緯度方向的 HDF5 chunk 列數，未分塊時回傳 None"""
+    chunks = data.encoding.get('chunksizes')
+    if not chunks:
+        return None
+    return dict(zip(data.dims, chunks)).get(lat_name)
+
+def _stream_to_geotiff(data, lat_name, lats, lons, geotiff_path, max_memory, chunk_rows, tags):
+    """依緯度帶讀取 NetCDF 變數並寫入 tiled GeoTIFF 的對應 window"""
+    lat_first = data.dims[0] == lat_name
+    height = data.sizes[lat_name]
+    width = data.size // height
+    itemsize = data.dtype.itemsize
+
+    lat_ascending = bool(np.all(np.diff(lats) > 0))
+    min_lon, max_lon = float(np.nanmin(lons)), float(np.nanmax(lons))
+    min_lat, max_lat = float(np.nanmin(lats)), float(np.nanmax(lats))
+    transform = from_bounds(min_lon, min_lat, max_lon, max_lat, width, height)
+
+    # 預算的 1/4 給 GDAL 區塊快取 (緯度帶邊界未對齊 tile 時暫存未完成的區塊)
+    gdal_cache = max(max_memory // 4, width * STREAM_BLOCK_SIZE * itemsize)
+    band_budget = max(max_memory - gdal_cache, 0)
+    step = chunk_rows or 1
+    band_rows = band_budget // (STREAM_BAND_COPIES * width * itemsize)
+    band_rows = min(height, max(step, band_rows // step * step))
+
+    print(f"串流模式: 每次讀取 {band_rows} 列 (chunk={chunk_rows})，"
+          f"預估峰值 {(STREAM_BAND_COPIES * band_rows * width * itemsize + gdal_cache) / 2**20:.0f}MB")
+
+    with rasterio.Env(GDAL_CACHEMAX=max(1, gdal_cache // 2**20)):
         with rasterio.open(
             geotiff_path,
             'w',
@@ -261,23 +250,255 @@ def convert_nc_to_geotiff(nc_file_path, output_dir="../public/tempo/geotiff"):
             height=height,
             width=width,
             count=1,
-            dtype=data_values.dtype,
+            dtype=data.dtype,
             crs=CRS.from_epsg(4326),  # WGS84
             transform=transform,
-            compress='lzw'
+            compress='lzw',
+            tiled=True,
+            blockxsize=STREAM_BLOCK_SIZE,
+            blockysize=STREAM_BLOCK_SIZE,
+            nodata=np.nan,
         ) as dst:
-            dst.write(data_values, 1)
-            
-            # 設定 NoData 值
-            dst.nodata = np.nan
-            
-            # 添加描述
-            dst.update_tags(
-                DESCRIPTION=f'TEMPO NO2 data from {nc_filename}',
-                VARIABLE_NAME=candidate_vars
-            )
+            for start in range(0, height, band_rows):
+                stop = min(start + band_rows, height)
+                band = data.isel({lat_name: slice(start, stop)}).values
+                if not lat_first:
+                    band = band.T
+                band[~np.isfinite(band)] = np.nan
+
+                # 南→北的資料翻轉成北→南，寫入對應的下方 window
+                if lat_ascending:
+                    band = band[::-1]
+                    row_off = height - stop
+                else:
+                    row_off = start
+                dst.write(band, 1, window=Window(0, row_off, width, stop - start))
+
+            dst.update_tags(**tags)
+
+# Cloud-Optimized GeoTIFF 的 predictor 選項 (對應 GDAL COG driver 的 PREDICTOR)
+COG_PREDICTORS = {
+    "auto": "YES",                      # 整數用水平差分、浮點用浮點 predictor
+    "none": "NO",
+    "standard": "STANDARD",
+    "floating_point": "FLOATING_POINT",
+}
+
+def write_cog(geotiff_path, compress="DEFLATE", predictor="auto", level=None, blocksize=512):
+    """把 GeoTIFF 就地轉成 Cloud-Optimized GeoTIFF (內部 tile + overview)
+
+    有顏色表的 8-bit 檔案以 NEAREST 產生 overview，避免混出不存在的索引；
+    浮點數據則以 AVERAGE 產生。
+    """
+    geotiff_path = Path(geotiff_path)
+    with rasterio.open(geotiff_path) as src:
+        try:
+            src.colormap(1)
+            resampling = "NEAREST"
+        except ValueError:
+            resampling = "AVERAGE"
+
+    options = dict(
+        COMPRESS=compress.upper(),
+        PREDICTOR=COG_PREDICTORS[predictor],
+        BLOCKSIZE=blocksize,
+        OVERVIEWS="AUTO",
+        OVERVIEW_RESAMPLING=resampling,
+        BIGTIFF="IF_SAFER",
+    )
+    if level is not None:
+        options["LEVEL"] = level
+
+    tmp_path = geotiff_path.with_name(geotiff_path.stem + ".cog.tmp.tif")
+    rasterio.shutil.copy(geotiff_path, tmp_path, driver="COG", **options)
+    os.replace(tmp_path, geotiff_path)
+    print(f"✓ 已轉為 COG ({options['COMPRESS']}, predictor={predictor}, overview={resampling}): {geotiff_path.name}")
+
+def _open_no2_variable(tree, collection_id, candidate_vars=None):
+    """在已開啟的 DataTree 中取得 NO2 (或 candidate_vars 指定的) 變數 (延遲載入、降為 2D) 與經緯度座標"""
+    layout = get_nc_layout(tree, collection_id, candidate_vars)
+    group_name, var_name = layout['group'], layout['variable']
+    lat_name, lon_name = layout['lat'], layout['lon']
+
+    lats = tree[lat_name].values
+    lons = tree[lon_name].values
+
+    node = tree[group_name] if group_name else tree
+    data = node[var_name]
+    print(f"使用變數: {var_name} (group='{group_name}')")
+
+    # 記錄 HDF5 chunk 在緯度方向的大小，供串流模式對齊讀取
+    chunk_rows = _chunk_rows(data, lat_name)
+
+    print(f"數據形狀: {data.shape}")
+    print(f"數據維度: {data.dims}")
+
+    # 如果數據有時間維度，取第一個時間點
+    if 'time' in data.dims:
+        data = data.isel(time=0)
+        print("選擇第一個時間點")
+    
+    # 如果還有其他維度，取第一個
+    while len(data.dims) > 2:
+        dim_to_remove = [d for d in data.dims if d not in ['latitude', 'longitude', 'lat', 'lon']][0]
+        data = data.isel({dim_to_remove: 0})
+        print(f"移除維度: {dim_to_remove}")
+
+    return data, lats, lons, layout, chunk_rows
+
+def _geotiff_tags(nc_file_path, layout, product=NO2):
+    return dict(
+        DESCRIPTION=f'TEMPO {product.label} data from {Path(nc_file_path).stem}',
+        VARIABLE_NAME=f"{layout['group'] or ''}/{layout['variable']}"
+    )
+
+def decode_nc_grid(nc_file_path, collection_id=PARAMS["echo_collection_id"], candidate_vars=None, product=NO2):
+    """讀取 NetCDF 的 NO2 格網 (其他產品以 collection_id / candidate_vars 指定，product 決定描述標籤)
+
+    回傳 (北→南排列的 2D 陣列, (west, south, east, north), GeoTIFF 描述標籤)。
+    """
+    # 只開啟一次檔案：DataTree 會一併讀取所有 group 的 metadata
+    with xr.open_datatree(nc_file_path, engine=NETCDF_ENGINE) as tree:
+        data, lats, lons, layout, _ = _open_no2_variable(tree, collection_id, candidate_vars)
+        data = data.load()
+
+    # 獲取數據數值
+    data_values = data.values
+    
+    # 處理無效值
+    data_values = np.where(np.isfinite(data_values), data_values, np.nan)
+    
+    # 確保維度順序正確 (lat, lon)
+    if data.dims[0] == 'longitude' or data.dims[0] == 'lon':
+        data_values = data_values.T
+        lats, lons = lons, lats
+    
+    print(f"最終數據形狀: {data_values.shape}")
+    print(f"緯度範圍: {np.nanmin(lats):.3f} 到 {np.nanmax(lats):.3f}")
+    print(f"經度範圍: {np.nanmin(lons):.3f} 到 {np.nanmax(lons):.3f}")
+    
+    # 檢查緯度是否遞增（南到北），如果是則需要翻轉
+    if len(lats.shape) == 1:  # 1D 緯度陣列
+        lat_ascending = np.all(np.diff(lats) > 0)
+    else:  # 2D 緯度陣列
+        lat_ascending = np.all(np.diff(lats, axis=0) > 0)
+    
+    print(f"緯度是否遞增 (南→北): {lat_ascending}")
+    
+    if lat_ascending:
+        print("翻轉資料使其符合地圖投影 (北→南)")
+        data_values = np.flipud(data_values)
+        # 注意：翻轉數據後，不要翻轉座標陣列
+        # 因為我們需要保持座標的原始範圍來正確計算邊界
+    
+    # 計算地理邊界 - 確保 min_lat < max_lat
+    min_lon, max_lon = float(np.nanmin(lons)), float(np.nanmax(lons))
+    min_lat, max_lat = float(np.nanmin(lats)), float(np.nanmax(lats))
+
+    return data_values, (min_lon, min_lat, max_lon, max_lat), _geotiff_tags(nc_file_path, layout, product)
+
+def save_station_samples(nc_file_path, sample, stations_path):
+    """以 sample() 取樣所有測站並寫出 JSON；失敗只記錄，不影響 tiles 與 GeoTIFF"""
+    if stations_path is None:
+        return
+    try:
+        timestamp = granule_timestamp(Path(nc_file_path).name)
+        observed = (datetime.strptime(timestamp, "%Y%m%dT%H%M%SZ").strftime("%Y-%m-%dT%H:%M:%SZ")
+                    if GRANULE_TIME_RE.fullmatch(timestamp) else None)
+        tempo_stations.write_station_samples(stations_path, sample(), Path(nc_file_path).stem, observed)
+    except Exception as e:
+        print(f"測站取樣失敗: {e}")
+
+def update_composites(composites, nc_file_path, data_values, bounds):
+    """把 granule 加入各合成視窗；失敗只記錄，不影響 tiles 與 GeoTIFF"""
+    try:
+        timestamp = granule_timestamp(Path(nc_file_path).name)
+        if not GRANULE_TIME_RE.fullmatch(timestamp):
+            raise ValueError(f"檔名沒有觀測時間: {Path(nc_file_path).name}")
+        composites.add(timestamp, data_values, bounds)
+    except Exception as e:
+        print(f"合成視窗更新失敗: {e}")
+        tempo_metrics.annotate(ok=False, error=str(e))
+
+def write_no2_geotiff(data_values, bounds, geotiff_path, tags, cog=None):
+    """把 NO2 格網寫成 GeoTIFF (北→南，NaN 為 NoData)；cog 為 write_cog 的參數時輸出 COG"""
+    # 資料已是北→南排列，from_bounds 會使用負的像素高度
+    height, width = data_values.shape
+    transform = from_bounds(*bounds, width, height)
+
+    # 寫入 GeoTIFF
+    with rasterio.open(
+        geotiff_path,
+        'w',
+        driver='GTiff',
+        height=height,
+        width=width,
+        count=1,
+        dtype=data_values.dtype,
+        crs=CRS.from_epsg(4326),  # WGS84
+        transform=transform,
+        compress='lzw'
+    ) as dst:
+        dst.write(data_values, 1)
         
-        dst.close()
+        # 設定 NoData 值
+        dst.nodata = np.nan
+        
+        # 添加描述
+        dst.update_tags(**tags)
+
+    if cog is not None:
+        write_cog(geotiff_path, **cog)
+
+@tempo_metrics.instrument("convert")
+def convert_nc_to_geotiff(nc_file_path, output_dir="../public/tempo/geotiff",
+                          collection_id=PARAMS["echo_collection_id"], max_memory=None, cog=None,
+                          stations_path=DEFAULT_STATION_SAMPLES, product=NO2):
+    """將 NetCDF 檔案轉換為 GeoTIFF
+
+    max_memory (bytes) 有設定時改用串流模式，峰值記憶體受預算限制而不隨格網大小成長。
+    cog 為 write_cog 的參數 (dict) 時輸出 Cloud-Optimized GeoTIFF。
+    解碼後同時在所有測站取樣，寫到 stations_path (None 則略過)。
+    product 決定候選變數與 GeoTIFF 的描述標籤。
+    """
+    
+    print(f"\n開始轉換 NetCDF 到 GeoTIFF...")
+    print(f"輸入檔案: {nc_file_path}")
+    
+    # 創建輸出目錄
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    # 設定輸出檔案名稱
+    nc_filename = Path(nc_file_path).stem
+    geotiff_path = output_path / f"{nc_filename}_NO2.tif"
+    
+    try:
+        if max_memory:
+            # 串流模式：依緯度帶逐段讀取並寫入，不把整個變數載入記憶體
+            with xr.open_datatree(nc_file_path, engine=NETCDF_ENGINE) as tree:
+                data, lats, lons, layout, chunk_rows = _open_no2_variable(
+                    tree, collection_id, product.candidate_vars)
+                _stream_to_geotiff(
+                    data, layout['lat'], lats, lons, geotiff_path, max_memory, chunk_rows,
+                    tags=_geotiff_tags(nc_file_path, layout, product),
+                )
+                bounds = (float(np.nanmin(lons)), float(np.nanmin(lats)),
+                          float(np.nanmax(lons)), float(np.nanmax(lats)))
+                save_station_samples(
+                    nc_file_path,
+                    lambda: tempo_stations.sample_lazy(data, layout['lat'], lats, bounds),
+                    stations_path,
+                )
+            if cog is not None:
+                write_cog(geotiff_path, **cog)
+        else:
+            data_values, bounds, tags = decode_nc_grid(
+                nc_file_path, collection_id, product.candidate_vars, product=product)
+            save_station_samples(
+                nc_file_path, lambda: tempo_stations.sample_grid(data_values, bounds), stations_path
+            )
+            write_no2_geotiff(data_values, bounds, geotiff_path, tags, cog=cog)
         
         print(f"✓ GeoTIFF 轉換完成: {geotiff_path}")
         return str(geotiff_path)
@@ -288,7 +509,70 @@ def convert_nc_to_geotiff(nc_file_path, output_dir="../public/tempo/geotiff"):
         traceback.print_exc()
         return None
 
-def create_colored_geotiff(geotiff_file, output_dir="../public/tempo/geotiff"):
+def compute_color_range(data, product=NO2):
+    """決定顏色映射的數值範圍，沒有有效數據時回傳 None"""
+    # 計算統計資訊（忽略 NaN 值）
+    valid_data = data[np.isfinite(data)]
+    if len(valid_data) == 0:
+        print("警告：沒有有效數據")
+        return None
+    
+    # 使用更保守的百分位數來避免極值影響
+    data_min = np.percentile(valid_data, 1)    # 1% 分位數
+    data_max = np.percentile(valid_data, 99)   # 99% 分位數
+    data_mean = np.nanmean(valid_data)
+    data_std = np.nanstd(valid_data)
+    
+    # 每個產品有已知的典型範圍 (例如 NO2 為 0 到 5e15 molecules/cm²)
+    # 如果數據看起來合理，使用固定範圍來保持一致性
+    valid_min, valid_max = product.valid_range
+    if data_min >= valid_min and data_max <= valid_max:  # 合理的數值範圍
+        # 使用固定的科學範圍來保持顏色映射的一致性
+        scientific_min, scientific_max = product.color_range
+        
+        print(f"使用科學標準範圍進行顏色映射:")
+        print(f"  標準最小值: {scientific_min:.2e} {product.unit}")
+        print(f"  標準最大值: {scientific_max:.2e} {product.unit}")
+        print(f"  實際數據範圍: {data_min:.2e} - {data_max:.2e}")
+        
+        data_min, data_max = scientific_min, scientific_max
+    else:
+        print(f"數據範圍異常，使用百分位數範圍:")
+    
+    print(f"資料統計:")
+    print(f"  顏色映射最小值: {data_min:.6e}")
+    print(f"  顏色映射最大值: {data_max:.6e}")
+    print(f"  實際平均值: {data_mean:.6e}")
+    print(f"  實際標準差: {data_std:.6e}")
+    return data_min, data_max
+
+def colorize_grid(data, data_min, data_max):
+    """正規化到 0-255 範圍的調色盤索引，保留 0 給無資料"""
+    return tempo_colorize.colorize(data, data_min, data_max)
+
+def write_colored_geotiff(normalized_data, profile, colored_path, cog=None):
+    """寫出帶 256 色顏色表的 8-bit GeoTIFF；cog 為 write_cog 的參數時輸出 COG"""
+    profile = dict(profile)
+    profile.update(
+        dtype=rasterio.uint8,
+        count=1,
+        compress='lzw',
+        nodata=0
+    )
+    
+    # 寫入著色的 GeoTIFF
+    with rasterio.open(colored_path, 'w', **profile) as dst:
+        dst.write(normalized_data, 1)
+        
+        dst.write_colormap(1, tempo_colorize.build_color_ramp())
+
+        print("顏色映射: 透明 → 藍 → 綠 → 黃 → 紅，對應濃度由低到高")
+
+    if cog is not None:
+        write_cog(colored_path, **cog)
+
+@tempo_metrics.instrument("colorize")
+def create_colored_geotiff(geotiff_file, output_dir="../public/tempo/geotiff", cog=None):
     """創建著色的 GeoTIFF 以改善視覺效果"""
     try:
         print("創建著色版本的 GeoTIFF...")
@@ -297,100 +581,230 @@ def create_colored_geotiff(geotiff_file, output_dir="../public/tempo/geotiff"):
         with rasterio.open(geotiff_file) as src:
             data = src.read(1)  # 讀取第一個波段
             profile = src.profile.copy()
+
+        color_range = compute_color_range(data)
+        if color_range is None:
+            return geotiff_file
+
+        normalized_data = colorize_grid(data, *color_range)
+        
+        # 創建輸出檔案名稱
+        base_name = Path(geotiff_file).stem
+        colored_filename = f"{base_name}_colored.tif"
+        colored_path = Path(output_dir) / colored_filename
+        
+        write_colored_geotiff(normalized_data, profile, colored_path, cog=cog)
+        
+        print(f"✓ 著色 GeoTIFF 創建完成: {colored_path}")
+        return str(colored_path)
             
-            # 計算統計資訊（忽略 NaN 值）
-            valid_data = data[np.isfinite(data)]
-            if len(valid_data) == 0:
-                print("警告：沒有有效數據")
-                return geotiff_file
-            
-            # 使用更保守的百分位數來避免極值影響
-            data_min = np.percentile(valid_data, 1)    # 1% 分位數
-            data_max = np.percentile(valid_data, 99)   # 99% 分位數
-            data_mean = np.nanmean(valid_data)
-            data_std = np.nanstd(valid_data)
-            
-            # 對於 NO2 數據，我們知道典型範圍是 0 到 5e15 molecules/cm²
-            # 如果數據看起來合理，使用固定範圍來保持一致性
-            if data_min >= 0 and data_max <= 1e16:  # 合理的 NO2 範圍
-                # 使用固定的科學範圍來保持顏色映射的一致性
-                scientific_min = 0
-                scientific_max = 5e15  # 5×10¹⁵ molecules/cm²
-                
-                print(f"使用科學標準範圍進行顏色映射:")
-                print(f"  標準最小值: {scientific_min:.2e} molecules/cm²")
-                print(f"  標準最大值: {scientific_max:.2e} molecules/cm²")
-                print(f"  實際數據範圍: {data_min:.2e} - {data_max:.2e}")
-                
-                data_min, data_max = scientific_min, scientific_max
-            else:
-                print(f"數據範圍異常，使用百分位數範圍:")
-            
-            print(f"資料統計:")
-            print(f"  顏色映射最小值: {data_min:.6e}")
-            print(f"  顏色映射最大值: {data_max:.6e}")
-            print(f"  實際平均值: {data_mean:.6e}")
-            print(f"  實際標準差: {data_std:.6e}")
-            
-            # 正規化到 0-255 範圍，保留 0 給無資料
-            range_span = data_max - data_min
-            if range_span <= 0:
-                scaled = np.zeros_like(data, dtype=np.float32)
-            else:
-                scaled = (data - data_min) / range_span
+    except Exception as e:
+        print(f"創建著色 GeoTIFF 失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        return geotiff_file  # 返回原始檔案
+
+def _default_tiles_dir(geotiff_file):
+    """tiles 目錄與 geotiff 目錄同層 (tempo/tiles)"""
+    base_dir = os.path.dirname(geotiff_file)  # geotiff 目錄
+    parent_dir = os.path.dirname(base_dir)    # tempo 目錄
+    return os.path.join(parent_dir, 'tiles')
+
+@tempo_metrics.instrument("tiling")
+def generate_tiles(geotiff_file, tiles_dir=None, min_zoom=2, max_zoom=8, processes=None,
+                   incremental=True, archive=None):
+    """使用內建的 tempo_tiler 直接從著色 GeoTIFF 生成 XYZ raster tiles
+
+    incremental 為 True 時只重寫內容有變的 tile，變更清單寫在 tiles-changes.json。
+    archive 為 .pmtiles 路徑時改寫成單一封存檔並回傳其路徑。
+    """
+    try:
+        print("開始生成 raster tiles...")
+        print(f"輸入檔案: {geotiff_file}")
+
+        if tiles_dir is None:
+            tiles_dir = _default_tiles_dir(geotiff_file)
+
+        # 讀取 8-bit 索引與顏色表，整個金字塔都在記憶體中建立
+        with rasterio.open(geotiff_file) as src:
+            grid = src.read(1)
+            bounds = tuple(src.bounds)
+            palette = tempo_tiler.palette_from_colormap(src.colormap(1))
+
+        tempo_tiler.build_tile_pyramid(
+            grid,
+            bounds,
+            tiles_dir,
+            palette,
+            min_zoom=min_zoom,
+            max_zoom=max_zoom,
+            processes=processes,
+            incremental=incremental,
+            archive_path=archive,
+        )
 
-            normalized = np.where(
-                np.isfinite(data),
-                np.clip(scaled, 0, 1),
-                np.nan
+        print("✓ Tiles 生成成功!")
+        return archive or tiles_dir
+
+    except Exception as e:
+        print(f"生成 tiles 過程中發生錯誤: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
+
+@tempo_metrics.instrument("fused")
+def process_granule_fused(nc_file_path, tiles_dir="../public/tempo/tiles",
+                          geotiff_dir="../public/tempo/geotiff", debug_geotiff=False,
+                          min_zoom=2, max_zoom=8, processes=None, incremental=True, cog=None,
+                          archive=None, data_tiles_dir=None, stations_path=DEFAULT_STATION_SAMPLES,
+                          composites=None, contours_dir=None, product=NO2):
+    """記憶體內的完整流程：解碼 → 正規化 → 著色 → tiles，不經過中間 GeoTIFF
+
+    debug_geotiff 為 True 時才另外寫出 *_NO2.tif 與 *_NO2_colored.tif 供除錯；
+    cog 有設定時這兩個檔案會以 Cloud-Optimized GeoTIFF 輸出。
+    archive 為 .pmtiles 路徑時 tiles 寫成單一封存檔並回傳其路徑。
+    data_tiles_dir 有設定時同一趟另外輸出數值編碼 tile (實際 NO2 柱濃度)，
+    此時金字塔以原始數值建立，著色 tile 由各 tile 的數值正規化而來。
+    解碼後同時在所有測站取樣，寫到 stations_path (None 則略過)。
+    composites 為 tempo_composite.CompositeStore 時把這個 granule 加入各合成視窗。
+    contours_dir 有設定時從解碼後的格網輸出等值帶向量圖層 (見 tempo_contours)。
+    product 為 tempo_products 的產品，決定讀取的變數與顏色映射範圍 (預設 NO2)。
+    """
+    try:
+        with tempo_metrics.stage("decode"):
+            data_values, bounds, tags = decode_nc_grid(
+                nc_file_path, product.layout_key, product.candidate_vars, product=product)
+        with tempo_metrics.stage("stations"):
+            save_station_samples(
+                nc_file_path, lambda: tempo_stations.sample_grid(data_values, bounds), stations_path
             )
+        if composites is not None:
+            with tempo_metrics.stage("composite_update"):
+                update_composites(composites, nc_file_path, data_values, bounds)
 
-            normalized_data = np.where(
-                np.isnan(normalized),
-                0,
-                (normalized * 255).astype(np.uint8)
+        color_range = compute_color_range(data_values, product)
+        if color_range is None:
+            return None
+        write_geotiffs = debug_geotiff or cog is not None
+        if data_tiles_dir is None or write_geotiffs:
+            with tempo_metrics.stage("colorize", megapixels=round(data_values.size / 1e6, 2)):
+                normalized_data = colorize_grid(data_values, *color_range)
+
+        if write_geotiffs:
+            output_path = Path(geotiff_dir)
+            output_path.mkdir(parents=True, exist_ok=True)
+            geotiff_path = output_path / f"{Path(nc_file_path).stem}_{product.label}.tif"
+            write_no2_geotiff(data_values, bounds, geotiff_path, tags, cog=cog)
+            height, width = normalized_data.shape
+            profile = dict(
+                driver='GTiff',
+                height=height,
+                width=width,
+                crs=CRS.from_epsg(4326),
+                transform=from_bounds(*bounds, width, height),
             )
-            
-            # 更新 profile
-            profile.update(
-                dtype=rasterio.uint8,
-                count=1,
-                compress='lzw',
-                nodata=0
+            write_colored_geotiff(normalized_data, profile, output_path / f"{geotiff_path.stem}_colored.tif",
+                                  cog=cog)
+            print(f"GeoTIFF 已寫入: {output_path}")
+
+        if contours_dir is not None:
+            with tempo_metrics.stage("contours") as contours:
+                entries = tempo_contours.build_contours(data_values, bounds, contours_dir,
+                                                        min_zoom=min_zoom, max_zoom=max_zoom)
+                contours.add(files=len(entries),
+                             vertices=sum(entry['vertices'] for entry in entries),
+                             bytes=sum(entry['bytes'] for entry in entries))
+
+        if data_tiles_dir is not None:
+            # 數值 tile 需要實際數值，金字塔直接以原始格網建立
+            grid, value_range = data_values, color_range
+        else:
+            # 原始格網在著色後即可釋放，tiling 只需要 8-bit 索引
+            grid, value_range = normalized_data, None
+        del data_values
+
+        with tempo_metrics.stage("tiling") as tiling:
+            summary = tempo_tiler.build_tile_pyramid(
+                grid,
+                bounds,
+                tiles_dir,
+                tempo_colorize.color_ramp_lut(),
+                min_zoom=min_zoom,
+                max_zoom=max_zoom,
+                processes=processes,
+                value_range=value_range,
+                incremental=incremental,
+                archive_path=archive,
+                data_tiles_dir=data_tiles_dir,
             )
-            
-            # 創建輸出檔案名稱
-            base_name = Path(geotiff_file).stem
-            colored_filename = f"{base_name}_colored.tif"
-            colored_path = Path(output_dir) / colored_filename
-            
-            # 寫入著色的 GeoTIFF
-            with rasterio.open(colored_path, 'w', **profile) as dst:
-                dst.write(normalized_data, 1)
-                
-                dst.write_colormap(1, _build_color_ramp())
+            tiling.add(tiles={key: len(value) if isinstance(value, list) else value
+                              for key, value in summary.items()})
+
+        print("✓ Tiles 生成成功!")
+        return archive or tiles_dir
 
-                print("顏色映射: 透明 → 藍 → 綠 → 黃 → 紅，對應濃度由低到高")
-            
-            print(f"✓ 著色 GeoTIFF 創建完成: {colored_path}")
-            return str(colored_path)
-            
     except Exception as e:
-        print(f"創建著色 GeoTIFF 失敗: {e}")
+        print(f"記憶體內處理失敗: {e}")
         import traceback
         traceback.print_exc()
-        return geotiff_file  # 返回原始檔案
+        return None
+
+@tempo_metrics.instrument("composite_tiles")
+def generate_composite_tiles(store, output_dir=DEFAULT_COMPOSITES_DIR, min_zoom=2, max_zoom=8,
+                             processes=None, incremental=True):
+    """從合成累加器產生各視窗的 mean / max tiles (output_dir/<視窗>/<mean|max>/)
+
+    另外寫出 output_dir/index.json，列出各視窗的時間範圍、granule 與顏色映射範圍。
+    """
+    try:
+        output_path = Path(output_dir)
+        output_path.mkdir(parents=True, exist_ok=True)
+        index = {}
+        for name in store.windows:
+            info = store.window_info(name)
+            if not info['granules']:
+                continue
+            layers = {}
+            for stat, grid in zip(("mean", "max"), store.composite(name)):
+                print("\n" + "="*50)
+                print(f"合成 {name} {stat} ({len(info['granules'])} 個 granule)")
+                color_range = compute_color_range(grid)
+                if color_range is None:
+                    continue
+                tempo_tiler.build_tile_pyramid(
+                    colorize_grid(grid, *color_range),
+                    store.bounds,
+                    str(output_path / name / stat),
+                    tempo_colorize.color_ramp_lut(),
+                    min_zoom=min_zoom,
+                    max_zoom=max_zoom,
+                    processes=processes,
+                    incremental=incremental,
+                )
+                layers[stat] = {"tiles": f"{name}/{stat}", "range": [float(v) for v in color_range]}
+            index[name] = dict(info, layers=layers)
+
+        with open(output_path / "index.json", "w", encoding="utf-8") as f:
+            json.dump({"unit": "molecules/cm^2", "windows": index}, f, indent=2)
+        print(f"✓ 合成 tiles: {', '.join(index) or '無'} → {output_path}")
+        return str(output_path)
+
+    except Exception as e:
+        print(f"生成合成 tiles 失敗: {e}")
+        import traceback
+        traceback.print_exc()
+        return None
 
-def generate_tiles(geotiff_file):
-    """使用 GDAL 生成 raster tiles"""
+def generate_tiles_gdal(geotiff_file, tiles_dir=None):
+    """使用 GDAL (gdal_translate + gdal2tiles.py) 生成 raster tiles，保留作為比較基準"""
     try:
         print("開始生成 raster tiles...")
         print(f"輸入檔案: {geotiff_file}")
         
         # 設置輸出路徑
         base_dir = os.path.dirname(geotiff_file)  # geotiff 目錄
-        parent_dir = os.path.dirname(base_dir)    # tempo 目錄
-        tiles_dir = os.path.join(parent_dir, 'tiles')
+        if tiles_dir is None:
+            tiles_dir = _default_tiles_dir(geotiff_file)
         
         # 步驟 1: 檢查原始 GeoTIFF
         print("步驟 1: 檢查原始 GeoTIFF...")
@@ -521,13 +935,8 @@ def generate_tiles(geotiff_file):
         traceback.print_exc()
         return None
 
-def get_latest_nc_download_url():
-    r = requests.get(CMR_URL, params=PARAMS, timeout=30)
-    r.raise_for_status()
-    data = r.json()
-
-    entry = data["feed"]["entry"][0]
-
+def nc_download_url(entry):
+    """從 granule 的 links 裡挑出「直接下載 .nc」的 https 連結"""
     # 從 links 裡挑出「直接下載 .nc」的連結（rel 含 data#）
     links = entry.get("links", [])
     nc_links = [
@@ -536,20 +945,114 @@ def get_latest_nc_download_url():
         if l.get("rel", "").endswith("/data#") and l.get("href", "").endswith(".nc")
     ]
 
-    # 通常會有一個 https 的 protected 連結（需要 Earthdata Login）
-    download_url = next((u for u in nc_links if u.startswith("https://")), None)
+    # 通常會有一個 https 的 protected 連結（需要 Earthdata Login）；本機替身伺服器只提供 http
+    return next((u for u in nc_links if u.startswith("https://")),
+                next((u for u in nc_links if u.startswith("http://")), None))
+
+# 一律回傳 3-tuple；沒有新 granule (entry 為 None) 是正常情況，只有找到 granule 卻沒有下載連結才算失敗
+@tempo_metrics.instrument("cmr_query", measure=lambda result: {
+    'ok': result[1] is None or result[0] is not None,
+    'new_granule': result[1] is not None,
+})
+def get_latest_nc_download_url(state=None, product=NO2):
+    """查詢最新 granule，回傳 (download_url, entry, CMR 驗證資訊)
 
-    print("Latest granule title:", entry.get("title"))
+    state 為上次的處理狀態；沒有比它更新的 granule 時 download_url 與 entry 為 None。
+    """
+    params = dict(product.search_params, sort_key=PARAMS["sort_key"], page_size=PARAMS["page_size"])
+    entry, validators = tempo_state.poll_latest_granule(CMR_URL, params, state or {})
+    if entry is None:
+        return None, None, validators
+
+    download_url = nc_download_url(entry)
     print("Start:", entry.get("time_start"), "End:", entry.get("time_end"))
     print("Download URL:", download_url)
-    return download_url, entry.get("title")
+    return download_url, entry, validators
+
+def check_new_granule(args):
+    """--check：只輪詢 CMR，有新 granule 回傳 0，否則回傳 NO_NEW_GRANULE_EXIT_CODE"""
+    state = {} if args.force else tempo_state.load_state()
+    _, entry, validators = get_latest_nc_download_url(state)
+    if state and validators != state.get('cmr'):
+        tempo_state.save_state(dict(state, cmr=validators))
+    if entry is None:
+        print("沒有新的 granule")
+        return tempo_state.NO_NEW_GRANULE_EXIT_CODE
+    print(f"有新的 granule: {entry.get('title')}")
+    return 0
+
+def iter_granules(since, until, collection_id=PARAMS["echo_collection_id"], page_size=100):
+    """依開始時間由舊到新，逐頁列出時間範圍內的 granule (CMR-Search-After 分頁)"""
+    params = {
+        "echo_collection_id": collection_id,
+        "sort_key": "start_date",
+        "page_size": page_size,
+        "temporal": f"{since},{until}",
+    }
+    headers = {}
+    page = 1
+    while True:
+        r = requests.get(CMR_URL, params=params, headers=headers, timeout=30)
+        r.raise_for_status()
+        entries = r.json()["feed"]["entry"]
+        print(f"CMR 第 {page} 頁: {len(entries)} 筆 granule")
+        yield from entries
+
+        search_after = r.headers.get("CMR-Search-After")
+        if len(entries) < page_size or not search_after:
+            return
+        headers = {"CMR-Search-After": search_after}
+        page += 1
+
+def granule_timestamp(title):
+    """從檔名取出觀測時間，例如 TEMPO_NO2_L3_NRT_V02_20251002T133140Z_S004.nc → 20251002T133140Z"""
+    match = GRANULE_TIME_RE.search(title or "")
+    return match.group(1) if match else Path(title or "unknown").stem
 
-def download_nc_file(url, save_dir="../public/tempo/no2", session=None):
-    """下載 NetCDF 檔案到指定目錄"""
+def get_granule_integrity(title, collection_id=PARAMS["echo_collection_id"], search_params=None):
+    """從 CMR UMM-G metadata 取得檔案大小與 checksum，查不到時回傳 (None, None)
+
+    search_params 為其他產品的集合條件 (tempo_products.Product.search_params)，取代 collection_id。
+    """
+    try:
+        r = requests.get(
+            CMR_UMM_URL,
+            params=dict(search_params or {"collection_concept_id": collection_id}, granule_ur=title),
+            timeout=30,
+        )
+        r.raise_for_status()
+        items = r.json().get("items", [])
+        if not items:
+            return None, None
+        files = items[0]["umm"].get("DataGranule", {}).get("ArchiveAndDistributionInformation", [])
+        info = next((f for f in files if f.get("Name", "").endswith(".nc")), None)
+        if info is None:
+            return None, None
+        size = info.get("SizeInBytes")
+        checksum = info.get("Checksum")
+        if checksum:
+            checksum = (checksum["Algorithm"], checksum["Value"])
+        print(f"CMR metadata: {size} bytes, checksum: {checksum[0] if checksum else '無'}")
+        return size, checksum
+    except Exception as e:
+        print(f"⚠ 無法取得 granule 完整性資訊: {e}")
+        return None, None
+
+@tempo_metrics.instrument("download")
+def download_nc_file(url, save_dir="../public/tempo/no2", session=None,
+                     expected_size=None, checksum=None, connections=None, keep_existing=False,
+                     file_prefix=NO2.file_prefix):
+    """下載 NetCDF 檔案到指定目錄
+
+    以多條連線平行下載 byte range；失敗時保留 .part 檔，下次執行會續傳。
+    expected_size / checksum (演算法, 值) 來自 CMR metadata，下載後會核對。
+    keep_existing 為 True 時不清理資料夾中其他 granule (backfill 使用)。
+    file_prefix 為同一產品的檔名前綴，清理舊檔案時只比對這個前綴。
+    """
     
     # 如果沒有提供 session，創建一個新的
     if session is None:
-        session = get_earthdata_session()
+        session = get_earthdata_session(tempo_download.pool_size(connections))
     
     # 創建目錄如果不存在
     save_path = Path(save_dir)
@@ -565,153 +1068,266 @@ def download_nc_file(url, save_dir="../public/tempo/no2", session=None):
     # 檢查檔案是否已經存在
     if file_path.exists():
         print(f"檔案已存在: {filename}")
+        tempo_metrics.annotate(cached=True, downloaded_bytes=0)
         return str(file_path)
     
     # 檢查並記錄現有的舊檔案
-    existing_files = list(save_path.glob("TEMPO_NO2_*.nc"))
-    print(f"目前資料夾中有 {len(existing_files)} 個 TEMPO NO2 檔案")
+    existing_files = list(save_path.glob(f"{file_prefix}*.nc"))
+    print(f"目前資料夾中有 {len(existing_files)} 個 {file_prefix.rstrip('_')} 檔案")
     
     print(f"開始下載: {filename}")
     print(f"儲存位置: {file_path}")
     
     try:
         print(f"正在連接到: {url}")
-        
-        # 使用 requests session 進行完整的 OAuth 流程
-        # 第一步：訪問原始 URL，讓它重定向到認證頁面
-        print("步驟 1: 訪問下載 URL...")
-        response1 = session.get(url, allow_redirects=False, timeout=30)
-        
-        if response1.status_code == 302 or response1.status_code == 301:
-            redirect_url = response1.headers.get('Location')
-            print(f"步驟 2: 重定向到認證 URL: {redirect_url[:100]}...")
-            
-            # 第二步：訪問認證 URL
-            response2 = session.get(redirect_url, allow_redirects=True, timeout=30)
-            
-            if response2.status_code == 200:
-                print("步驟 3: 認證成功，重新嘗試下載...")
-                
-                # 第三步：重新嘗試原始 URL
-                response = session.get(url, stream=True, timeout=300, allow_redirects=True)
-                
-                if response.status_code == 200:
-                    # 取得檔案大小（如果有提供）
-                    total_size = int(response.headers.get('content-length', 0))
-                    
-                    with open(file_path, 'wb') as f:
-                        downloaded = 0
-                        for chunk in response.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-                                
-                                # 顯示進度（每 1MB 顯示一次）
-                                if downloaded % (1024 * 1024) == 0:
-                                    if total_size > 0:
-                                        progress = (downloaded / total_size) * 100
-                                        print(f"下載進度: {progress:.1f}% ({downloaded / (1024*1024):.1f}MB)")
-                                    else:
-                                        print(f"已下載: {downloaded / (1024*1024):.1f}MB")
-                    
-                    print(f"下載完成: {filename}")
-                    
-                    # 刪除舊的 TEMPO NO2 檔案（除了剛下載的檔案）
-                    if existing_files:
-                        print(f"\n清理舊檔案...")
-                        for old_file in existing_files:
-                            if old_file != file_path:  # 確保不刪除剛下載的檔案
-                                try:
-                                    old_file.unlink()
-                                    print(f"已刪除舊檔案: {old_file.name}")
-                                except Exception as e:
-                                    print(f"刪除舊檔案失敗 {old_file.name}: {e}")
-                    
-                    return str(file_path)
-                else:
-                    print(f"下載失敗，狀態碼: {response.status_code}")
-            else:
-                print(f"認證失敗，狀態碼: {response2.status_code}")
-        else:
-            # 如果沒有重定向，直接嘗試下載
-            print("沒有重定向，直接下載...")
-            if response1.status_code == 200:
-                total_size = int(response1.headers.get('content-length', 0))
-                
-                with open(file_path, 'wb') as f:
-                    downloaded = 0
-                    for chunk in response1.iter_content(chunk_size=8192):
-                        if chunk:
-                            f.write(chunk)
-                            downloaded += len(chunk)
-                            
-                            if downloaded % (1024 * 1024) == 0:
-                                if total_size > 0:
-                                    progress = (downloaded / total_size) * 100
-                                    print(f"下載進度: {progress:.1f}% ({downloaded / (1024*1024):.1f}MB)")
-                                else:
-                                    print(f"已下載: {downloaded / (1024*1024):.1f}MB")
-                
-                print(f"下載完成: {filename}")
-                
-                # 刪除舊的 TEMPO NO2 檔案（除了剛下載的檔案）
-                if existing_files:
-                    print(f"\n清理舊檔案...")
-                    for old_file in existing_files:
-                        if old_file != file_path:  # 確保不刪除剛下載的檔案
-                            try:
-                                old_file.unlink()
-                                print(f"已刪除舊檔案: {old_file.name}")
-                            except Exception as e:
-                                print(f"刪除舊檔案失敗 {old_file.name}: {e}")
-                
-                return str(file_path)
-        
-        return None
-        
+        downloader = tempo_download.RangeDownloader(session, connections=connections)
+        downloader.download(url, file_path, expected_size=expected_size, checksum=checksum)
+        tempo_metrics.annotate(downloaded_bytes=downloader.transferred,
+                               file_bytes=os.path.getsize(file_path), connections=downloader.connections)
     except Exception as e:
         print(f"下載失敗: {e}")
-        # 如果下載失敗，刪除部分下載的檔案
-        if file_path.exists():
-            file_path.unlink()
+        # 保留 .part 檔，下次執行從中斷處繼續
         return None
 
-if __name__ == "__main__":
+    if keep_existing:
+        return str(file_path)
+
+    # 刪除同一產品的舊檔案與其他 granule 殘留的 .part（除了剛下載的檔案）
+    stale_parts = [p for p in save_path.glob(f"{file_prefix}*.nc.part*") if not p.name.startswith(filename)]
+    if existing_files or stale_parts:
+        print(f"\n清理舊檔案...")
+        for old_file in existing_files + stale_parts:
+            if old_file != file_path:  # 確保不刪除剛下載的檔案
+                try:
+                    old_file.unlink()
+                    print(f"已刪除舊檔案: {old_file.name}")
+                except Exception as e:
+                    print(f"刪除舊檔案失敗 {old_file.name}: {e}")
+    
+    return str(file_path)
+
+def write_frames_index(output_root):
+    """列出所有已完成的 granule 目錄，寫成 index.json 供地圖時間軸使用"""
+    root = Path(output_root)
+    frames = sorted(
+        d.name for d in root.iterdir()
+        if (d / "tiles" / tempo_tiler.MANIFEST_NAME).exists()
+    )
+    with open(root / "index.json", "w", encoding="utf-8") as f:
+        json.dump({"frames": frames}, f, indent=2)
+    return frames
+
+def run_backfill(since, until, session, output_root="../public/tempo/frames",
+                 save_dir="../public/tempo/no2/backfill", prefetch=1, connections=None,
+                 keep_nc=False, incremental=True, cog=None, composites_dir=None):
+    """補抓 [since, until] 之間的所有 granule，每個 granule 輸出到 output_root/<時間>/
+
+    下載 (背景執行緒) 與解碼/tiling (主執行緒) 以有界佇列串接：
+    處理第 N 個 granule 時，第 N+1 個已在下載，最多預先下載 prefetch 個。
+    composites_dir 有設定時每個 granule 依序加入合成視窗，全部處理完後才產生一次合成 tiles。
+    """
+    print(f"Backfill: {since} → {until}")
+    Path(output_root).mkdir(parents=True, exist_ok=True)
+    downloads = Queue(maxsize=max(1, prefetch))
+    stop = threading.Event()
+    composites = tempo_composite.CompositeStore() if composites_dir else None
+
+    def producer():
+        try:
+            for entry in iter_granules(since, until):
+                if stop.is_set():
+                    break
+                title = entry.get("title")
+                frame_dir = Path(output_root) / granule_timestamp(title)
+                if (frame_dir / "tiles" / tempo_tiler.MANIFEST_NAME).exists():
+                    print(f"已處理過，略過: {title}")
+                    continue
+
+                url = nc_download_url(entry)
+                if not url:
+                    print(f"找不到下載連結，略過: {title}")
+                    continue
+
+                expected_size, checksum = get_granule_integrity(title)
+                nc_file = download_nc_file(
+                    url,
+                    save_dir=save_dir,
+                    session=session,
+                    expected_size=expected_size,
+                    checksum=checksum,
+                    connections=connections,
+                    keep_existing=True,
+                )
+                downloads.put((title, frame_dir, nc_file))
+        except Exception as e:
+            print(f"列出或下載 granule 時發生錯誤: {e}")
+        finally:
+            downloads.put(None)
+
+    threading.Thread(target=producer, name="backfill-download", daemon=True).start()
+
+    processed, failed = [], []
     try:
-        # 取得最新檔案的下載連結
-        download_url, title = get_latest_nc_download_url()
-        
-        if download_url:
+        while True:
+            item = downloads.get()
+            if item is None:
+                break
+            title, frame_dir, nc_file = item
+            if nc_file is None:
+                failed.append(title)
+                continue
+
             print("\n" + "="*50)
-            print("開始下載 TEMPO NO2 檔案...")
-            
-            # 取得認證的 session
-            session = get_earthdata_session()
-            
-            # 下載檔案
-            downloaded_file = download_nc_file(download_url, session=session)
+            print(f"處理 granule: {title}")
+            tiles_dir = process_granule_fused(
+                nc_file,
+                tiles_dir=str(frame_dir / "tiles"),
+                geotiff_dir=str(frame_dir / "geotiff"),
+                stations_path=str(frame_dir / "stations.json"),
+                incremental=incremental,
+                cog=cog,
+                composites=composites,
+            )
+            if tiles_dir:
+                processed.append(title)
+            else:
+                failed.append(title)
+
+            if not keep_nc:
+                Path(nc_file).unlink(missing_ok=True)
+    finally:
+        stop.set()
+
+    frames = write_frames_index(output_root)
+    if composites is not None and processed:
+        generate_composite_tiles(composites, composites_dir, incremental=incremental)
+    print("\n" + "="*50)
+    print(f"Backfill 完成: 成功 {len(processed)}，失敗 {len(failed)}，共 {len(frames)} 個時間點")
+    for title in failed:
+        print(f"  失敗: {title}")
+    return processed
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="Fetch the latest TEMPO NO2 granule and build raster tiles.")
+    ap.add_argument("--max-memory", type=parse_size, default=None,
+                    help="串流轉換 NetCDF 的記憶體預算，例如 512M、2G；不提供則整個變數一次載入")
+    ap.add_argument("--full-tiles", action="store_true",
+                    help="忽略 manifest，重寫所有 tiles")
+    ap.add_argument("--connections", type=int, default=None,
+                    help="平行下載的連線數 (預設 TEMPO_DOWNLOAD_CONNECTIONS 或 4)")
+    ap.add_argument("--since",
+                    help="Backfill 模式：補抓此時間 (ISO 8601，例如 2025-10-02T00:00:00Z) 之後的所有 granule")
+    ap.add_argument("--until",
+                    help="Backfill 結束時間 (預設為現在)")
+    ap.add_argument("--prefetch", type=int, default=1,
+                    help="Backfill 時最多預先下載的 granule 數量")
+    ap.add_argument("--keep-nc", action="store_true",
+                    help="Backfill 處理完後保留 .nc 檔")
+    ap.add_argument("--cog", action="store_true",
+                    help="以 Cloud-Optimized GeoTIFF (內部 tile + overview) 輸出原始與著色 GeoTIFF")
+    ap.add_argument("--cog-compression", default="DEFLATE",
+                    choices=["DEFLATE", "LZW", "ZSTD", "LZMA", "NONE"],
+                    help="COG 壓縮方式")
+    ap.add_argument("--cog-predictor", default="auto", choices=sorted(COG_PREDICTORS),
+                    help="COG predictor (auto: 整數用水平差分、浮點用浮點 predictor)")
+    ap.add_argument("--cog-level", type=int, default=None,
+                    help="COG 壓縮等級 (DEFLATE/ZSTD/LZMA)")
+    ap.add_argument("--tile-archive", nargs="?", const=DEFAULT_TILE_ARCHIVE, default=None,
+                    metavar="PATH",
+                    help=f"把 tiles 寫成單一 PMTiles 檔 (預設 {DEFAULT_TILE_ARCHIVE})，取代個別 PNG")
+    ap.add_argument("--data-tiles", nargs="?", const=DEFAULT_DATA_TILES_DIR, default=None,
+                    metavar="DIR",
+                    help=f"同一趟另外輸出數值編碼 tile (預設 {DEFAULT_DATA_TILES_DIR})，前端可直接解碼 NO2 數值")
+    ap.add_argument("--composites", nargs="?", const=DEFAULT_COMPOSITES_DIR, default=None,
+                    metavar="DIR",
+                    help=f"維護最近 granule 的 rolling mean / max 並輸出合成 tiles (預設 {DEFAULT_COMPOSITES_DIR})；"
+                         f"視窗由 TEMPO_COMPOSITE_WINDOWS 設定 (預設 {tempo_composite.COMPOSITE_WINDOWS})")
+    ap.add_argument("--contours", nargs="?", const=DEFAULT_CONTOURS_DIR, default=None,
+                    metavar="DIR",
+                    help=f"同一趟另外輸出 NO2 等值帶向量圖層 (預設 {DEFAULT_CONTOURS_DIR})；"
+                         f"門檻由 TEMPO_CONTOUR_LEVELS 設定 (預設 {tempo_contours.CONTOUR_LEVELS})")
+    ap.add_argument("--products", type=tempo_products.parse_products, default=None,
+                    help=f"同一次執行並行處理多個產品 ({', '.join(tempo_products.PRODUCTS)} 或 all，以逗號分隔)；"
+                         f"共用認證 session，CMR 查詢與下載以執行緒並行，解碼到 tiles 交給 process pool")
+    ap.add_argument("--check", action="store_true",
+                    help=f"只檢查 CMR 是否有新 granule：有則結束代碼 0，"
+                         f"沒有則為 {tempo_state.NO_NEW_GRANULE_EXIT_CODE}")
+    ap.add_argument("--force", action="store_true",
+                    help="忽略狀態檔，即使已處理過也重新處理最新 granule")
+    ap.add_argument("--metrics-file", default=str(DEFAULT_METRICS_FILE),
+                    help="各階段量測結果 (JSON lines) 的輸出檔")
+    ap.add_argument("--profile", nargs="?", const=str(DEFAULT_PROFILE_DIR), default=None, metavar="DIR",
+                    help=f"每個階段另存 cProfile 結果 (預設 {DEFAULT_PROFILE_DIR})")
+    ap.add_argument("--debug-geotiff", action="store_true",
+                    help="記憶體內處理時另外寫出中間 GeoTIFF 供除錯")
+    args = ap.parse_args(argv)
+    args.cog_options = (
+        dict(compress=args.cog_compression, predictor=args.cog_predictor, level=args.cog_level)
+        if args.cog else None
+    )
+    return args
+
+def run_latest(args):
+    """處理 CMR 上最新的一個 granule；已處理過 (依狀態檔) 時直接結束"""
+    state = {} if args.force else tempo_state.load_state()
+    # 取得最新檔案的下載連結
+    download_url, entry, validators = get_latest_nc_download_url(state)
+    if entry is None:
+        if state and validators != state.get('cmr'):
+            tempo_state.save_state(dict(state, cmr=validators))
+        print("沒有新的 granule，略過處理")
+        return
+    title = entry.get("title")
+    
+    if download_url:
+        print("\n" + "="*50)
+        print("開始下載 TEMPO NO2 檔案...")
+        
+        # 取得認證的 session
+        session = get_earthdata_session(tempo_download.pool_size(args.connections))
+        
+        # 下載檔案，並以 CMR metadata 核對大小與 checksum
+        expected_size, checksum = get_granule_integrity(title)
+        downloaded_file = download_nc_file(
+            download_url,
+            session=session,
+            expected_size=expected_size,
+            checksum=checksum,
+            connections=args.connections,
+        )
+        
+        if downloaded_file:
+            print(f"\n成功下載檔案到: {downloaded_file}")
             
-            if downloaded_file:
-                print(f"\n成功下載檔案到: {downloaded_file}")
-                
+            if args.max_memory:
+                if args.data_tiles:
+                    print("--data-tiles 只支援記憶體內流程，串流轉換時略過")
+                if args.composites:
+                    print("--composites 只支援記憶體內流程，串流轉換時略過")
+                if args.contours:
+                    print("--contours 只支援記憶體內流程，串流轉換時略過")
+                # 有記憶體預算時走串流轉換，經由 GeoTIFF 檔案處理
                 # 轉換為 GeoTIFF
                 print("\n" + "="*50)
                 print("開始轉換為 GeoTIFF...")
-                geotiff_file = convert_nc_to_geotiff(downloaded_file)
-                
+                geotiff_file = convert_nc_to_geotiff(
+                    downloaded_file, max_memory=args.max_memory, cog=args.cog_options
+                )
+            
                 if geotiff_file:
                     print(f"成功轉換為 GeoTIFF: {geotiff_file}")
-                    
+                
                     # 創建著色版本
                     print("\n" + "="*50)
                     print("創建著色版本...")
-                    colored_geotiff = create_colored_geotiff(geotiff_file)
-                    
+                    colored_geotiff = create_colored_geotiff(geotiff_file, cog=args.cog_options)
+                
                     # 生成 raster tiles (使用著色版本)
                     print("\n" + "="*50)
                     print("開始生成 raster tiles...")
-                    tiles_dir = generate_tiles(colored_geotiff)
-                    
+                    tiles_dir = generate_tiles(colored_geotiff, incremental=not args.full_tiles,
+                                               archive=args.tile_archive)
+                
                     if tiles_dir:
                         print(f"成功生成 tiles: {tiles_dir}")
                         print("\n" + "="*50)
@@ -720,16 +1336,178 @@ if __name__ == "__main__":
                         print(f"原始 GeoTIFF: {geotiff_file}")
                         print(f"著色 GeoTIFF: {colored_geotiff}")
                         print(f"Tiles 目錄: {tiles_dir}")
+                        tempo_state.record_processed(entry, tiles_dir, validators)
                     else:
                         print("生成 tiles 失敗")
                 else:
                     print("轉換 GeoTIFF 失敗")
             else:
-                print("\n下載失敗")
+                # 解碼、著色與 tiling 全部在記憶體內完成
+                print("\n" + "="*50)
+                print("開始記憶體內處理 (解碼 → 著色 → tiles)...")
+                composites = tempo_composite.CompositeStore() if args.composites else None
+                tiles_dir = process_granule_fused(
+                    downloaded_file,
+                    debug_geotiff=args.debug_geotiff,
+                    incremental=not args.full_tiles,
+                    cog=args.cog_options,
+                    archive=args.tile_archive,
+                    data_tiles_dir=args.data_tiles,
+                    composites=composites,
+                    contours_dir=args.contours,
+                )
+
+                if tiles_dir:
+                    print("\n" + "="*50)
+                    print("處理完成！")
+                    print(f"NetCDF 檔案: {downloaded_file}")
+                    print(f"Tiles 目錄: {tiles_dir}")
+                    if composites is not None:
+                        generate_composite_tiles(composites, args.composites, incremental=not args.full_tiles)
+                    tempo_state.record_processed(entry, tiles_dir, validators)
+                else:
+                    print("生成 tiles 失敗")
+        else:
+            print("\n下載失敗")
+    else:
+        print("無法取得下載連結")
+
+def _product_options(args, product, processes):
+    """run_products 傳給 process_granule_fused 的參數；--data-tiles 等額外輸出只套用於 NO2"""
+    options = dict(
+        debug_geotiff=args.debug_geotiff,
+        incremental=not args.full_tiles,
+        cog=args.cog_options,
+        processes=processes,
+        product=product,
+    )
+    if product is NO2:
+        options.update(
+            archive=args.tile_archive,
+            data_tiles_dir=args.data_tiles,
+            contours_dir=args.contours,
+            composites=tempo_composite.CompositeStore() if args.composites else None,
+        )
+    else:
+        options.update(tiles_dir=str(product.tiles_dir), geotiff_dir=str(product.geotiff_dir),
+                       stations_path=product.stations_path)
+    return options
+
+def _process_product(product, nc_file_path, options):
+    """process pool 的工作函式；fork 出的子 process 沿用已載入的 xarray / rasterio 等模組"""
+    with tempo_metrics.stage("product", product=product.name):
+        return process_granule_fused(nc_file_path, **options)
+
+def _warm_worker():
+    return os.getpid()
+
+def run_products(args, products):
+    """同一次執行處理多個產品的最新 granule
+
+    CMR 查詢與下載在本 process 以執行緒並行，共用一個認證 session；每個下載完成的
+    granule 立即交給 process pool (每個產品一個 worker，平分 CPU 給各自的 tiler)。
+    各產品的處理狀態分別記錄在 product.state_file。
+    """
+    if args.max_memory:
+        print("--products 只支援記憶體內流程，忽略 --max-memory")
+    states = {product: {} if args.force else tempo_state.load_state(product.state_file) for product in products}
+
+    with ThreadPoolExecutor(max_workers=len(products)) as pool:
+        polls = list(pool.map(lambda product: get_latest_nc_download_url(states[product], product), products))
+
+    pending = []
+    for product, (download_url, entry, validators) in zip(products, polls):
+        state = states[product]
+        if entry is None:
+            if state and validators != state.get('cmr'):
+                tempo_state.save_state(dict(state, cmr=validators), product.state_file)
+            print(f"[{product.name}] 沒有新的 granule，略過處理")
+        elif not download_url:
+            print(f"[{product.name}] 無法取得下載連結")
+        else:
+            pending.append((product, download_url, entry, validators))
+    if not pending:
+        return
+
+    # 所有產品同時下載，共用一個足以容納 產品數 × 連線數 的連線池
+    session = get_earthdata_session(tempo_download.pool_size(args.connections, len(pending)))
+
+    def fetch(item):
+        product, download_url, entry, _ = item
+        expected_size, checksum = get_granule_integrity(entry.get("title"), search_params=product.search_params)
+        return download_nc_file(
+            download_url,
+            save_dir=str(product.download_dir),
+            session=session,
+            expected_size=expected_size,
+            checksum=checksum,
+            connections=args.connections,
+            file_prefix=product.file_prefix,
+        )
+
+    workers = len(pending)
+    processes = max(1, (os.cpu_count() or 1) // workers)
+    # fork 讓 worker 直接沿用已載入的模組；須在下載執行緒啟動前建立所有 worker
+    context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+    print(f"處理 {workers} 個產品: {', '.join(item[0].name for item in pending)} "
+          f"({workers} 個 worker，各 {processes} 個 tiling process)")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pool.submit(_warm_worker).result()
+        jobs = {}
+        with ThreadPoolExecutor(max_workers=workers) as downloads:
+            fetches = {downloads.submit(fetch, item): item for item in pending}
+            for future in as_completed(fetches):
+                product, _, entry, validators = fetches[future]
+                downloaded_file = future.result()
+                if not downloaded_file:
+                    print(f"[{product.name}] 下載失敗")
+                    continue
+                print(f"[{product.name}] 下載完成，開始處理: {downloaded_file}")
+                options = _product_options(args, product, processes)
+                jobs[pool.submit(_process_product, product, downloaded_file, options)] = (product, entry, validators)
+
+        for future in as_completed(jobs):
+            product, entry, validators = jobs[future]
+            output = future.result()
+            if not output:
+                print(f"[{product.name}] 生成 tiles 失敗")
+                continue
+            print(f"[{product.name}] 處理完成: {output}")
+            if product is NO2 and args.composites:
+                generate_composite_tiles(tempo_composite.CompositeStore(), args.composites,
+                                         incremental=not args.full_tiles)
+            tempo_state.record_processed(entry, output, validators, path=product.state_file)
+
+if __name__ == "__main__":
+    args = parse_args()
+    tempo_metrics.configure(args.metrics_file, args.profile)
+    if args.check:
+        # 輪詢失敗時以非零代碼結束，讓 workflow 照常執行完整流程
+        sys.exit(check_new_granule(args))
+    try:
+        if args.since:
+            # 補抓一段時間內的所有 granule
+            session = get_earthdata_session(tempo_download.pool_size(args.connections))
+            until = args.until or datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            run_backfill(
+                args.since,
+                until,
+                session,
+                prefetch=args.prefetch,
+                connections=args.connections,
+                keep_nc=args.keep_nc,
+                incremental=not args.full_tiles,
+                cog=args.cog_options,
+                composites_dir=args.composites,
+            )
+        elif args.products:
+            run_products(args, args.products)
         else:
-            print("無法取得下載連結")
+            run_latest(args)
             
     except Exception as e:
         print(f"發生錯誤: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        tempo_metrics.print_summary()
@@ -0,0 +1,245 @@
+"""本機的 Pandora 資料目錄替身：Apache 風格的 HTML 目錄清單與 L2 檔案
+
+用來驗證 fetch_pandora_us_stations.py 的並行爬取與每主機限速，不必打擾真正的 PGN 伺服器：
+
+- 依 --seed 產生固定的測站樹：<測站>/<PandoraNNNsM>/L2/<檔案>.txt，
+  其中混入沒有 Pandora 目錄、沒有 L2 目錄 (404)、L2 內沒有 .txt、北美以外的測站
+- --latency 模擬每個請求的往返延遲
+- 記錄每個請求的時間，按 Enter 或結束時印出請求數、任一秒內的最大請求數與最大同時連線數，
+  用來確認限速有效
+- --expected 寫出爬取結果應有的 GeoJSON，可直接與爬蟲輸出比較
+- L2 檔案帶 ETag / Last-Modified，條件請求未變更時回應 304；--moved 讓部分檔案的座標改變
+
+在 scripts/ 目錄下執行:
+    python pandora_mock_server.py --stations 80 --latency 100 --expected /tmp/pandora-expected.geojson
+    python fetch_pandora_us_stations.py --base http://127.0.0.1:8810/ --output /tmp/pandora.geojson
+"""
+import argparse
+import hashlib
+import html
+import json
+import random
+import signal
+import sys
+import threading
+import time
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LAST_MODIFIED = formatdate(1735689600, usegmt=True)
+
+
+def build_tree(stations, seed=0, moved=0):
+    """回傳 ({目錄路徑: [子項目]}, {檔案路徑: 內容}, 預期的 features)
+
+    moved：前幾個有 L2 檔案的儀器座標偏移 0.5 度 (檔案內容與 ETag 隨之改變)，
+    用來驗證爬蟲的座標快取只重新讀取變更的檔案
+    """
+    rng = random.Random(seed)
+    dirs = {"/": []}
+    files = {}
+    features = []
+    for i in range(stations):
+        station = f"Station{i:03d}"
+        station_dir = f"/{station}/"
+        dirs["/"].append(f"{station}/")
+        dirs[station_dir] = ["calibration/"]
+        dirs[f"{station_dir}calibration/"] = []
+        kind = rng.random()
+        if kind < 0.1:
+            # 沒有 Pandora 儀器的測站
+            continue
+        for _ in range(rng.choice((1, 1, 1, 2, 3))):
+            instrument = f"Pandora{rng.randint(2, 250)}s{rng.randint(1, 2)}"
+            if f"{instrument}/" in dirs[station_dir]:
+                continue
+            instrument_dir = f"{station_dir}{instrument}/"
+            dirs[station_dir].append(f"{instrument}/")
+            dirs[instrument_dir] = []
+            roll = rng.random()
+            if roll < 0.08:
+                # 沒有 L2 目錄：回應 404
+                continue
+            l2_dir = f"{instrument_dir}L2/"
+            dirs[instrument_dir].append("L2/")
+            dirs[l2_dir] = []
+            if roll < 0.15:
+                dirs[l2_dir].append("README.md")
+                continue
+            if roll < 0.7:
+                lat, lon = rng.uniform(20, 60), rng.uniform(-160, -60)
+            else:
+                lat, lon = rng.uniform(-40, 60), rng.uniform(-10, 140)
+            if moved > 0:
+                moved -= 1
+                lat += 0.5
+            for day in range(rng.randint(1, 4)):
+                name = f"{instrument}_{station}_L2_rnvh3p1-8_2025{day + 1:02d}01.txt"
+                dirs[l2_dir].append(name)
+                files[l2_dir + name] = (
+                    f"File name: {name}\n"
+                    f"Short location name: {station}\n"
+                    f"Location latitude [deg]: {lat:.4f}\n"
+                    f"Location longitude [deg]: {lon:.4f}\n"
+                    f"Location altitude [m]: {rng.uniform(0, 2000):.0f}\n"
+                    + "---------------------------------------------------------------\n" * 2000
+                )
+            if 5 <= lat <= 83 and -170 <= lon <= -50:
+                features.append({
+                    "type": "Feature",
+                    "geometry": {"type": "Point", "coordinates": [float(f"{lon:.4f}"), float(f"{lat:.4f}")]},
+                    "properties": {"station": station, "instrument": instrument},
+                })
+    features.sort(key=lambda f: (f["properties"]["station"], f["properties"]["instrument"]))
+    return dirs, files, features
+
+
+class RequestLog:
+    """請求時間與同時連線數的統計"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.times = []
+        self.active = 0
+        self.peak_active = 0
+        self.not_modified_count = 0
+
+    def enter(self):
+        with self.lock:
+            self.times.append(time.monotonic())
+            self.active += 1
+            self.peak_active = max(self.peak_active, self.active)
+
+    def not_modified(self):
+        with self.lock:
+            self.not_modified_count += 1
+
+    def leave(self):
+        with self.lock:
+            self.active -= 1
+
+    def summary(self):
+        with self.lock:
+            times = sorted(self.times)
+            peak_active = self.peak_active
+            not_modified = self.not_modified_count
+        # 任一 1 秒視窗內的最大請求數
+        peak_rate, start = 0, 0
+        for end, t in enumerate(times):
+            while t - times[start] >= 1.0:
+                start += 1
+            peak_rate = max(peak_rate, end - start + 1)
+        span = times[-1] - times[0] if len(times) > 1 else 0
+        return (f"{len(times)} 個請求 ({not_modified} 個 304)，歷時 {span:.1f}s，"
+                f"任一秒最多 {peak_rate} 個請求，最多同時 {peak_active} 個連線")
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # 爬蟲讀完檔案開頭就關閉連線，不必印出 traceback
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+def make_handler(dirs, files, log, latency, verbose):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            log.enter()
+            try:
+                if latency:
+                    time.sleep(latency)
+                path = self.path.split("?", 1)[0]
+                if path in dirs:
+                    self._listing(path)
+                elif path in files:
+                    self._file(files[path].encode("utf-8"))
+                else:
+                    self._send(404, b"Not Found", "text/plain")
+            finally:
+                log.leave()
+
+        def _listing(self, path):
+            rows = ['<a href="../">Parent Directory</a>'] if path != "/" else []
+            rows += [f'<a href="{html.escape(name)}">{html.escape(name)}</a>' for name in sorted(dirs[path])]
+            body = (f"<html><head><title>Index of {html.escape(path)}</title></head><body>"
+                    f"<h1>Index of {html.escape(path)}</h1><pre>" + "\n".join(rows) + "</pre></body></html>")
+            self._send(200, body.encode("utf-8"), "text/html")
+
+        def _file(self, body):
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if etag in self.headers.get("If-None-Match", ""):
+                log.not_modified()
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            self._send(200, body, "text/plain", {"ETag": etag, "Last-Modified": LAST_MODIFIED})
+
+        def _send(self, status, body, content_type, headers=None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            try:
+                self.wfile.write(body)
+            except ConnectionError:
+                pass
+
+        def log_message(self, fmt, *args):
+            if verbose:
+                super().log_message(fmt, *args)
+
+    return Handler
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for the Pandora data directory listings.")
+    ap.add_argument("--stations", type=int, default=60, help="測站數")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8810)
+    ap.add_argument("--latency", type=float, default=100, help="每個請求的延遲 (毫秒)")
+    ap.add_argument("--moved", type=int, default=0, help="座標偏移的儀器數 (模擬更新過的 L2 檔案)")
+    ap.add_argument("--expected", help="寫出預期的 GeoJSON 到此路徑")
+    ap.add_argument("--verbose", action="store_true", help="印出每個請求")
+    args = ap.parse_args()
+
+    dirs, files, features = build_tree(args.stations, args.seed, args.moved)
+    if args.expected:
+        with open(args.expected, "w", encoding="utf-8") as f:
+            json.dump({"type": "FeatureCollection", "features": features}, f, ensure_ascii=False, indent=2)
+
+    log = RequestLog()
+    server = QuietServer((args.host, args.port),
+                         make_handler(dirs, files, log, args.latency / 1000, args.verbose))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"✓ {args.stations} 個測站、{len(files)} 個 L2 檔案，預期 {len(features)} 個北美 features")
+    print(f"目錄清單: http://{args.host}:{args.port}/")
+    print("按 Enter 印出請求統計，Ctrl+C 結束")
+    # 在背景執行時以 kill 結束，同樣印出統計
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        while True:
+            try:
+                input()
+            except EOFError:
+                # 在背景執行 (stdin 關閉) 時持續服務
+                while True:
+                    time.sleep(3600)
+            print(log.summary())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(log.summary())
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""NASA Earthdata 認證：可重複使用的 session 與磁碟上的 token / cookie 快取
+
+- 以帳密向 URS 取得 (或沿用) bearer token，連同到期時間快取在磁碟上，
+  之後的執行直接帶 Authorization: Bearer 下載，不必每次走重定向登入流程
+- 無法取得 token 時退回 URS cookie 流程，cookie jar 同樣存到磁碟供下次沿用
+- 只有在收到 401 時才重新認證，多條下載連線共用同一份憑證
+"""
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+from http.cookiejar import LWPCookieJar
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.utils import get_netrc_auth
+
+# URS 的位置 (可指向 tempo_mock_server.py 在無網路環境下測試)
+URS_URL = os.environ.get("TEMPO_URS_URL", "https://urs.earthdata.nasa.gov").rstrip("/")
+URS_HOST = urlparse(URS_URL).hostname
+TOKEN_URL = f"{URS_URL}/api/users/find_or_create_token"
+TOKEN_CACHE_NAME = "earthdata_token.json"
+COOKIE_CACHE_NAME = "earthdata_cookies.txt"
+
+# 距離到期不到此時間的 token 視為失效，提前換新
+TOKEN_EXPIRY_MARGIN = timedelta(days=1)
+# URS 沒有回傳到期日時假設的有效期 (URS token 實際為 60 天)
+TOKEN_DEFAULT_LIFETIME = timedelta(days=30)
+
+
+def netrc_credentials():
+    """從 ~/.netrc 取得 URS 帳密，沒有時回傳 None"""
+    return get_netrc_auth(URS_URL)
+
+
+def _parse_expiration(text):
+    for fmt in ("%m/%d/%Y", "%Y-%m-%dT%H:%M:%S%z", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(text, fmt)
+        except (TypeError, ValueError):
+            continue
+        return parsed if parsed.tzinfo else parsed.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) + TOKEN_DEFAULT_LIFETIME
+
+
+def _write_private(path, text):
+    """寫入只有擁有者可讀寫的檔案 (token/cookie 等同密碼)"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+class EarthdataSession(requests.Session):
+    """已認證的 Earthdata session，token 或 cookie 快取在 cache_dir"""
+
+    def __init__(self, username=None, password=None, cache_dir=None, pool_size=None):
+        super().__init__()
+        # 連線池只在建立 session 時設定一次：所有平行下載 (包含 --products 的多個產品) 共用，
+        # 下載途中不再替換 adapter
+        if pool_size:
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            self.mount('https://', adapter)
+            self.mount('http://', adapter)
+        self.credentials = (username, password) if username and password else netrc_credentials()
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.token = None
+        self._lock = threading.Lock()
+
+        # 讓 session 自動處理重定向和 cookies
+        self.max_redirects = 10
+        # 設定 User-Agent，某些服務需要
+        self.headers.update({'User-Agent': 'Aircast/1.0 (Python requests)'})
+
+    @property
+    def uses_token(self):
+        """是否以 bearer token 認證 (下載時可略過重定向登入流程)"""
+        return self.token is not None
+
+    def _cache_path(self, name):
+        return self.cache_dir / name if self.cache_dir else None
+
+    def has_cached_token(self):
+        return self._load_cached_token() is not None
+
+    def login(self):
+        """依序使用：快取的 token → 向 URS 取得新 token → 快取的 cookie + 帳密"""
+        token = self._load_cached_token()
+        if token:
+            print("✓ 使用快取的 Earthdata token")
+        elif self.credentials:
+            token = self._request_token()
+        if token:
+            self._use_token(token)
+            return self
+
+        print("改用 URS cookie 認證流程")
+        self.auth = self.credentials
+        self._load_cookies()
+        return self
+
+    def _load_cached_token(self):
+        path = self._cache_path(TOKEN_CACHE_NAME)
+        if path is None:
+            return None
+        try:
+            cached = json.loads(path.read_text(encoding='utf-8'))
+            expires = datetime.fromisoformat(cached['expires_at'])
+        except (OSError, ValueError, KeyError):
+            return None
+        # token 屬於取得它的帳號：換了 EARTHDATA_USERNAME (或共用 cache_dir) 時不沿用
+        if not self.credentials or cached.get('username') != self.credentials[0]:
+            return None
+        if expires - TOKEN_EXPIRY_MARGIN <= datetime.now(timezone.utc):
+            print("快取的 Earthdata token 即將到期，重新取得")
+            return None
+        return cached['access_token']
+
+    def _request_token(self):
+        """向 URS 取得 (或沿用既有的) token 並寫入快取，失敗時回傳 None"""
+        try:
+            response = requests.post(TOKEN_URL, auth=self.credentials, timeout=30)
+            response.raise_for_status()
+            payload = response.json()
+            token = payload['access_token']
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print(f"⚠ 無法取得 Earthdata token: {e}")
+            return None
+
+        expires = _parse_expiration(payload.get('expiration_date'))
+        path = self._cache_path(TOKEN_CACHE_NAME)
+        if path is not None:
+            _write_private(path, json.dumps({
+                'username': self.credentials[0],
+                'access_token': token,
+                'expires_at': expires.isoformat(),
+            }))
+        print(f"✓ 取得 Earthdata token (到期 {expires:%Y-%m-%d})")
+        return token
+
+    def _use_token(self, token):
+        self.token = token
+        # bearer token 與 basic auth 不能並用；跨主機重定向 (例如 S3) 時 requests 會自動移除此 header
+        self.auth = None
+        self.headers['Authorization'] = f"Bearer {token}"
+
+    def _load_cookies(self):
+        path = self._cache_path(COOKIE_CACHE_NAME)
+        if path is None or not path.exists():
+            return
+        jar = LWPCookieJar(str(path))
+        try:
+            jar.load(ignore_discard=True)
+        except (OSError, ValueError):
+            return
+        # 過期的 cookie 不載入
+        jar.clear_expired_cookies()
+        self.cookies.update(jar)
+        print(f"載入快取的 URS cookie ({len(jar)} 個)")
+
+    def save_cookies(self):
+        """把 cookie 流程取得的 cookie 存到磁碟，下次執行直接沿用"""
+        path = self._cache_path(COOKIE_CACHE_NAME)
+        if path is None or self.uses_token:
+            return
+        jar = LWPCookieJar()
+        for cookie in self.cookies:
+            jar.set_cookie(cookie)
+        # as_lwp_str 不含檔頭，少了它 LWPCookieJar.load 會拒絕讀取
+        _write_private(path, "#LWP-Cookies-2.0\n" + jar.as_lwp_str(ignore_discard=True, ignore_expires=False))
+
+    def _reauthenticate(self, used_authorization):
+        """收到 401 後重新認證；其他執行緒已更新過憑證時直接沿用"""
+        with self._lock:
+            if self.uses_token:
+                if self.headers.get('Authorization') != used_authorization:
+                    return
+                print("Earthdata token 被拒絕 (401)，重新取得")
+                path = self._cache_path(TOKEN_CACHE_NAME)
+                if path is not None:
+                    path.unlink(missing_ok=True)
+                token = self._request_token()
+                if token:
+                    self._use_token(token)
+                    return
+                # 取不到新 token 時退回 cookie 流程
+                self.token = None
+                self.headers.pop('Authorization', None)
+                self.auth = self.credentials
+            else:
+                print("URS cookie 失效 (401)，清除後重新登入")
+                self.cookies.clear()
+                path = self._cache_path(COOKIE_CACHE_NAME)
+                if path is not None:
+                    path.unlink(missing_ok=True)
+
+    def request(self, method, url, **kwargs):
+        used_authorization = self.headers.get('Authorization')
+        response = super().request(method, url, **kwargs)
+        if response.status_code != 401 or self.credentials is None:
+            return response
+
+        response.close()
+        self._reauthenticate(used_authorization)
+        return super().request(method, url, **kwargs)
@@ -0,0 +1,136 @@
+"""TEMPO NO2 著色核心
+
+把浮點 NO2 格網正規化成 0-255 調色盤索引 (0 = 無資料)，結果與原本
+create_colored_geotiff 的 np.where/np.clip 寫法逐像素相同，但：
+
+- 顏色表只建立一次，快取成 (256, 4) uint8 查找表
+- 以 cache 大小的列區塊處理，暫存緩衝區預先配置並重複使用
+- 區塊分配給多個執行緒 (NumPy ufunc 執行時會釋放 GIL)
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+# 每個區塊的浮點暫存大小，約為一般 L2 cache
+COLORIZE_BLOCK_BYTES = int(os.environ.get("TEMPO_COLORIZE_BLOCK_BYTES", 512 * 1024))
+# 允許透過環境變數覆寫著色的執行緒數量
+COLORIZE_THREADS = int(os.environ.get("TEMPO_COLORIZE_THREADS", os.cpu_count() or 1))
+
+COLOR_ANCHORS = [
+    (0, (0, 0, 0, 0)),            # 透明背景
+    (1, (0, 0, 140, 255)),        # 深藍
+    (64, (0, 120, 255, 255)),     # 藍
+    (128, (0, 255, 170, 255)),    # 綠
+    (192, (255, 255, 0, 255)),    # 黃
+    (255, (255, 0, 0, 255)),      # 紅
+]
+
+
+@lru_cache(maxsize=None)
+def _color_ramp_items():
+    ramp = {}
+    for (start_idx, start_col), (end_idx, end_col) in zip(COLOR_ANCHORS[:-1], COLOR_ANCHORS[1:]):
+        span = max(end_idx - start_idx, 1)
+        for i in range(span):
+            t = i / span
+            rgba = tuple(
+                int(round(start_col[channel] + t * (end_col[channel] - start_col[channel])))
+                for channel in range(4)
+            )
+            ramp[start_idx + i] = rgba
+    ramp[COLOR_ANCHORS[-1][0]] = COLOR_ANCHORS[-1][1]
+    return tuple(sorted(ramp.items()))
+
+
+def build_color_ramp():
+    """建立 0-255 的平滑顏色表 (RGBA)，格式為 rasterio write_colormap 使用的 dict。"""
+    return dict(_color_ramp_items())
+
+
+@lru_cache(maxsize=None)
+def color_ramp_lut():
+    """快取的 (256, 4) uint8 顏色查找表 (唯讀)。"""
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    for index, rgba in _color_ramp_items():
+        lut[index] = rgba
+    lut.setflags(write=False)
+    return lut
+
+
+def _block_rows(width, itemsize):
+    return max(1, COLORIZE_BLOCK_BYTES // max(1, width * itemsize))
+
+
+def _colorize_rows(data, out, row_start, row_stop, data_min, range_span, work_dtype):
+    """處理 [row_start, row_stop) 這段列，區塊暫存在此執行緒內重複使用。"""
+    width = data.shape[1]
+    step = _block_rows(width, np.dtype(work_dtype).itemsize)
+    scratch = np.empty((step, width), dtype=work_dtype)
+    invalid = np.empty((step, width), dtype=bool)
+
+    with np.errstate(invalid='ignore'):
+        for start in range(row_start, row_stop, step):
+            stop = min(start + step, row_stop)
+            rows = stop - start
+            block = data[start:stop]
+            tmp = scratch[:rows]
+            bad = invalid[:rows]
+            target = out[start:stop]
+
+            # 與 (data - data_min) / range_span → clip → * 255 → uint8 相同的運算順序
+            np.subtract(block, data_min, out=tmp, casting='unsafe')
+            np.divide(tmp, range_span, out=tmp)
+            np.clip(tmp, 0, 1, out=tmp)
+            np.multiply(tmp, 255, out=tmp)
+            np.copyto(target, tmp, casting='unsafe')
+
+            # 非有限值 (NaN/Inf) 一律為 0 (透明)
+            np.isfinite(block, out=bad)
+            np.logical_not(bad, out=bad)
+            np.copyto(target, 0, where=bad)
+
+
+def colorize(data, data_min, data_max, out=None, threads=None):
+    """把 NO2 格網正規化成 uint8 調色盤索引，並回報吞吐量 (MP/s)。"""
+    threads = COLORIZE_THREADS if threads is None else threads
+    data = np.asarray(data)
+    squeeze = data.ndim == 1
+    if squeeze:
+        data = data[np.newaxis, :]
+    if out is None:
+        out = np.empty(data.shape, dtype=np.uint8)
+
+    started = time.perf_counter()
+    range_span = data_max - data_min
+    # 實際使用的執行緒數 (列數少於 threads 時較少)
+    used_threads = 1
+    if range_span <= 0 or data.size == 0:
+        out.fill(0)
+    else:
+        # 以極小的試算決定與原本陣列運算相同的浮點精度
+        work_dtype = ((data[:1, :1] - data_min) / range_span).dtype
+        height = data.shape[0]
+        workers = max(1, min(threads, height))
+        bounds = np.linspace(0, height, workers + 1).astype(int)
+        jobs = [(int(a), int(b)) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+        used_threads = max(1, len(jobs))
+
+        if len(jobs) == 1:
+            _colorize_rows(data, out, *jobs[0], data_min, range_span, work_dtype)
+        else:
+            with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+                futures = [
+                    pool.submit(_colorize_rows, data, out, a, b, data_min, range_span, work_dtype)
+                    for a, b in jobs
+                ]
+                for future in futures:
+                    future.result()
+
+    elapsed = time.perf_counter() - started
+    megapixels = data.size / 1e6
+    print(f"著色: {megapixels:.1f} MP，耗時 {elapsed:.3f}s ({megapixels / max(elapsed, 1e-9):.1f} MP/s，"
+          f"{used_threads} 執行緒)")
+    return out[0] if squeeze else out
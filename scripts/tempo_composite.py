@@ -0,0 +1,257 @@
+"""最近數個 granule 的 NO2 時間合成 (rolling mean / max)
+
+白天的 TEMPO 掃描雜訊大、又有雲遮造成的缺漏，合成圖以最近 N 小時內所有 granule 的
+平均與最大值呈現。每個視窗在磁碟上保留三個與格網同大小的累加器：
+
+- sum (float64)、count (uint16)：平均 = sum / count
+- max (float32)：逐像素最大值
+
+新 granule 進來時只需把它加進各視窗 (O(格網))；滑出視窗的 granule 以它留存的格網
+(float32 .npy) 從 sum / count 扣除，不必重新讀取舊的 .nc。max 無法相減，只在
+「被移除的 granule 正是最大值」的像素上，從視窗內其餘 granule 的 memmap 重新取最大值。
+
+累加器以 memmap 原地更新；更新中途中斷時 composites.json 留有 pending 標記，
+下次載入會以留存的 granule 格網重建累加器。
+"""
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+COMPOSITE_DIR = Path(os.environ.get("TEMPO_COMPOSITE_DIR", "../.cache/tempo/composites"))
+# 合成視窗 (以最新 granule 的觀測時間往回算)，例如 "3h,24h"
+COMPOSITE_WINDOWS = os.environ.get("TEMPO_COMPOSITE_WINDOWS", "3h,24h")
+STATE_NAME = "composites.json"
+TIME_FORMAT = "%Y%m%dT%H%M%SZ"
+
+
+def parse_windows(text):
+    """'3h,24h' 或 '90m,1d' → {名稱: timedelta}"""
+    units = {'m': 'minutes', 'h': 'hours', 'd': 'days'}
+    windows = {}
+    for name in (part.strip().lower() for part in text.split(',')):
+        if not name:
+            continue
+        if name[-1] not in units:
+            raise ValueError(f"無法解析合成視窗: {name} (例如 3h、24h、1d)")
+        windows[name] = timedelta(**{units[name[-1]]: float(name[:-1])})
+    return windows
+
+
+def _parse_time(key):
+    return datetime.strptime(key, TIME_FORMAT).replace(tzinfo=timezone.utc)
+
+
+class CompositeStore:
+    """各視窗的 sum / count / max 累加器與視窗內 granule 的留存格網"""
+
+    def __init__(self, directory=COMPOSITE_DIR, windows=None):
+        self.directory = Path(directory)
+        self.windows = parse_windows(COMPOSITE_WINDOWS) if windows is None else windows
+        self.state = self._load_state()
+
+    # --- 狀態與檔案 ---
+
+    def _load_state(self):
+        try:
+            state = json.loads((self.directory / STATE_NAME).read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {'grid': None, 'granules': [], 'windows': {}}
+        # 視窗設定改變時：移除的視窗刪除累加器，新視窗的成員由留存的 granule 重建
+        for name in list(state['windows']):
+            if name not in self.windows:
+                del state['windows'][name]
+                shutil.rmtree(self.directory / name, ignore_errors=True)
+        for name in self.windows:
+            if name not in state['windows']:
+                state['windows'][name] = {'members': [], 'pending': True}
+        return state
+
+    def _save_state(self):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / STATE_NAME
+        tmp_path = path.with_name(path.name + '.tmp')
+        tmp_path.write_text(json.dumps(self.state, indent=2), encoding='utf-8')
+        os.replace(tmp_path, path)
+
+    def _granule_path(self, key):
+        return self.directory / "granules" / f"{key}.npy"
+
+    def _accumulator_path(self, name, kind):
+        return self.directory / name / f"{kind}.npy"
+
+    def _open(self, name, kind):
+        return np.load(self._accumulator_path(name, kind), mmap_mode='r+')
+
+    def _create_accumulators(self, name):
+        shape = tuple(self.state['grid']['shape'])
+        window_dir = self.directory / name
+        window_dir.mkdir(parents=True, exist_ok=True)
+        for kind, dtype, fill in (('sum', np.float64, 0), ('count', np.uint16, 0), ('max', np.float32, np.nan)):
+            array = np.lib.format.open_memmap(self._accumulator_path(name, kind), mode='w+',
+                                              dtype=dtype, shape=shape)
+            array[:] = fill
+            array.flush()
+            del array
+
+    def _reset(self, shape, bounds):
+        """格網大小或範圍改變時清除所有累加器"""
+        if self.state.get('grid') is not None:
+            print("合成: 格網與累加器不同，清除重建")
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.state = {
+            'grid': {'shape': list(shape), 'bounds': [float(v) for v in bounds]},
+            'granules': [],
+            'windows': {name: {'members': []} for name in self.windows},
+        }
+        for name in self.windows:
+            self._create_accumulators(name)
+        self._save_state()
+
+    # --- 累加 ---
+
+    def _apply(self, name, values, sign):
+        """把一個 granule 的格網加進 (sign=1) 或移出 (sign=-1) 視窗的 sum / count"""
+        total, count = self._open(name, 'sum'), self._open(name, 'count')
+        valid = np.isfinite(values)
+        np.add(total, values if sign > 0 else -values.astype(np.float64), out=total, where=valid)
+        (np.add if sign > 0 else np.subtract)(count, np.uint16(1), out=count, where=valid)
+        if sign < 0:
+            # 沒有任何 granule 的像素歸零，避免加減之間累積的捨入誤差
+            total[count == 0] = 0
+        total.flush()
+        count.flush()
+        return valid
+
+    def _add(self, name, values):
+        self._apply(name, values, 1)
+        maximum = self._open(name, 'max')
+        np.fmax(maximum, values, out=maximum)
+        maximum.flush()
+
+    def _remove(self, name, key, members):
+        """移除 key；members 為移除後仍在視窗內的 granule"""
+        values = np.load(self._granule_path(key), mmap_mode='r')
+        valid = self._apply(name, values, -1)
+
+        maximum = self._open(name, 'max')
+        flat_max = maximum.reshape(-1)
+        affected = np.flatnonzero(valid & (maximum == values))
+        if affected.size:
+            # 只在被移除的 granule 為最大值的像素重新計算
+            recomputed = np.full(affected.size, np.nan, dtype=np.float32)
+            for member in members:
+                other = np.load(self._granule_path(member), mmap_mode='r').reshape(-1)
+                np.fmax(recomputed, other[affected], out=recomputed)
+            flat_max[affected] = recomputed
+        maximum.flush()
+
+    def _rebuild(self, name):
+        """以留存的 granule 格網重建視窗的累加器 (中斷後或新增視窗時)"""
+        print(f"合成: 重建 {name} 視窗的累加器")
+        self._create_accumulators(name)
+        window = self.state['windows'][name]
+        window['members'] = self._members_in_window(name, self.state['granules'])
+        for key in window['members']:
+            self._add(name, np.load(self._granule_path(key), mmap_mode='r'))
+        window.pop('pending', None)
+
+    def _members_in_window(self, name, keys):
+        if not keys:
+            return []
+        end = max(_parse_time(key) for key in keys)
+        start = end - self.windows[name]
+        return sorted(key for key in keys if _parse_time(key) > start)
+
+    def add(self, key, grid, bounds):
+        """加入一個 granule (key 為觀測時間，例如 20251002T133140Z)，回傳內容有變動的視窗"""
+        shape = grid.shape
+        grid_info = self.state.get('grid')
+        if (grid_info is None or tuple(grid_info['shape']) != shape
+                or not np.allclose(grid_info['bounds'], bounds)):
+            self._reset(shape, bounds)
+
+        values = np.asarray(grid, dtype=np.float32)
+        granule_path = self._granule_path(key)
+        replaced = key in self.state['granules']
+        if replaced:
+            # 同一觀測時間重新處理 (新版本)：先以舊格網移出，再加入新的
+            for name, window in self.state['windows'].items():
+                if key in window['members'] and not window.get('pending'):
+                    window['members'].remove(key)
+                    self._remove(name, key, window['members'])
+            self.state['granules'].remove(key)
+
+        granule_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = granule_path.with_name(f"{key}.tmp.npy")
+        np.save(tmp_path, values)
+        os.replace(tmp_path, granule_path)
+        self.state['granules'] = sorted(self.state['granules'] + [key])
+
+        changed = []
+        for name, window in self.state['windows'].items():
+            if window.get('pending'):
+                self._rebuild(name)
+                self._save_state()
+                changed.append(name)
+                continue
+
+            members = self._members_in_window(name, self.state['granules'])
+            if key not in members:
+                print(f"合成: {key} 早於 {name} 視窗，略過")
+                continue
+            evicted = [m for m in window['members'] if m not in members]
+            window['pending'] = True
+            self._save_state()
+            remaining = [m for m in window['members'] if m in members]
+            for old in evicted:
+                self._remove(name, old, remaining)
+            self._add(name, values)
+            window['members'] = members
+            window.pop('pending', None)
+            self._save_state()
+            changed.append(name)
+            print(f"合成 {name}: 加入 {key}，移出 {len(evicted)} 個，視窗內 {len(members)} 個 granule")
+
+        self._prune()
+        return changed
+
+    def _prune(self):
+        """刪除已不在任何視窗內的 granule 格網"""
+        keep = set()
+        for name, window in self.state['windows'].items():
+            keep.update(window['members'])
+            keep.update(self._members_in_window(name, self.state['granules']))
+        stale = [key for key in self.state['granules'] if key not in keep]
+        for key in stale:
+            self._granule_path(key).unlink(missing_ok=True)
+        if stale:
+            self.state['granules'] = [key for key in self.state['granules'] if key in keep]
+            self._save_state()
+
+    # --- 輸出 ---
+
+    @property
+    def bounds(self):
+        return tuple(self.state['grid']['bounds'])
+
+    def window_info(self, name):
+        """視窗的時間範圍與 granule 數"""
+        members = self.state['windows'][name]['members']
+        return {
+            'window': name,
+            'hours': self.windows[name].total_seconds() / 3600,
+            'start': members[0] if members else None,
+            'end': members[-1] if members else None,
+            'granules': members,
+        }
+
+    def composite(self, name):
+        """回傳 (mean, max) 兩個 float32 北→南格網，沒有資料的像素為 NaN"""
+        total, count = self._open(name, 'sum'), self._open(name, 'count')
+        mean = np.full(total.shape, np.nan, dtype=np.float32)
+        np.divide(total, count, out=mean, where=count > 0, casting='unsafe')
+        return mean, np.array(self._open(name, 'max'))
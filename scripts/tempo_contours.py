@@ -0,0 +1,362 @@
+"""NO2 等值帶向量圖層 (依 zoom 簡化的 GeoJSON)
+
+從解碼後的格網 (EPSG:4326, 北→南) 依設定的 NO2 門檻切出等值帶多邊形
+(門檻 i ≤ 數值 < 門檻 i+1)，前端可自行設定填色、線條與透明度，不必重新著色 raster tile。
+
+每個 zoom 各輸出一個 GeoJSON，簡化程度依該 zoom 的螢幕像素決定：
+
+- 格網先以 2 的次方倍做區塊平均，使一個格網像素不大於容許誤差，再分類、
+  以 rasterio (GDAL polygonize) 一次向量化
+- 面積小於 TEMPO_CONTOUR_MIN_PIXELS 個像素的區塊先以 sieve 併入鄰近的帶
+- 所有多邊形來自同一張分類格網，邊界在節點處切成共用邊 (arc)，每條 arc 只以
+  Douglas-Peucker 簡化一次，相鄰等值帶的邊界仍完全重合，不會有縫隙或重疊
+- 座標依 zoom 四捨五入到足夠的小數位
+
+超過格網解析度的 zoom 不再輸出 (前端放大最後一層即可)；index.json 列出門檻與各 zoom 的檔案。
+"""
+import json
+import math
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+from rasterio import features
+from rasterio.transform import Affine
+
+TILE_SIZE = 256
+# 等值帶門檻 (molecules/cm²)，以逗號分隔
+CONTOUR_LEVELS = os.environ.get("TEMPO_CONTOUR_LEVELS", "2e15,4e15,6e15,8e15,1e16,1.5e16,2e16")
+# 簡化容許的誤差 (螢幕像素)
+CONTOUR_TOLERANCE = float(os.environ.get("TEMPO_CONTOUR_TOLERANCE", 1))
+# 小於此像素數的區塊併入鄰近的帶 (0 表示不處理)
+CONTOUR_MIN_PIXELS = int(os.environ.get("TEMPO_CONTOUR_MIN_PIXELS", 16))
+INDEX_NAME = "index.json"
+
+
+def parse_levels(text):
+    """'2e15,4e15,1e16' → 遞增的門檻 list"""
+    levels = sorted(float(part) for part in text.split(',') if part.strip())
+    if not levels:
+        raise ValueError(f"無法解析等值帶門檻: {text!r}")
+    return levels
+
+
+def screen_pixel_degrees(zoom):
+    """zoom 等級下一個螢幕像素的經度寬度"""
+    return 360.0 / (TILE_SIZE * 2 ** zoom)
+
+
+def zoom_factor(zoom, grid_degrees, tolerance=None):
+    """該 zoom 的區塊平均倍率 (2 的次方，至少 1)"""
+    tolerance = CONTOUR_TOLERANCE if tolerance is None else tolerance
+    ratio = tolerance * screen_pixel_degrees(zoom) / grid_degrees
+    return 2 ** max(0, int(math.floor(math.log2(ratio)))) if ratio >= 1 else 1
+
+
+def block_mean(grid, factor):
+    """factor × factor 區塊平均 (忽略 NaN)，邊緣不足一個區塊的部分以 NaN 補齊"""
+    if factor == 1:
+        return grid
+    height, width = grid.shape
+    padded_height, padded_width = -(-height // factor) * factor, -(-width // factor) * factor
+    padded = np.full((padded_height, padded_width), np.nan, dtype=np.float32)
+    padded[:height, :width] = grid
+    blocks = padded.reshape(padded_height // factor, factor, padded_width // factor, factor)
+    valid = np.isfinite(blocks)
+    count = valid.sum(axis=(1, 3))
+    total = np.where(valid, blocks, 0).sum(axis=(1, 3), dtype=np.float64)
+    mean = np.full(count.shape, np.nan, dtype=np.float32)
+    np.divide(total, count, out=mean, where=count > 0, casting='unsafe')
+    return mean
+
+
+def classify(grid, levels, min_pixels=None):
+    """數值 → 等值帶編號 (0 為無資料或低於最低門檻，i 為 levels[i-1] ≤ 數值 < levels[i])"""
+    min_pixels = CONTOUR_MIN_PIXELS if min_pixels is None else min_pixels
+    bands = np.digitize(grid, levels).astype(np.uint8)
+    bands[~np.isfinite(grid)] = 0
+    if min_pixels > 1:
+        bands = features.sieve(bands, size=min_pixels, connectivity=4)
+    return bands
+
+
+def junctions(bands):
+    """(高+1, 寬+1) 布林陣列：格網角點是否為等值帶邊界的節點
+
+    角點四周的四個像素 (格網外視為 0) 有三種以上的帶，或兩種帶呈對角排列時，
+    邊界在此分岔；其餘邊界上的角點只屬於一條兩側固定的邊。
+    """
+    padded = np.pad(bands, 1)
+    corners = np.stack([padded[:-1, :-1], padded[:-1, 1:], padded[1:, :-1], padded[1:, 1:]], axis=-1)
+    ordered = np.sort(corners, axis=-1)
+    distinct = 1 + (ordered[..., 1:] != ordered[..., :-1]).sum(axis=-1)
+    diagonal = ((distinct == 2) & (corners[..., 0] == corners[..., 3])
+                & (corners[..., 1] == corners[..., 2]) & (corners[..., 0] != corners[..., 1]))
+    return (distinct >= 3) | diagonal
+
+
+class ArcTopology:
+    """把 polygonize 輸出的 ring 拆成共用邊 (arc)，簡化後再組回 ring
+
+    GDAL 只輸出轉折點，T 形節點在直線那一側的 ring 上不存在，因此先把落在線段上的節點
+    插回 ring，再於節點處切成 arc。arc 以固定方向 (起點座標較小者在前) 去除重複，
+    相鄰兩個多邊形引用同一條 arc，簡化後的邊界仍完全重合。
+    """
+
+    def __init__(self, bands):
+        self.nodes = junctions(bands)
+        height, width = bands.shape
+        self.row_stride, self.col_stride = width + 1, height + 1
+        rows, cols = np.nonzero(self.nodes)
+        # 節點依列 (水平線段查詢) 與依欄 (垂直線段查詢) 排序的一維 key
+        self.row_keys = np.sort(rows * self.row_stride + cols)
+        self.col_keys = np.sort(cols * self.col_stride + rows)
+        self.arcs = []
+        self._arc_ids = {}
+
+    def _insert_nodes(self, points):
+        """把位於 ring 線段內部的節點插入 (points 不含重複的結尾點)"""
+        following = np.concatenate([points[1:], points[:1]])
+        horizontal = points[:, 1] == following[:, 1]
+        low = np.minimum(points, following)
+        high = np.maximum(points, following)
+        line = np.where(horizontal, points[:, 1] * self.row_stride, points[:, 0] * self.col_stride)
+        low = line + np.where(horizontal, low[:, 0], low[:, 1])
+        high = line + np.where(horizontal, high[:, 0], high[:, 1])
+        first = np.where(horizontal, np.searchsorted(self.row_keys, low, 'right'),
+                         np.searchsorted(self.col_keys, low, 'right'))
+        last = np.where(horizontal, np.searchsorted(self.row_keys, high, 'left'),
+                        np.searchsorted(self.col_keys, high, 'left'))
+        inside = np.flatnonzero(last > first)
+        if not inside.size:
+            return points
+        pieces, previous = [], 0
+        for i in inside:
+            pieces.append(points[previous:i + 1])
+            if horizontal[i]:
+                cols = self.row_keys[first[i]:last[i]] - line[i]
+                inserted = np.column_stack([cols, np.full(cols.size, points[i, 1])])
+            else:
+                rows = self.col_keys[first[i]:last[i]] - line[i]
+                inserted = np.column_stack([np.full(rows.size, points[i, 0]), rows])
+            # 依線段方向排列
+            if (following[i] < points[i]).any():
+                inserted = inserted[::-1]
+            pieces.append(inserted)
+            previous = i + 1
+        pieces.append(points[previous:])
+        return np.concatenate(pieces)
+
+    def _arc_ref(self, arc):
+        """登記 arc (含兩端點)，回傳 (arc 編號, 是否反向)"""
+        forward = tuple(arc[0]) < tuple(arc[-1]) or (
+            tuple(arc[0]) == tuple(arc[-1]) and tuple(arc[1]) <= tuple(arc[-2]))
+        canonical = arc if forward else arc[::-1]
+        key = canonical.tobytes()
+        arc_id = self._arc_ids.get(key)
+        if arc_id is None:
+            arc_id = self._arc_ids[key] = len(self.arcs)
+            self.arcs.append(np.ascontiguousarray(canonical))
+        return arc_id, not forward
+
+    def add_ring(self, ring):
+        """polygonize 的 ring (結尾重複起點) → [(arc 編號, 是否反向)]"""
+        points = np.asarray(ring, dtype=np.int64)[:-1]
+        points = self._insert_nodes(points)
+        node_index = np.flatnonzero(self.nodes[points[:, 1], points[:, 0]])
+        if not node_index.size:
+            # 沒有節點的封閉 ring (島或洞)：從最小的點開始，當作首尾相同的 arc
+            node_index = np.lexsort((points[:, 1], points[:, 0]))[:1]
+        points = np.roll(points, -node_index[0], axis=0)
+        splits = list(node_index - node_index[0]) + [len(points)]
+        closed = np.concatenate([points, points[:1]])
+        return [self._arc_ref(closed[a:b + 1]) for a, b in zip(splits[:-1], splits[1:])]
+
+    def simplify(self, tolerance):
+        """以 Douglas-Peucker 一次簡化所有 arc，回傳簡化後的 arc list"""
+        if not self.arcs:
+            return []
+        lengths = np.array([len(arc) for arc in self.arcs])
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        keep = douglas_peucker(np.concatenate(self.arcs), offsets, tolerance)
+        points = np.concatenate(self.arcs)
+        return [points[a:b][keep[a:b]] for a, b in zip(offsets[:-1], offsets[1:])]
+
+    @staticmethod
+    def ring(refs, arcs):
+        """[(arc 編號, 是否反向)] → 首尾相同的 ring，少於三個頂點時回傳 None"""
+        parts = [(arcs[arc_id][::-1] if reverse else arcs[arc_id])[:-1] for arc_id, reverse in refs]
+        points = np.concatenate(parts)
+        if len(points) < 3:
+            return None
+        return np.concatenate([points, points[:1]])
+
+
+def douglas_peucker(points, offsets, tolerance):
+    """同時簡化多條折線 (points[offsets[i]:offsets[i+1]])，回傳要保留的點的布林遮罩
+
+    逐層處理：每一輪對所有尚未完成的區段一起找出離端點連線最遠的點，
+    超過容許誤差就保留並切成兩段。折線首尾相同時以到該點的距離計算。
+    """
+    points = points.astype(np.float64)
+    keep = np.zeros(len(points), dtype=bool)
+    first, last = offsets[:-1], offsets[1:] - 1
+    keep[first] = keep[last] = True
+    while True:
+        active = last - first >= 2
+        first, last = first[active], last[active]
+        if not first.size:
+            return keep
+        counts = last - first - 1
+        group = np.repeat(np.arange(first.size), counts)
+        group_start = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        inner = np.arange(counts.sum()) - group_start[group] + first[group] + 1
+
+        start = points[first]
+        segment = points[last] - start
+        length = np.hypot(segment[:, 0], segment[:, 1])
+        relative = points[inner] - start[group]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distance = np.where(
+                length[group] > 0,
+                np.abs(segment[group, 0] * relative[:, 1] - segment[group, 1] * relative[:, 0]) / length[group],
+                np.hypot(relative[:, 0], relative[:, 1]),
+            )
+        farthest = np.maximum.reduceat(distance, group_start)
+        # 每段第一個達到最大距離的點
+        candidates = np.flatnonzero(distance == farthest[group])
+        candidate_group = group[candidates]
+        leading = np.concatenate([[True], candidate_group[1:] != candidate_group[:-1]])
+        split_group = candidate_group[leading]
+        split = inner[candidates[leading]]
+
+        over = farthest[split_group] > tolerance
+        split_group, split = split_group[over], split[over]
+        keep[split] = True
+        first = np.concatenate([first[split_group], split])
+        last = np.concatenate([split, last[split_group]])
+
+
+def band_polygons(bands, tolerance):
+    """分類格網 → {等值帶: [多邊形 (簡化後格網像素角點座標的 ring list)]}"""
+    topology = ArcTopology(bands)
+    shapes = [
+        (int(band), [topology.add_ring(ring) for ring in geometry['coordinates']])
+        for geometry, band in features.shapes(bands, mask=bands > 0, connectivity=4,
+                                              transform=Affine.identity())
+    ]
+    arcs = topology.simplify(tolerance)
+    polygons = {}
+    for band, ring_refs in shapes:
+        rings = [ArcTopology.ring(refs, arcs) for refs in ring_refs]
+        if rings[0] is None:
+            continue
+        polygons.setdefault(band, []).append([ring for ring in rings if ring is not None])
+    return polygons
+
+
+def _feature_collection(polygons, levels, bounds, shape, factor, decimals):
+    """區塊平均後的像素座標 → 經緯度，組成每個等值帶一個 MultiPolygon 的 FeatureCollection
+
+    邊緣不足一個區塊的部分裁切回原始格網範圍。
+    """
+    west, south, east, north = bounds
+    height, width = shape
+    scale = np.array([(east - west) / width, -(north - south) / height])
+    origin = np.array([west, north])
+    feature_list = []
+    vertices = 0
+    for band in sorted(polygons):
+        coordinates = []
+        for rings in polygons[band]:
+            coordinates.append([
+                np.round(origin + np.minimum(ring * factor, (width, height)) * scale, decimals).tolist()
+                for ring in rings
+            ])
+            vertices += sum(len(ring) for ring in rings)
+        feature_list.append({
+            'type': 'Feature',
+            'properties': {
+                'band': band,
+                'min': levels[band - 1],
+                'max': levels[band] if band < len(levels) else None,
+            },
+            'geometry': {'type': 'MultiPolygon', 'coordinates': coordinates},
+        })
+    return {'type': 'FeatureCollection', 'features': feature_list}, vertices
+
+
+def build_contours(grid, bounds, output_dir, levels=None, min_zoom=2, max_zoom=8, tolerance=None,
+                   min_pixels=None):
+    """從記憶體格網輸出各 zoom 的等值帶 GeoJSON (<zoom>.geojson) 與 index.json
+
+    grid: 2D 數值陣列 (北→南)，NaN 代表無資料
+    bounds: (west, south, east, north)，EPSG:4326
+    回傳各 zoom 的統計 (倍率、多邊形數、頂點數、bytes、耗時)。
+    """
+    levels = parse_levels(CONTOUR_LEVELS) if levels is None else list(levels)
+    tolerance = CONTOUR_TOLERANCE if tolerance is None else tolerance
+    grid = np.asarray(grid, dtype=np.float32)
+    height, width = grid.shape
+    grid_degrees = (bounds[2] - bounds[0]) / width
+    output_path = Path(output_dir)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    started = time.perf_counter()
+    entries = []
+    bands_cache = {}
+    for zoom in range(min_zoom, max_zoom + 1):
+        zoom_started = time.perf_counter()
+        factor = zoom_factor(zoom, grid_degrees, tolerance)
+        # 容許誤差換算成區塊平均後的像素
+        pixel_tolerance = tolerance * screen_pixel_degrees(zoom) / (grid_degrees * factor)
+        if pixel_tolerance < 1 and zoom > min_zoom:
+            # 已超過格網解析度，更高的 zoom 由前端放大最後一層
+            break
+        if factor not in bands_cache:
+            bands_cache = {factor: classify(block_mean(grid, factor), levels, min_pixels)}
+        polygons = band_polygons(bands_cache[factor], pixel_tolerance)
+        # 座標精度取螢幕像素的 1/4
+        decimals = max(0, math.ceil(-math.log10(screen_pixel_degrees(zoom) / 4)))
+        collection, vertices = _feature_collection(polygons, levels, bounds, grid.shape, factor, decimals)
+
+        name = f"{zoom}.geojson"
+        data = json.dumps(collection, separators=(',', ':')).encode('utf-8')
+        tmp_path = output_path / f"{name}.tmp"
+        tmp_path.write_bytes(data)
+        os.replace(tmp_path, output_path / name)
+
+        entry = {
+            'zoom': zoom,
+            'file': name,
+            'factor': factor,
+            'polygons': sum(len(p) for p in polygons.values()),
+            'vertices': vertices,
+            'bytes': len(data),
+            'seconds': round(time.perf_counter() - zoom_started, 3),
+        }
+        entries.append(entry)
+        print(f"  等值帶 z{zoom} (×{factor}): {entry['polygons']} 個多邊形、"
+              f"{vertices:,} 個頂點、{len(data) / 1024:.0f}KB，耗時 {entry['seconds']:.2f}s")
+
+    # 清除 zoom 範圍改變後不再產生的檔案
+    current = {entry['file'] for entry in entries}
+    for stale in output_path.glob("*.geojson"):
+        if stale.name not in current:
+            stale.unlink()
+
+    index = {
+        'unit': 'molecules/cm^2',
+        'levels': levels,
+        'bounds': [float(v) for v in bounds],
+        'minzoom': entries[0]['zoom'],
+        'maxzoom': entries[-1]['zoom'],
+        'zooms': entries,
+    }
+    with open(output_path / INDEX_NAME, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    elapsed = time.perf_counter() - started
+    total = sum(entry['bytes'] for entry in entries)
+    print(f"✓ 等值帶: {len(entries)} 個檔案，共 {total / 1024:.0f}KB，耗時 {elapsed:.2f}s → {output_path}")
+    return entries
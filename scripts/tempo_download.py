@@ -0,0 +1,266 @@
+"""TEMPO granule 平行、可續傳的 HTTP Range 下載器
+
+- 透過同一個已認證的 requests session，以多條連線平行下載不同的 byte range
+- 下載中的資料寫在 <檔名>.part，已完成的 range 記錄在 <檔名>.part.json，
+  中斷後下次執行會從未完成的 range 繼續
+- 完成後依 CMR granule metadata 檢查檔案大小與 checksum，再改名為正式檔名
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+# 每個 range 請求的大小
+RANGE_CHUNK_SIZE = int(os.environ.get("TEMPO_RANGE_CHUNK_SIZE", 8 * 1024 * 1024))
+# 平行連線數
+DOWNLOAD_CONNECTIONS = int(os.environ.get("TEMPO_DOWNLOAD_CONNECTIONS", 4))
+# 串流讀取的緩衝大小
+STREAM_BUFFER_SIZE = 1024 * 1024
+
+CONTENT_RANGE_RE = re.compile(r"bytes\s+(\d+)-(\d+)/(\d+|\*)")
+
+
+class DownloadError(Exception):
+    """下載或完整性檢查失敗"""
+
+
+def _hash_file(path, algorithm):
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(STREAM_BUFFER_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def normalize_checksum_algorithm(name):
+    """把 CMR 的演算法名稱 (例如 'MD5'、'SHA-256') 轉成 hashlib 名稱"""
+    return name.lower().replace('-', '').replace('_', '')
+
+
+def verify_file(path, expected_size=None, checksum=None):
+    """檢查檔案大小與 checksum；checksum 為 (演算法, 十六進位值)"""
+    size = os.path.getsize(path)
+    if expected_size is not None and size != expected_size:
+        raise DownloadError(f"檔案大小不符: {size} != {expected_size}")
+    if checksum:
+        algorithm, expected = checksum
+        actual = _hash_file(path, normalize_checksum_algorithm(algorithm))
+        if actual.lower() != expected.lower():
+            raise DownloadError(f"{algorithm} checksum 不符: {actual} != {expected}")
+        print(f"✓ {algorithm} checksum 相符")
+
+
+def authorize(session, url):
+    """走一次 Earthdata 的重定向認證，讓 session 取得下載用的 cookie (不讀取檔案內容)
+
+    session 以 bearer token 認證時 token 直接附在每個請求上，不需要這個流程。
+    """
+    if getattr(session, 'uses_token', False):
+        return
+    headers = {'Range': 'bytes=0-0'}
+    response = session.get(url, headers=headers, allow_redirects=False, stream=True, timeout=30)
+    response.close()
+    if response.status_code in (301, 302, 303, 307):
+        redirect_url = response.headers.get('Location')
+        print(f"重定向到認證 URL: {redirect_url[:100]}...")
+        auth_response = session.get(redirect_url, headers=headers, allow_redirects=True,
+                                    stream=True, timeout=30)
+        auth_response.close()
+        if auth_response.status_code not in (200, 206):
+            raise DownloadError(f"認證失敗，狀態碼: {auth_response.status_code}")
+
+    # 保存取得的 URS cookie，下次執行直接沿用
+    save_cookies = getattr(session, 'save_cookies', None)
+    if save_cookies is not None:
+        save_cookies()
+
+
+def probe(session, url):
+    """以 bytes=0-0 探測檔案大小與是否支援 Range，回傳 (total_size, supports_range)"""
+    response = session.get(url, headers={'Range': 'bytes=0-0'}, stream=True,
+                           allow_redirects=True, timeout=30)
+    response.close()
+    if response.status_code == 206:
+        match = CONTENT_RANGE_RE.match(response.headers.get('Content-Range', ''))
+        if match and match.group(3) != '*':
+            return int(match.group(3)), True
+    if response.status_code in (200, 206):
+        length = response.headers.get('Content-Length')
+        return (int(length) if length else None), False
+    raise DownloadError(f"無法取得檔案資訊，狀態碼: {response.status_code}")
+
+
+class PartState:
+    """.part.json：記錄總大小與已完成的 range，讓中斷的下載可以續傳"""
+
+    def __init__(self, path, url, total_size):
+        self.path = Path(path)
+        self.url = url
+        self.total_size = total_size
+        self.done = set()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path, url, total_size):
+        state = cls(path, url, total_size)
+        try:
+            saved = json.loads(state.path.read_text())
+        except (OSError, ValueError):
+            return state
+        # 檔案內容不同 (大小改變) 時不能沿用
+        if saved.get('total_size') == total_size and saved.get('url') == url:
+            state.done = {tuple(r) for r in saved.get('done', [])}
+        return state
+
+    def mark_done(self, start, end):
+        with self.lock:
+            self.done.add((start, end))
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            tmp_path.write_text(json.dumps({
+                'url': self.url,
+                'total_size': self.total_size,
+                'done': sorted(self.done),
+            }))
+            os.replace(tmp_path, self.path)
+
+    def remove(self):
+        try:
+            self.path.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def pool_size(connections=None, downloads=1):
+    """同時進行 downloads 個下載、每個 connections 條連線時 session 需要的連線池大小"""
+    return (connections or DOWNLOAD_CONNECTIONS) * max(1, downloads)
+
+
+class RangeDownloader:
+    """多連線 Range 下載器，所有連線共用同一個 session (認證與 cookie)
+
+    session 的連線池須在建立時依 pool_size() 設定好，這裡不會替換 adapter。
+    """
+
+    def __init__(self, session, connections=None, chunk_size=None):
+        self.session = session
+        self.connections = connections or DOWNLOAD_CONNECTIONS
+        self.chunk_size = chunk_size or RANGE_CHUNK_SIZE
+        self._progress_lock = threading.Lock()
+        self._downloaded = 0
+        # 本次實際傳輸的 bytes (不含從 .part 續傳的部分)
+        self.transferred = 0
+
+    def download(self, url, file_path, expected_size=None, checksum=None):
+        """下載到 file_path，成功回傳路徑；失敗時保留 .part 供下次續傳並拋出 DownloadError"""
+        file_path = Path(file_path)
+        part_path = file_path.with_name(file_path.name + '.part')
+        state_path = file_path.with_name(file_path.name + '.part.json')
+
+        authorize(self.session, url)
+        total_size, supports_range = probe(self.session, url)
+        if expected_size is not None and total_size is not None and total_size != expected_size:
+            raise DownloadError(f"伺服器回報的大小 {total_size} 與 CMR metadata {expected_size} 不符")
+
+        started = time.perf_counter()
+        self.transferred = 0
+        if supports_range and total_size:
+            self._download_ranges(url, part_path, state_path, total_size)
+        else:
+            print("伺服器不支援 Range，改用單一連線下載")
+            self._download_single(url, part_path)
+        elapsed = time.perf_counter() - started
+
+        verify_file(part_path, expected_size if expected_size is not None else total_size, checksum)
+        os.replace(part_path, file_path)
+        PartState(state_path, url, total_size).remove()
+
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        print(f"下載完成: {file_path.name} ({size_mb:.1f}MB，{elapsed:.1f}s，"
+              f"{size_mb / max(elapsed, 1e-9):.1f}MB/s)")
+        return str(file_path)
+
+    def _download_ranges(self, url, part_path, state_path, total_size):
+        state = PartState.load(state_path, url, total_size)
+        if not part_path.exists() or os.path.getsize(part_path) != total_size:
+            # 預先配置完整大小，各 range 直接寫入對應位置
+            state.done = set()
+            with open(part_path, 'wb') as f:
+                f.truncate(total_size)
+
+        ranges = [
+            (start, min(start + self.chunk_size, total_size) - 1)
+            for start in range(0, total_size, self.chunk_size)
+        ]
+        pending = [r for r in ranges if r not in state.done]
+        self._downloaded = sum(end - start + 1 for start, end in state.done)
+        if state.done:
+            print(f"從 .part 續傳: 已完成 {self._downloaded / (1024 * 1024):.1f}MB，"
+                  f"剩餘 {len(pending)}/{len(ranges)} 個 range")
+        print(f"平行下載 {total_size / (1024 * 1024):.1f}MB，{self.connections} 條連線")
+
+        fd = os.open(part_path, os.O_RDWR)
+        try:
+            with ThreadPoolExecutor(max_workers=self.connections) as pool:
+                futures = [pool.submit(self._fetch_range, url, fd, start, end, state, total_size)
+                           for start, end in pending]
+                errors = []
+                for future in futures:
+                    try:
+                        future.result()
+                    except Exception as e:
+                        errors.append(e)
+                if errors:
+                    raise DownloadError(f"{len(errors)} 個 range 下載失敗: {errors[0]}")
+        finally:
+            os.close(fd)
+
+    def _fetch_range(self, url, fd, start, end, state, total_size):
+        response = self.session.get(url, headers={'Range': f'bytes={start}-{end}'}, stream=True,
+                                    allow_redirects=True, timeout=300)
+        try:
+            if response.status_code != 206:
+                raise DownloadError(f"range {start}-{end} 狀態碼: {response.status_code}")
+            offset = start
+            for chunk in response.iter_content(chunk_size=STREAM_BUFFER_SIZE):
+                if chunk:
+                    os.pwrite(fd, chunk, offset)
+                    offset += len(chunk)
+            if offset != end + 1:
+                raise DownloadError(f"range {start}-{end} 不完整 (收到 {offset - start} bytes)")
+        finally:
+            response.close()
+
+        state.mark_done(start, end)
+        self._report(end - start + 1, total_size)
+
+    def _download_single(self, url, part_path):
+        response = self.session.get(url, stream=True, timeout=300, allow_redirects=True)
+        try:
+            if response.status_code != 200:
+                raise DownloadError(f"下載失敗，狀態碼: {response.status_code}")
+            total_size = int(response.headers.get('content-length', 0))
+            with open(part_path, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=STREAM_BUFFER_SIZE):
+                    if chunk:
+                        f.write(chunk)
+                        self._report(len(chunk), total_size)
+        finally:
+            response.close()
+
+    def _report(self, size, total_size):
+        with self._progress_lock:
+            before = self._downloaded
+            self._downloaded += size
+            self.transferred += size
+            # 每 10MB 顯示一次進度
+            step = 10 * 1024 * 1024
+            if self._downloaded // step != before // step:
+                if total_size:
+                    progress = self._downloaded / total_size * 100
+                    print(f"下載進度: {progress:.1f}% ({self._downloaded / (1024 * 1024):.1f}MB)")
+                else:
+                    print(f"已下載: {self._downloaded / (1024 * 1024):.1f}MB")
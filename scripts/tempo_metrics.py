@@ -0,0 +1,269 @@
+"""TEMPO pipeline 各階段的計時與記憶體量測
+
+每個階段 (CMR 查詢、認證、下載、解碼、著色、tiling…) 結束時寫一行 JSON 到 metrics 檔：
+wall / CPU 時間、峰值 RSS、讀寫 bytes (Linux 的 /proc/self/io)，下載階段另外記錄吞吐量。
+峰值 RSS 是該階段期間的峰值：Linux 上進入階段時經由 /proc/self/clear_refs 重設 VmHWM，
+結束時讀回；無法重設的平台改記整個 process 至今的峰值 (peak_rss_scope 為 process)。
+啟用 profile 時每個階段另存一份 cProfile 結果 (.prof，可用 snakeviz / pstats 檢視)。
+"""
+import cProfile
+import functools
+import itertools
+import json
+import resource
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from pathlib import Path
+
+_CONFIG = {
+    'metrics_file': None,
+    'profile_dir': None,
+    'run_id': uuid.uuid4().hex[:12],
+}
+_RECORDS = []
+_LOCK = threading.Lock()
+# cProfile 同一時間只能有一個 profiler，巢狀或並行的階段只由最外層量測
+_PROFILING = threading.Lock()
+# profile 檔名的流水號：同一階段在一次執行中可能跑多次 (backfill、多產品)
+_PROFILE_SEQ = itertools.count(1)
+# 每個執行緒目前進行中的階段 (最內層在最後)
+_ACTIVE = threading.local()
+# 所有執行緒進行中的階段：重設 VmHWM 前先把當下的峰值記到它們身上，巢狀與並行的階段互不干擾
+_RUNNING = set()
+_HWM_LOCK = threading.Lock()
+# 重設 VmHWM 也會讓 ru_maxrss 歸零，整個 process 的峰值另外保留 (KB)
+_PROCESS_PEAK = {'kb': 0}
+
+
+def configure(metrics_file=None, profile_dir=None):
+    """設定 metrics 檔與 profile 目錄 (None 表示不輸出)"""
+    _CONFIG['metrics_file'] = Path(metrics_file) if metrics_file else None
+    _CONFIG['profile_dir'] = Path(profile_dir) if profile_dir else None
+
+
+def _io_counters():
+    """讀取本 process 的 I/O 計數 (rchar/wchar 為 read/write 系統呼叫總量，read_bytes/write_bytes 為實際磁碟)"""
+    try:
+        with open('/proc/self/io', 'r') as f:
+            return {key: int(value) for key, value in (line.split(':') for line in f)}
+    except (OSError, ValueError):
+        return {}
+
+
+def _read_hwm_kb():
+    """目前的 VmHWM (KB)；非 Linux 時回傳 None"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def _reset_hwm():
+    """把 VmHWM 重設為目前的 RSS，成功回傳 True"""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _begin_peak(current):
+    with _HWM_LOCK:
+        hwm = _read_hwm_kb()
+        if hwm is None:
+            return
+        _PROCESS_PEAK['kb'] = max(_PROCESS_PEAK['kb'], hwm)
+        for other in _RUNNING:
+            other.peak_kb = max(other.peak_kb, hwm)
+        if _reset_hwm():
+            current.peak_kb = _read_hwm_kb() or 0
+            _RUNNING.add(current)
+
+
+def _end_peak(current):
+    """階段期間的峰值 RSS (MB)；無法量測時回傳 None"""
+    with _HWM_LOCK:
+        if current not in _RUNNING:
+            return None
+        _RUNNING.discard(current)
+        peak = max(current.peak_kb, _read_hwm_kb() or 0)
+        _PROCESS_PEAK['kb'] = max(_PROCESS_PEAK['kb'], peak)
+    return round(peak / 1024, 1)
+
+
+def _process_peak_rss_mb():
+    """整個 process 至今的峰值 RSS (MB)"""
+    return max(_peak_rss_mb(resource.RUSAGE_SELF), round(_PROCESS_PEAK['kb'] / 1024, 1))
+
+
+def _peak_rss_mb(who):
+    # Linux 的 ru_maxrss 單位為 KB，macOS 為 bytes
+    peak = resource.getrusage(who).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+class Stage:
+    """單一階段的量測結果，可在執行中以 add() 補充欄位 (例如下載 bytes)"""
+
+    def __init__(self, name):
+        self.name = name
+        self.extra = {}
+        # 階段期間的 VmHWM (KB)
+        self.peak_kb = 0
+
+    def add(self, **fields):
+        self.extra.update(fields)
+
+
+def annotate(**fields):
+    """在目前執行緒最內層的階段附加欄位；不在任何階段內時忽略"""
+    stack = getattr(_ACTIVE, 'stack', None)
+    if stack:
+        stack[-1].add(**fields)
+
+
+@contextmanager
+def stage(name, **fields):
+    """量測 with 區塊內的階段"""
+    current = Stage(name)
+    current.add(**fields)
+    io_start = _io_counters()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    started = datetime.now(timezone.utc)
+    _begin_peak(current)
+
+    profiler = None
+    if _CONFIG['profile_dir'] is not None and _PROFILING.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # 其他 profiling 工具已在執行
+            profiler = None
+            _PROFILING.release()
+
+    stack = _ACTIVE.__dict__.setdefault('stack', [])
+    stack.append(current)
+    error = None
+    try:
+        yield current
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        stack.pop()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        io_end = _io_counters()
+        stage_peak = _end_peak(current)
+        process_peak = _process_peak_rss_mb()
+
+        if profiler is not None:
+            profiler.disable()
+            _PROFILING.release()
+            _dump_profile(name, profiler, current.extra.get('product'))
+
+        record = {
+            'run_id': _CONFIG['run_id'],
+            'stage': name,
+            'started': started.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+            'thread': threading.current_thread().name,
+            'wall_s': round(wall, 4),
+            'cpu_s': round(cpu, 4),
+            'children_cpu_s': round((children.ru_utime + children.ru_stime)
+                                    - (children_start.ru_utime + children_start.ru_stime), 4),
+            'peak_rss_mb': process_peak if stage_peak is None else stage_peak,
+            'peak_rss_scope': 'process' if stage_peak is None else 'stage',
+            # 整個 process 至今的峰值 (只增不減)
+            'process_peak_rss_mb': process_peak,
+            'children_peak_rss_mb': _peak_rss_mb(resource.RUSAGE_CHILDREN),
+        }
+        for key, label in (('rchar', 'read_bytes'), ('wchar', 'write_bytes'),
+                           ('read_bytes', 'disk_read_bytes'), ('write_bytes', 'disk_write_bytes')):
+            if key in io_start and key in io_end:
+                record[label] = io_end[key] - io_start[key]
+        record.update(current.extra)
+        if 'downloaded_bytes' in record and wall > 0:
+            record['throughput_mbps'] = round(record['downloaded_bytes'] / (1024 * 1024) / wall, 2)
+        record['ok'] = error is None and record.get('ok', True)
+        if error is not None:
+            record['error'] = error
+        _write(record)
+
+
+def instrument(name, measure=None):
+    """把函式包成一個量測階段
+
+    measure(result) 回傳要附加的欄位 (dict)，可包含 ok 覆寫成功與否；否則回傳值為 None 時
+    該階段記為失敗，與 pipeline 函式「失敗時回傳 None」的慣例一致。
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as current:
+                result = func(*args, **kwargs)
+                current.add(ok=result is not None)
+                if measure is not None:
+                    current.add(**(measure(result) or {}))
+                return result
+        return wrapper
+    return decorator
+
+
+def _dump_profile(name, profiler, product=None):
+    profile_dir = _CONFIG['profile_dir']
+    profile_dir.mkdir(parents=True, exist_ok=True)
+    parts = [_CONFIG['run_id'], name] + ([str(product)] if product else []) + [f"{next(_PROFILE_SEQ):03d}"]
+    path = profile_dir / f"{'-'.join(parts)}.prof"
+    profiler.dump_stats(str(path))
+
+
+def _write(record):
+    with _LOCK:
+        _RECORDS.append(record)
+        path = _CONFIG['metrics_file']
+        if path is None:
+            return
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def records():
+    """本次執行至今的所有量測結果"""
+    with _LOCK:
+        return list(_RECORDS)
+
+
+def print_summary():
+    """在執行結束時印出本次各階段的耗時摘要"""
+    if not _RECORDS:
+        return
+    print("\n" + "=" * 50)
+    print(f"階段耗時 (run {_CONFIG['run_id']})")
+    for record in _RECORDS:
+        line = (f"  {record['stage']:<16} {record['wall_s']:>8.2f}s wall  {record['cpu_s']:>8.2f}s CPU  "
+                f"峰值 RSS {record['peak_rss_mb']:.0f}MB")
+        if record['children_cpu_s'] > 0:
+            line += f" (+子程序 {record['children_cpu_s']:.2f}s)"
+        if 'throughput_mbps' in record:
+            line += f"  {record['throughput_mbps']:.1f}MB/s"
+        if not record['ok']:
+            line += "  (失敗)"
+        print(line)
+    if _CONFIG['metrics_file'] is not None:
+        print(f"Metrics: {_CONFIG['metrics_file']}")
+    if _CONFIG['profile_dir'] is not None:
+        print(f"cProfile: {_CONFIG['profile_dir']}/{_CONFIG['run_id']}-*.prof")
@@ -0,0 +1,501 @@
+"""本機的 NASA Earthdata 替身伺服器：CMR 搜尋、URS 登入與受保護的 granule 下載
+
+在沒有網路 (或不想打擾 NASA 服務) 的機器上跑完整的 fetch_tempo_no2.py 流程與下載效能測試：
+
+- CMR (--port)：/search/granules.json (sort_key、page_size、temporal、updated_since、
+  CMR-Search-After 分頁、ETag / If-None-Match) 與 /search/granules.umm_json (大小與 MD5)
+- 資料主機 (--port)：/data/<granule>.nc 支援 Range；未認證時 302 到 URS，
+  URS 帶 code 轉回 /login 後設定 session cookie，再 302 回原本的檔案 (與 ASDC 相同的流程)
+- URS (--urs-port，不同主機)：/oauth/authorize (Basic auth) 與 /api/users/find_or_create_token
+- --latency 模擬每個請求的往返延遲，--bandwidth / --total-bandwidth 限制每條連線與總頻寬
+
+granule 來自 --data-dir 內的 TEMPO_NO2_*.nc；加上 --synthetic N 時以 benchmarks.synthetic
+產生 N 個每小時一個的合成 granule。
+
+在 scripts/ 目錄下執行，依照啟動時印出的環境變數執行 fetch_tempo_no2.py:
+    python tempo_mock_server.py --synthetic 3 --size medium --latency 50 --bandwidth 20M
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import re
+import secrets
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from urllib.parse import parse_qs, quote, urlencode, urlparse
+
+GRANULE_TIME_RE = re.compile(r"(\d{8}T\d{6}Z)")
+RANGE_RE = re.compile(r"bytes=(\d*)-(\d*)$")
+DATA_REL = "http://esipfed.org/ns/fedsearch/1.1/data#"
+COLLECTION_ID = "C3685668637-LARC_CLOUD"
+SESSION_COOKIE = "asdc_session"
+TOKEN_LIFETIME = timedelta(days=60)
+# 回應內容每次寫出的大小 (頻寬限制的粒度)
+WRITE_CHUNK_SIZE = 64 * 1024
+# 合成 granule 的掃描間隔與長度
+SCAN_INTERVAL = timedelta(hours=1)
+SCAN_DURATION = timedelta(minutes=40)
+
+
+def parse_rate(text):
+    """解析頻寬，例如 '20M' (MB/s)、'512K'；0 表示不限制"""
+    text = str(text).strip().upper().removesuffix('/S').rstrip('B')
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    if text and text[-1] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+def _iso(moment):
+    return moment.strftime("%Y-%m-%dT%H:%M:%S.") + f"{moment.microsecond // 1000:03d}Z"
+
+
+class RateLimiter:
+    """以固定速率排程傳送時間的限速器，可由多條連線共用"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def consume(self, size):
+        with self._lock:
+            now = time.monotonic()
+            self._next = max(self._next, now) + size / self.rate
+            wait = self._next - now
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Granule:
+    """--data-dir 中的一個 .nc 檔案與它的 CMR metadata"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.title = self.path.name
+        stat = self.path.stat()
+        self.size = stat.st_size
+        self.updated = _iso(datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+        match = GRANULE_TIME_RE.search(self.title)
+        start = (datetime.strptime(match.group(1), "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+                 if match else datetime.fromtimestamp(stat.st_mtime, timezone.utc))
+        self.time_start = _iso(start)
+        self.time_end = _iso(start + SCAN_DURATION)
+        self.id = f"G{int(hashlib.md5(self.title.encode()).hexdigest()[:8], 16)}-LOCAL"
+        self._md5 = None
+        self._lock = threading.Lock()
+
+    @property
+    def md5(self):
+        with self._lock:
+            if self._md5 is None:
+                digest = hashlib.md5()
+                with open(self.path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(block)
+                self._md5 = digest.hexdigest()
+            return self._md5
+
+    def entry(self, base_url):
+        """granules.json 的 feed entry"""
+        return {
+            "id": self.id,
+            "title": self.title,
+            "collection_concept_id": COLLECTION_ID,
+            "time_start": self.time_start,
+            "time_end": self.time_end,
+            "updated": self.updated,
+            "granule_size": str(self.size / (1024 * 1024)),
+            "links": [
+                {"rel": DATA_REL, "type": "application/x-netcdf",
+                 "href": f"{base_url}/data/{quote(self.title)}"},
+            ],
+        }
+
+    def umm(self):
+        """granules.umm_json 的 item"""
+        return {
+            "meta": {"concept-id": self.id, "revision-date": self.updated},
+            "umm": {
+                "GranuleUR": self.title,
+                "DataGranule": {
+                    "ArchiveAndDistributionInformation": [{
+                        "Name": self.title,
+                        "SizeInBytes": self.size,
+                        "Checksum": {"Value": self.md5, "Algorithm": "MD5"},
+                    }],
+                },
+            },
+        }
+
+
+def load_granules(data_dir):
+    granules = [Granule(path) for path in Path(data_dir).glob("TEMPO_NO2_*.nc")]
+    return sorted(granules, key=lambda g: g.time_start)
+
+
+def write_synthetic_granules(data_dir, count, shape):
+    """產生 count 個每小時一個的合成 granule (最新一個在一小時前)，已存在的檔案不重寫"""
+    from benchmarks.synthetic import write_synthetic_granule
+
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    latest = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - SCAN_INTERVAL
+    for i in range(count):
+        start = latest - SCAN_INTERVAL * (count - 1 - i)
+        path = data_dir / f"TEMPO_NO2_L3_NRT_V02_{start:%Y%m%dT%H%M%SZ}_S{i + 1:03d}.nc"
+        if not path.exists():
+            write_synthetic_granule(path, shape, seed=i)
+            print(f"✓ 合成 granule: {path.name} ({path.stat().st_size / (1024 * 1024):.1f}MB)")
+
+
+class MockEarthdata:
+    """兩個伺服器共用的狀態：granule、帳密、token、登入 code 與 session"""
+
+    def __init__(self, data_dir, username, password, latency=0.0, bandwidth=0.0,
+                 total_bandwidth=0.0, tokens=True, verbose=True):
+        self.data_dir = Path(data_dir)
+        self.username = username
+        self.password = password
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.total_limiter = RateLimiter(total_bandwidth) if total_bandwidth else None
+        self.tokens_enabled = tokens
+        self.verbose = verbose
+        self.granules = load_granules(data_dir)
+        self.base_url = None
+        self.urs_url = None
+        self.token = None
+        self.codes = {}
+        self.sessions = set()
+        self.lock = threading.Lock()
+
+    def reload(self):
+        """重新掃描 --data-dir (新增的 granule 會出現在下一次 CMR 查詢)"""
+        granules = load_granules(self.data_dir)
+        with self.lock:
+            self.granules = granules
+
+    def check_basic(self, header):
+        if not header or not header.startswith('Basic '):
+            return False
+        try:
+            username, _, password = base64.b64decode(header[6:]).decode().partition(':')
+        except ValueError:
+            return False
+        return secrets.compare_digest(username, self.username) and secrets.compare_digest(password, self.password)
+
+    def issue_token(self):
+        with self.lock:
+            if self.token is None:
+                self.token = secrets.token_urlsafe(32)
+            return self.token
+
+    def revoke_tokens(self):
+        """讓現有的 token 與 session 失效 (測試 401 重新認證)"""
+        with self.lock:
+            self.token = None
+            self.sessions.clear()
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    mock = None
+
+    def log_message(self, fmt, *args):
+        if self.mock.verbose:
+            print(f"[{self.server.server_port}] {fmt % args}")
+
+    def _delay(self):
+        if self.mock.latency:
+            time.sleep(self.mock.latency)
+
+    def _send(self, status, body=b'', content_type='application/json', headers=None):
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if body:
+            self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if body and self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _send_json(self, payload, headers=None):
+        self._send(200, json.dumps(payload).encode(), headers=headers)
+
+    def _redirect(self, location, headers=None):
+        self._send(302, headers={'Location': location, **(headers or {})})
+
+    def _query(self):
+        parsed = urlparse(self.path)
+        return parsed.path, {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+
+
+class DataHandler(MockHandler):
+    """CMR 搜尋與受 URS 保護的資料主機"""
+
+    def do_GET(self):
+        self._delay()
+        path, query = self._query()
+        if path == '/search/granules.json':
+            self._search(query)
+        elif path == '/search/granules.umm_json':
+            self._search_umm(query)
+        elif path.startswith('/data/'):
+            self._download(path)
+        elif path == '/login':
+            self._login(query)
+        else:
+            self._send(404)
+
+    do_HEAD = do_GET
+
+    def _search(self, query):
+        with self.mock.lock:
+            granules = list(self.mock.granules)
+
+        if query.get('updated_since'):
+            granules = [g for g in granules if g.updated >= query['updated_since']]
+        if query.get('temporal'):
+            since, _, until = query['temporal'].partition(',')
+            granules = [g for g in granules
+                        if (not until or g.time_start <= until) and (not since or g.time_end >= since)]
+        sort_key = query.get('sort_key', 'start_date')
+        granules.sort(key=lambda g: g.time_start, reverse=sort_key.startswith('-'))
+
+        page_size = int(query.get('page_size', 10))
+        offset = 0
+        search_after = self.headers.get('CMR-Search-After')
+        if search_after:
+            offset = json.loads(search_after)[0]
+        page = granules[offset:offset + page_size]
+
+        body = json.dumps({"feed": {
+            "updated": _iso(datetime.now(timezone.utc)),
+            "title": "ECHO granule metadata",
+            "entry": [g.entry(self.mock.base_url) for g in page],
+        }}).encode()
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        headers = {'ETag': etag, 'CMR-Hits': str(len(granules))}
+        if offset + page_size < len(granules):
+            headers['CMR-Search-After'] = json.dumps([offset + page_size])
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, headers={'ETag': etag})
+            return
+        self._send(200, body, headers=headers)
+
+    def _search_umm(self, query):
+        with self.mock.lock:
+            granules = list(self.mock.granules)
+        items = [g.umm() for g in granules if g.title == query.get('granule_ur')]
+        self._send_json({"hits": len(items), "items": items})
+
+    def _authorized(self):
+        """回傳 True (已認證)、False (需登入) 或 None (token 無效)"""
+        authorization = self.headers.get('Authorization', '')
+        if authorization.startswith('Bearer '):
+            with self.mock.lock:
+                token = self.mock.token
+            return True if token and secrets.compare_digest(authorization[7:], token) else None
+        cookies = dict(part.strip().partition('=')[::2]
+                       for part in self.headers.get('Cookie', '').split(';') if '=' in part)
+        with self.mock.lock:
+            return cookies.get(SESSION_COOKIE) in self.mock.sessions
+
+    def _download(self, path):
+        with self.mock.lock:
+            granule = next((g for g in self.mock.granules if f"/data/{quote(g.title)}" == path), None)
+        if granule is None:
+            self._send(404)
+            return
+
+        authorized = self._authorized()
+        if authorized is None:
+            self._send(401, headers={'WWW-Authenticate': 'Bearer'})
+            return
+        if not authorized:
+            self._redirect(f"{self.mock.urs_url}/oauth/authorize?" + urlencode({
+                'client_id': 'tempo-mock',
+                'response_type': 'code',
+                'redirect_uri': f"{self.mock.base_url}/login",
+                'state': path,
+            }))
+            return
+
+        start, end, status = 0, granule.size - 1, 200
+        requested = self.headers.get('Range')
+        if requested:
+            match = RANGE_RE.match(requested.strip())
+            if not match or not (match.group(1) or match.group(2)):
+                self._send(416, headers={'Content-Range': f"bytes */{granule.size}"})
+                return
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), granule.size - 1) if match.group(2) else granule.size - 1
+            else:
+                start = max(0, granule.size - int(match.group(2)))
+            if start > end:
+                self._send(416, headers={'Content-Range': f"bytes */{granule.size}"})
+                return
+            status = 206
+
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-netcdf')
+        self.send_header('Content-Length', str(end - start + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        if status == 206:
+            self.send_header('Content-Range', f"bytes {start}-{end}/{granule.size}")
+        self.end_headers()
+        if self.command == 'HEAD':
+            return
+        self._stream(granule.path, start, end - start + 1)
+
+    def _stream(self, path, offset, length):
+        limiter = RateLimiter(self.mock.bandwidth) if self.mock.bandwidth else None
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length > 0:
+                chunk = f.read(min(WRITE_CHUNK_SIZE, length))
+                if not chunk:
+                    break
+                if limiter is not None:
+                    limiter.consume(len(chunk))
+                if self.mock.total_limiter is not None:
+                    self.mock.total_limiter.consume(len(chunk))
+                try:
+                    self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError):
+                    return
+                length -= len(chunk)
+
+    def _login(self, query):
+        with self.mock.lock:
+            valid = self.mock.codes.pop(query.get('code'), None) is not None
+            session_id = secrets.token_urlsafe(24) if valid else None
+            if valid:
+                self.mock.sessions.add(session_id)
+        if not valid:
+            self._send(401)
+            return
+        state = query.get('state') or '/'
+        self._redirect(state if state.startswith('/') else '/', headers={
+            'Set-Cookie': f"{SESSION_COOKIE}={session_id}; Path=/; HttpOnly",
+        })
+
+
+class URSHandler(MockHandler):
+    """URS：OAuth 登入與 token API"""
+
+    def do_GET(self):
+        self._delay()
+        path, query = self._query()
+        if path != '/oauth/authorize':
+            self._send(404)
+            return
+        if not self.mock.check_basic(self.headers.get('Authorization')):
+            self._send(401, headers={'WWW-Authenticate': 'Basic realm="Please enter your Earthdata Login credentials"'})
+            return
+        code = secrets.token_urlsafe(16)
+        with self.mock.lock:
+            self.mock.codes[code] = query.get('client_id')
+        redirect_uri = query.get('redirect_uri', f"{self.mock.base_url}/login")
+        self._redirect(f"{redirect_uri}?" + urlencode({'code': code, 'state': query.get('state', '/')}))
+
+    def do_POST(self):
+        self._delay()
+        length = int(self.headers.get('Content-Length') or 0)
+        if length:
+            self.rfile.read(length)
+        path, _ = self._query()
+        if path != '/api/users/find_or_create_token' or not self.mock.tokens_enabled:
+            self._send(404)
+            return
+        if not self.mock.check_basic(self.headers.get('Authorization')):
+            self._send(401, json.dumps({"error": "invalid_credentials"}).encode())
+            return
+        expires = datetime.now(timezone.utc) + TOKEN_LIFETIME
+        self._send_json({
+            "access_token": self.mock.issue_token(),
+            "token_type": "Bearer",
+            "expiration_date": f"{expires:%m/%d/%Y}",
+        })
+
+
+def serve(mock, host='127.0.0.1', port=8800, urs_port=8801):
+    """在背景執行緒啟動兩個伺服器，回傳 (資料/CMR 伺服器, URS 伺服器)"""
+    servers = []
+    for handler, server_port in ((DataHandler, port), (URSHandler, urs_port)):
+        handler_class = type(handler.__name__, (handler,), {'mock': mock})
+        server = ThreadingHTTPServer((host, server_port), handler_class)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    data_server, urs_server = servers
+    mock.base_url = f"http://{host}:{data_server.server_port}"
+    mock.urs_url = f"http://{host}:{urs_server.server_port}"
+    return data_server, urs_server
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local stand-in for CMR search, URS login and protected TEMPO downloads.")
+    ap.add_argument("--data-dir", default="../.cache/tempo/mock-granules", help="granule (.nc) 所在目錄")
+    ap.add_argument("--synthetic", type=int, default=0, metavar="N", help="在 --data-dir 產生 N 個合成 granule")
+    ap.add_argument("--size", default="small", help="合成 granule 大小: small / medium / full 或 <高>x<寬>")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8800, help="CMR 與資料主機的 port")
+    ap.add_argument("--urs-port", type=int, default=8801, help="URS 的 port")
+    ap.add_argument("--username", default=os.environ.get("EARTHDATA_USERNAME", "tempo"))
+    ap.add_argument("--password", default=os.environ.get("EARTHDATA_PASSWORD", "tempo"))
+    ap.add_argument("--latency", type=float, default=0, help="每個請求的延遲 (毫秒)")
+    ap.add_argument("--bandwidth", type=parse_rate, default=0, help="每條連線的頻寬，例如 20M (0 = 不限制)")
+    ap.add_argument("--total-bandwidth", type=parse_rate, default=0, help="所有連線合計的頻寬")
+    ap.add_argument("--no-token", action="store_true", help="停用 token API，強制走 URS cookie 流程")
+    ap.add_argument("--quiet", action="store_true", help="不印出每個請求")
+    args = ap.parse_args()
+
+    if args.synthetic:
+        from benchmarks.synthetic import parse_shape
+        write_synthetic_granules(args.data_dir, args.synthetic, parse_shape(args.size))
+
+    mock = MockEarthdata(args.data_dir, args.username, args.password, latency=args.latency / 1000,
+                         bandwidth=args.bandwidth, total_bandwidth=args.total_bandwidth,
+                         tokens=not args.no_token, verbose=not args.quiet)
+    if not mock.granules:
+        raise SystemExit(f"{args.data_dir} 沒有 TEMPO_NO2_*.nc，請加上 --synthetic N")
+    serve(mock, args.host, args.port, args.urs_port)
+
+    print(f"✓ {len(mock.granules)} 個 granule，最新: {mock.granules[-1].title}")
+    print(f"CMR / 資料: {mock.base_url}   URS: {mock.urs_url}")
+    print("另開終端機 (scripts/ 目錄) 以下列環境變數執行 fetch_tempo_no2.py；"
+          "使用獨立的快取與狀態檔，避免替身的 token 與狀態混入正式環境:")
+    print(f"  export TEMPO_CMR_URL={mock.base_url}/search TEMPO_URS_URL={mock.urs_url}")
+    print(f"  export EARTHDATA_USERNAME={args.username} EARTHDATA_PASSWORD={args.password}")
+    print("  export TEMPO_CACHE_DIR=/tmp/tempo-mock/cache TEMPO_STATE_FILE=/tmp/tempo-mock/state.json")
+    print("按 Enter 重新掃描 granule，輸入 r 讓所有 token / session 失效，Ctrl+C 結束")
+    try:
+        while True:
+            command = input().strip().lower()
+            if command == 'r':
+                mock.revoke_tokens()
+                print("已撤銷所有 token 與 session")
+            else:
+                mock.reload()
+                print(f"重新掃描: {len(mock.granules)} 個 granule")
+    except EOFError:
+        # 沒有終端機 (背景執行) 時持續服務到被終止
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
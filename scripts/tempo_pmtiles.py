@@ -0,0 +1,350 @@
+"""PMTiles v3 單檔 tile 封存的寫入與讀取
+
+把整個 XYZ 金字塔存成一個 .pmtiles 檔，取代數千個小 PNG：
+- tile 依 Hilbert tile ID 排序，目錄 (directory) 以 gzip 壓縮放在檔頭之後，
+  根目錄放不下時自動拆成 leaf directories
+- 內容相同的 tile (大量的空白 tile) 只存一份，連續相同的 tile 以 run-length 合併
+- 內建小型讀取器與 HTTP 服務，可直接從封存檔檢查或提供 tiles
+
+規格: https://github.com/protomaps/PMTiles/blob/main/spec/v3/spec.md
+
+在 scripts/ 目錄下執行:
+    python tempo_pmtiles.py info ../public/tempo/tempo_no2.pmtiles
+    python tempo_pmtiles.py get ../public/tempo/tempo_no2.pmtiles 4 2 10 -o tile.png
+    python tempo_pmtiles.py serve ../public/tempo/tempo_no2.pmtiles --port 8080
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import struct
+from bisect import bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+HEADER_SIZE = 127
+MAGIC = b"PMTiles"
+VERSION = 3
+# 根目錄 + 檔頭必須落在前 16 KiB 內，讀取端一次請求即可取得
+ROOT_DIRECTORY_LIMIT = 16384 - HEADER_SIZE
+
+COMPRESSION_NONE = 1
+COMPRESSION_GZIP = 2
+TILE_TYPE_PNG = 2
+
+HEADER_FORMAT = "<7sB" + "Q" * 11 + "BBBBBBiiiiBii"
+
+
+def _rotate(n, x, y, rx, ry):
+    if ry == 0:
+        if rx == 1:
+            x = n - 1 - x
+            y = n - 1 - y
+        x, y = y, x
+    return x, y
+
+
+def zxy_to_tileid(z, x, y):
+    """(z, x, y) → PMTiles tile ID (較低 zoom 的 tile 總數 + 此 zoom 的 Hilbert 序號)"""
+    n = 1 << z
+    if not (0 <= x < n and 0 <= y < n):
+        raise ValueError(f"tile 超出範圍: {z}/{x}/{y}")
+    tile_id = ((1 << (2 * z)) - 1) // 3
+    s = n >> 1
+    while s > 0:
+        rx = 1 if x & s else 0
+        ry = 1 if y & s else 0
+        tile_id += s * s * ((3 * rx) ^ ry)
+        x, y = _rotate(n, x, y, rx, ry)
+        s >>= 1
+    return tile_id
+
+
+def _write_varint(buffer, value):
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def _read_varint(data, pos):
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def serialize_directory(entries):
+    """entries: [(tile_id, offset, length, run_length)]，回傳 gzip 壓縮後的目錄"""
+    buffer = bytearray()
+    _write_varint(buffer, len(entries))
+    last_id = 0
+    for tile_id, _, _, _ in entries:
+        _write_varint(buffer, tile_id - last_id)
+        last_id = tile_id
+    for _, _, _, run_length in entries:
+        _write_varint(buffer, run_length)
+    for _, _, length, _ in entries:
+        _write_varint(buffer, length)
+    for i, (_, offset, _, _) in enumerate(entries):
+        previous = entries[i - 1] if i > 0 else None
+        if previous is not None and offset == previous[1] + previous[2]:
+            _write_varint(buffer, 0)
+        else:
+            _write_varint(buffer, offset + 1)
+    return gzip.compress(bytes(buffer), mtime=0)
+
+
+def deserialize_directory(blob):
+    data = gzip.decompress(blob)
+    count, pos = _read_varint(data, 0)
+    tile_ids, run_lengths, lengths, offsets = [], [], [], []
+    last_id = 0
+    for _ in range(count):
+        delta, pos = _read_varint(data, pos)
+        last_id += delta
+        tile_ids.append(last_id)
+    for _ in range(count):
+        value, pos = _read_varint(data, pos)
+        run_lengths.append(value)
+    for _ in range(count):
+        value, pos = _read_varint(data, pos)
+        lengths.append(value)
+    for i in range(count):
+        value, pos = _read_varint(data, pos)
+        if value == 0 and i > 0:
+            offsets.append(offsets[i - 1] + lengths[i - 1])
+        else:
+            offsets.append(value - 1)
+    return list(zip(tile_ids, offsets, lengths, run_lengths))
+
+
+def _build_directories(entries):
+    """根目錄放不下時，把 entries 切成 leaf directories，回傳 (root, leaves bytes)"""
+    root = serialize_directory(entries)
+    if len(root) <= ROOT_DIRECTORY_LIMIT:
+        return root, b""
+
+    leaf_size = 4096
+    while True:
+        root_entries = []
+        leaves = bytearray()
+        for start in range(0, len(entries), leaf_size):
+            chunk = entries[start:start + leaf_size]
+            leaf = serialize_directory(chunk)
+            root_entries.append((chunk[0][0], len(leaves), len(leaf), 0))
+            leaves.extend(leaf)
+        root = serialize_directory(root_entries)
+        if len(root) <= ROOT_DIRECTORY_LIMIT:
+            return root, bytes(leaves)
+        leaf_size = int(leaf_size * 1.2)
+
+
+def write_pmtiles(path, tiles, bounds, min_zoom, max_zoom, metadata=None):
+    """把 {(z, x, y): PNG bytes} 寫成單一 PMTiles 檔並回傳統計資訊
+
+    bounds: (west, south, east, north)，EPSG:4326
+    """
+    ordered = sorted((zxy_to_tileid(z, x, y), data) for (z, x, y), data in tiles.items())
+
+    entries = []
+    tile_data = bytearray()
+    offsets_by_hash = {}
+    for tile_id, data in ordered:
+        digest = hashlib.blake2b(data, digest_size=16).digest()
+        offset = offsets_by_hash.get(digest)
+        if offset is None:
+            offset = len(tile_data)
+            offsets_by_hash[digest] = offset
+            tile_data.extend(data)
+
+        last = entries[-1] if entries else None
+        if last is not None and last[1] == offset and last[0] + last[3] == tile_id:
+            # 連續且內容相同的 tile 合併成一筆 run
+            entries[-1] = (last[0], last[1], last[2], last[3] + 1)
+        else:
+            entries.append((tile_id, offset, len(data), 1))
+
+    root, leaves = _build_directories(entries)
+    meta = gzip.compress(json.dumps(metadata or {}, separators=(',', ':')).encode('utf-8'), mtime=0)
+
+    west, south, east, north = bounds
+    root_offset = HEADER_SIZE
+    meta_offset = root_offset + len(root)
+    leaves_offset = meta_offset + len(meta)
+    data_offset = leaves_offset + len(leaves)
+    center_zoom = (min_zoom + max_zoom) // 2
+
+    header = struct.pack(
+        HEADER_FORMAT,
+        MAGIC, VERSION,
+        root_offset, len(root),
+        meta_offset, len(meta),
+        leaves_offset, len(leaves),
+        data_offset, len(tile_data),
+        len(ordered), len(entries), len(offsets_by_hash),
+        1,                      # clustered：tile 資料依 tile ID 排列
+        COMPRESSION_GZIP,       # 目錄與 metadata 的壓縮
+        COMPRESSION_NONE,       # PNG 本身已壓縮
+        TILE_TYPE_PNG,
+        min_zoom, max_zoom,
+        int(west * 1e7), int(south * 1e7), int(east * 1e7), int(north * 1e7),
+        center_zoom, int((west + east) / 2 * 1e7), int((south + north) / 2 * 1e7),
+    )
+
+    with open(path, 'wb') as f:
+        f.write(header)
+        f.write(root)
+        f.write(meta)
+        f.write(leaves)
+        f.write(tile_data)
+
+    stats = {
+        'addressed_tiles': len(ordered),
+        'tile_entries': len(entries),
+        'tile_contents': len(offsets_by_hash),
+        'bytes': data_offset + len(tile_data),
+    }
+    print(f"✓ PMTiles 已寫入: {path} ({stats['addressed_tiles']} 張 tile，"
+          f"{stats['tile_contents']} 份不重複內容，{stats['bytes'] / 1e6:.1f}MB)")
+    return stats
+
+
+class PMTilesReader:
+    """讀取 PMTiles 檔：查詢單張 tile、列出所有 tile"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        raw = self._file.read(HEADER_SIZE)
+        fields = struct.unpack(HEADER_FORMAT, raw)
+        if fields[0] != MAGIC or fields[1] != VERSION:
+            raise ValueError(f"不是 PMTiles v3 檔案: {path}")
+        names = [
+            'root_offset', 'root_length', 'metadata_offset', 'metadata_length',
+            'leaf_offset', 'leaf_length', 'data_offset', 'data_length',
+            'addressed_tiles', 'tile_entries', 'tile_contents',
+            'clustered', 'internal_compression', 'tile_compression', 'tile_type',
+            'min_zoom', 'max_zoom', 'min_lon_e7', 'min_lat_e7', 'max_lon_e7', 'max_lat_e7',
+            'center_zoom', 'center_lon_e7', 'center_lat_e7',
+        ]
+        self.header = dict(zip(names, fields[2:]))
+        self._root = deserialize_directory(self._read(self.header['root_offset'], self.header['root_length']))
+        self._leaves = {}
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _read(self, offset, length):
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    @property
+    def metadata(self):
+        blob = self._read(self.header['metadata_offset'], self.header['metadata_length'])
+        return json.loads(gzip.decompress(blob))
+
+    def _leaf(self, offset, length):
+        key = (offset, length)
+        if key not in self._leaves:
+            self._leaves[key] = deserialize_directory(
+                self._read(self.header['leaf_offset'] + offset, length))
+        return self._leaves[key]
+
+    def get_tile(self, z, x, y):
+        """回傳 tile 內容，不存在時回傳 None"""
+        tile_id = zxy_to_tileid(z, x, y)
+        directory = self._root
+        for _ in range(4):  # 規格限制最多三層 leaf
+            index = bisect_right([e[0] for e in directory], tile_id) - 1
+            if index < 0:
+                return None
+            entry_id, offset, length, run_length = directory[index]
+            if run_length == 0:
+                directory = self._leaf(offset, length)
+                continue
+            if tile_id < entry_id + run_length:
+                return self._read(self.header['data_offset'] + offset, length)
+            return None
+        return None
+
+    def entries(self):
+        """依序列出所有 tile entry (tile_id, offset, length, run_length)"""
+        for entry in self._root:
+            if entry[3] == 0:
+                yield from self._leaf(entry[1], entry[2])
+            else:
+                yield entry
+
+
+def serve(path, port=8080):
+    """以 /{z}/{x}/{y}.png 提供封存檔內的 tiles"""
+    reader = PMTilesReader(path)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            parts = self.path.split('?')[0].strip('/').split('/')
+            try:
+                z, x, y = int(parts[0]), int(parts[1]), int(parts[2].split('.')[0])
+                data = reader.get_tile(z, x, y)
+            except (ValueError, IndexError):
+                data = None
+            if data is None:
+                self.send_response(404)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/png')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(data)
+
+    print(f"提供 {path} 的 tiles: http://127.0.0.1:{port}/{{z}}/{{x}}/{{y}}.png")
+    ThreadingHTTPServer(('127.0.0.1', port), Handler).serve_forever()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Inspect, extract or serve tiles from a PMTiles archive.")
+    sub = ap.add_subparsers(dest='command', required=True)
+    info = sub.add_parser('info', help="顯示檔頭與 metadata")
+    info.add_argument('archive')
+    get = sub.add_parser('get', help="取出單張 tile")
+    get.add_argument('archive')
+    get.add_argument('z', type=int)
+    get.add_argument('x', type=int)
+    get.add_argument('y', type=int)
+    get.add_argument('-o', '--output', required=True)
+    srv = sub.add_parser('serve', help="以 HTTP 提供 tiles")
+    srv.add_argument('archive')
+    srv.add_argument('--port', type=int, default=8080)
+    args = ap.parse_args()
+
+    if args.command == 'info':
+        with PMTilesReader(args.archive) as reader:
+            print(json.dumps(reader.header, indent=2))
+            print(json.dumps(reader.metadata, indent=2, ensure_ascii=False))
+    elif args.command == 'get':
+        with PMTilesReader(args.archive) as reader:
+            data = reader.get_tile(args.z, args.x, args.y)
+        if data is None:
+            raise SystemExit(f"tile 不存在: {args.z}/{args.x}/{args.y}")
+        with open(args.output, 'wb') as f:
+            f.write(data)
+        print(f"✓ {args.z}/{args.x}/{args.y} → {args.output} ({len(data)} bytes)")
+    else:
+        serve(args.archive, args.port)
+
+
+if __name__ == "__main__":
+    main()
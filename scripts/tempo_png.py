@@ -0,0 +1,116 @@
+"""NO2 tile 的 PNG 編碼器
+
+著色 tile 本來就是 0-255 的調色盤索引，直接寫成 8-bit 索引色 PNG (PLTE + tRNS)，
+每像素 1 byte 而不是展開成 4 bytes 的 RGBA：
+
+- PLTE / tRNS 只寫到 tile 實際用到的最大索引，tRNS 省略尾端完全不透明的項目
+- 列濾波 (none / sub / up / average / paeth / adaptive) 與 zlib 等級、策略可調，
+  預設值依 benchmarks.bench_png 的量測結果選擇
+- 數值編碼 tile (RGBA) 另有一組濾波與策略設定
+
+濾波以 NumPy 對整張 tile 向量化計算，zlib 壓縮時會釋放 GIL，可在寫入執行緒中並行。
+"""
+import os
+import struct
+import zlib
+
+import numpy as np
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+COLOR_TYPE_INDEXED = 3
+COLOR_TYPE_RGBA = 6
+
+FILTERS = {'none': 0, 'sub': 1, 'up': 2, 'average': 3, 'paeth': 4}
+STRATEGIES = {
+    'default': zlib.Z_DEFAULT_STRATEGY,
+    'filtered': zlib.Z_FILTERED,
+    'rle': zlib.Z_RLE,
+    'huffman': zlib.Z_HUFFMAN_ONLY,
+}
+
+# 預設設定 (bench_png 量測：paeth + RLE 的大小接近 adaptive，速度快將近一倍；
+# RLE 只找重複字串，zlib 等級幾乎不影響結果)
+PNG_COMPRESS_LEVEL = int(os.environ.get("TEMPO_PNG_COMPRESS_LEVEL", 6))
+PNG_FILTER = os.environ.get("TEMPO_PNG_FILTER", "paeth")
+PNG_STRATEGY = os.environ.get("TEMPO_PNG_STRATEGY", "rle")
+# RGBA 數值 tile 的濾波與策略 (相鄰像素數值接近，同樣以 paeth + RLE 最划算)
+PNG_RGBA_FILTER = os.environ.get("TEMPO_PNG_RGBA_FILTER", "paeth")
+PNG_RGBA_STRATEGY = os.environ.get("TEMPO_PNG_RGBA_STRATEGY", "rle")
+
+
+def _chunk(kind, data):
+    return (struct.pack('>I', len(data)) + kind + data
+            + struct.pack('>I', zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+
+def _filter_rows(rows, bpp, method):
+    """對 (高, 每列 bytes) 的 uint8 陣列套用 PNG 列濾波，回傳含濾波類型 byte 的掃描線。"""
+    height, _ = rows.shape
+    if method == 'adaptive':
+        # 每列選擇絕對值總和最小的濾波 (PNG 規格建議的啟發式)
+        candidates = np.stack([_filtered(rows, bpp, FILTERS[name]) for name in FILTERS])
+        cost = np.abs(candidates.view(np.int8).astype(np.int32)).sum(axis=2)
+        choice = cost.argmin(axis=0)
+        filtered = candidates[choice, np.arange(height)]
+        types = choice.astype(np.uint8)
+    else:
+        filter_type = FILTERS[method]
+        filtered = _filtered(rows, bpp, filter_type)
+        types = np.full(height, filter_type, dtype=np.uint8)
+    return np.concatenate([types[:, None], filtered], axis=1)
+
+
+def _filtered(rows, bpp, filter_type):
+    if filter_type == 0:
+        return rows
+    rows16 = rows.astype(np.int16)
+    left = np.zeros_like(rows16)
+    left[:, bpp:] = rows16[:, :-bpp]
+    up = np.zeros_like(rows16)
+    up[1:] = rows16[:-1]
+    if filter_type == 1:
+        predictor = left
+    elif filter_type == 2:
+        predictor = up
+    elif filter_type == 3:
+        predictor = (left + up) >> 1
+    else:
+        upper_left = np.zeros_like(rows16)
+        upper_left[1:, bpp:] = rows16[:-1, :-bpp]
+        p = left + up - upper_left
+        pa, pb, pc = np.abs(p - left), np.abs(p - up), np.abs(p - upper_left)
+        predictor = np.where((pa <= pb) & (pa <= pc), left, np.where(pb <= pc, up, upper_left))
+    return ((rows16 - predictor) & 0xFF).astype(np.uint8)
+
+
+def _encode(rows, width, height, bpp, color_type, extra_chunks, level, filter_method, strategy):
+    level = PNG_COMPRESS_LEVEL if level is None else level
+    strategy = STRATEGIES[strategy]
+    scanlines = _filter_rows(rows, bpp, filter_method)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS, 9, strategy)
+    idat = compressor.compress(scanlines.tobytes()) + compressor.flush()
+    header = struct.pack('>IIBBBBB', width, height, 8, color_type, 0, 0, 0)
+    return b''.join([PNG_SIGNATURE, _chunk(b'IHDR', header), *extra_chunks,
+                     _chunk(b'IDAT', idat), _chunk(b'IEND', b'')])
+
+
+def encode_indexed(index, palette, level=None, filter_method=None, strategy=None):
+    """(高, 寬) uint8 索引 + (256, 4) RGBA 調色盤 → 8-bit 索引色 PNG bytes。"""
+    index = np.ascontiguousarray(index, dtype=np.uint8)
+    height, width = index.shape
+    used = int(index.max()) + 1
+    chunks = [_chunk(b'PLTE', np.ascontiguousarray(palette[:used, :3], dtype=np.uint8).tobytes())]
+    alpha = np.asarray(palette[:used, 3], dtype=np.uint8)
+    translucent = np.flatnonzero(alpha != 255)
+    if translucent.size:
+        chunks.append(_chunk(b'tRNS', alpha[:translucent[-1] + 1].tobytes()))
+    return _encode(index, width, height, 1, COLOR_TYPE_INDEXED, chunks,
+                   level, filter_method or PNG_FILTER, strategy or PNG_STRATEGY)
+
+
+def encode_rgba(rgba, level=None, filter_method=None, strategy=None):
+    """(高, 寬, 4) uint8 RGBA → PNG bytes。"""
+    rgba = np.ascontiguousarray(rgba, dtype=np.uint8)
+    height, width, _ = rgba.shape
+    return _encode(rgba.reshape(height, width * 4), width, height, 4, COLOR_TYPE_RGBA, [],
+                   level, filter_method or PNG_RGBA_FILTER, strategy or PNG_RGBA_STRATEGY)
@@ -0,0 +1,123 @@
+"""TEMPO L3 產品登錄表 (NO2 / HCHO / O3)
+
+每個產品記錄 CMR 查詢條件、NetCDF 內的候選變數、顏色映射範圍與輸出位置，
+fetch_tempo_no2.py 依此處理任一產品，--products 可在同一次執行中並行處理多個產品。
+
+NO2 沿用原本的路徑 (../public/tempo/tiles、state.json …)，其他產品輸出到
+../public/tempo/<產品>/ 底下同樣的結構。collection 可用 TEMPO_<產品>_COLLECTION
+改成指定的 concept ID (例如換到新版本的集合)。
+"""
+import os
+from pathlib import Path
+
+import tempo_state
+
+PUBLIC_ROOT = Path("../public/tempo")
+
+
+class Product:
+    """一個 TEMPO L3 產品的查詢條件、變數與輸出設定"""
+
+    def __init__(self, name, label, candidate_vars, color_range, valid_range, unit,
+                 collection_id=None, short_name=None, output_root=None, download_dir=None,
+                 state_file=None, stations_path=None):
+        self.name = name
+        self.label = label
+        # (group, variable)，依序嘗試
+        self.candidate_vars = candidate_vars
+        # 數值落在 valid_range 內時固定以 color_range 著色，否則改用 1%-99% 百分位數
+        self.color_range = color_range
+        self.valid_range = valid_range
+        self.unit = unit
+        self.collection_id = os.environ.get(f"TEMPO_{name.upper()}_COLLECTION", collection_id)
+        self.short_name = short_name
+        self.output_root = Path(output_root) if output_root else PUBLIC_ROOT / name
+        self.download_dir = Path(download_dir) if download_dir else self.output_root / "nc"
+        self.state_file = Path(state_file) if state_file else self.output_root / "state.json"
+        self.stations_path = stations_path
+
+    def __repr__(self):
+        return f"Product({self.name!r})"
+
+    @property
+    def search_params(self):
+        """CMR granule 查詢的集合條件"""
+        if self.collection_id:
+            return {"echo_collection_id": self.collection_id}
+        return {"short_name": self.short_name, "provider": "LARC_CLOUD"}
+
+    @property
+    def layout_key(self):
+        """NetCDF 結構快取的 key"""
+        return self.collection_id or self.short_name
+
+    @property
+    def file_prefix(self):
+        """下載檔名的前綴，例如 TEMPO_NO2_ (清理舊檔案用)"""
+        return f"TEMPO_{self.label}_"
+
+    @property
+    def tiles_dir(self):
+        return self.output_root / "tiles"
+
+    @property
+    def geotiff_dir(self):
+        return self.output_root / "geotiff"
+
+
+PRODUCTS = {
+    "no2": Product(
+        "no2", "NO2",
+        candidate_vars=[
+            ('product', 'vertical_column_troposphere'),
+            ('support_data', 'vertical_column_total'),
+            (None, 'vertical_column_troposphere'),
+            (None, 'vertical_column_total'),
+            ('product', 'vertical_column_troposphere_uncertainty'),
+            ('support_data', 'fitted_slant_column'),
+        ],
+        # NO2 典型範圍 0 到 5e15 molecules/cm²，以固定範圍保持顏色映射的一致性
+        color_range=(0, 5e15),
+        valid_range=(0, 1e16),
+        unit="molecules/cm²",
+        collection_id="C3685668637-LARC_CLOUD",  # TEMPO NO2 Gridded 新集合
+        output_root=PUBLIC_ROOT,
+        download_dir=PUBLIC_ROOT / "no2",
+        state_file=tempo_state.STATE_FILE,
+        stations_path="../public/tempo/stations.json",
+    ),
+    "hcho": Product(
+        "hcho", "HCHO",
+        candidate_vars=[
+            ('product', 'vertical_column'),
+            (None, 'vertical_column'),
+            ('support_data', 'vertical_column_total'),
+        ],
+        color_range=(0, 2e16),
+        valid_range=(0, 5e16),
+        unit="molecules/cm²",
+        short_name="TEMPO_HCHO_L3_NRT",
+    ),
+    "o3": Product(
+        "o3", "O3TOT",
+        candidate_vars=[
+            ('product', 'column_amount_o3'),
+            (None, 'column_amount_o3'),
+        ],
+        color_range=(200, 450),
+        valid_range=(100, 700),
+        unit="DU",
+        short_name="TEMPO_O3TOT_L3_NRT",
+    ),
+}
+
+
+def parse_products(text):
+    """'no2,hcho' → [Product, ...]；'all' 表示全部"""
+    names = list(PRODUCTS) if text.strip().lower() == "all" else [
+        part.strip().lower() for part in text.split(",") if part.strip()
+    ]
+    unknown = [name for name in names if name not in PRODUCTS]
+    if unknown or not names:
+        raise ValueError(f"未知的產品: {', '.join(unknown) or text!r} (可用: {', '.join(PRODUCTS)}、all)")
+    return [PRODUCTS[name] for name in dict.fromkeys(names)]
@@ -0,0 +1,120 @@
+"""處理狀態檔與 CMR 條件式輪詢
+
+state.json 記錄上次成功處理的 granule (ID、title、time_start、CMR updated 時間)
+與輸出的雜湊。每次輪詢時：
+
+- 以 updated_since 只向 CMR 查詢上次之後更新過的 granule，沒有新資料時回應幾乎是空的
+- CMR 回應若帶有 ETag / Last-Modified，下次以 If-None-Match / If-Modified-Since 條件式請求
+- 最新 granule 與狀態檔相同 (或比已處理的更舊) 時視為沒有新資料
+"""
+import hashlib
+import json
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+STATE_FILE = Path(os.environ.get("TEMPO_STATE_FILE", "../public/tempo/state.json"))
+
+# --check 時沒有新 granule 的結束代碼 (0 = 有新資料，其他非零值 = 錯誤)
+NO_NEW_GRANULE_EXIT_CODE = 3
+
+
+def load_state(path=STATE_FILE):
+    """讀取狀態檔，不存在或損毀時回傳空 dict"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(path.name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def is_new_granule(entry, state):
+    """entry 比狀態檔記錄的 granule 新 (或同一個 granule 被重新處理過) 時回傳 True"""
+    if not state.get('granule_id'):
+        return True
+    if entry.get('id') == state['granule_id']:
+        return entry.get('updated') != state.get('updated')
+    # 重新處理的舊 granule 也會出現在 updated_since 的結果中，不能蓋掉較新的輸出
+    return (entry.get('time_start') or '') > (state.get('time_start') or '')
+
+
+def poll_latest_granule(cmr_url, params, state, timeout=30):
+    """以條件式請求查詢最新 granule，回傳 (有新資料時的 entry 或 None, 更新後的 CMR 驗證資訊)"""
+    params = dict(params)
+    if state.get('updated'):
+        params['updated_since'] = state['updated']
+
+    validators = dict(state.get('cmr') or {})
+    headers = {}
+    if validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+
+    r = requests.get(cmr_url, params=params, headers=headers, timeout=timeout)
+    if r.status_code == 304:
+        print("CMR 回應 304 Not Modified")
+        return None, validators
+    r.raise_for_status()
+
+    validators = {
+        'etag': r.headers.get('ETag'),
+        'last_modified': r.headers.get('Last-Modified'),
+    }
+    entries = r.json().get('feed', {}).get('entry', [])
+    if not entries:
+        print(f"CMR 沒有 {state.get('updated')} 之後更新的 granule")
+        return None, validators
+
+    entry = entries[0]
+    print("Latest granule title:", entry.get("title"))
+    if not is_new_granule(entry, state):
+        print(f"已處理過最新的 granule: {state.get('title')}")
+        return None, validators
+    return entry, validators
+
+
+def output_hash(path):
+    """輸出的內容雜湊：tiles 目錄取 manifest，單一檔案 (PMTiles) 取整個檔案"""
+    if path is None:
+        return None
+    path = Path(path)
+    if path.is_dir():
+        path = path / "manifest.json"
+    if not path.is_file():
+        return None
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_processed(entry, output_path, validators=None, path=STATE_FILE):
+    """處理成功後寫入狀態檔，回傳 (新狀態, 輸出是否與上次不同)"""
+    previous = load_state(path)
+    state = {
+        'granule_id': entry.get('id'),
+        'title': entry.get('title'),
+        'time_start': entry.get('time_start'),
+        'updated': entry.get('updated'),
+        'output': str(output_path),
+        'output_hash': output_hash(output_path),
+        'processed_at': datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'cmr': validators or previous.get('cmr') or {},
+    }
+    save_state(state, path)
+    changed = state['output_hash'] != previous.get('output_hash')
+    print(f"狀態已更新: {path} (輸出{'已變更' if changed else '未變更'})")
+    return state, changed
@@ -0,0 +1,145 @@
+"""在每個 granule 的 NO2 格網上預先取樣所有測站的數值
+
+把 pandora / TOLnet / OpenAQ 測站的座標一次轉成格網的列、欄索引，以單一次
+NumPy 花式索引取出全部測站的數值，寫成以測站 ID 為 key 的精簡 JSON，
+前端點選測站時只需讀取這一個檔案，不必再抓 tile 反推數值。
+
+像素對應方式與 tempo_tiler.GridSource 相同 (北→南格網、bounds 為格點範圍)，
+因此測站數值與地圖上顯示的 tile 一致。
+"""
+import json
+import os
+from functools import lru_cache
+
+import numpy as np
+import xarray as xr
+
+# 獲取專案根目錄的 data 資料夾路徑
+script_dir = os.path.dirname(os.path.abspath(__file__))
+project_root = os.path.dirname(script_dir)
+data_dir = os.path.join(project_root, "public", "data")
+
+# 測站網路: (GeoJSON 檔名, 作為 ID 的 property)
+STATION_FILES = {
+    "pandora": ("pandora-us-stations.geojson", "station"),
+    "tolnet": ("TOLnet-us-stations.geojson", "id"),
+    "openaq": ("openaq-us-stations.geojson", "id"),
+}
+
+# 輸出保留的有效位數 (TEMPO L3 柱濃度的精度遠低於此)
+SIGNIFICANT_DIGITS = 4
+
+
+class Stations:
+    """所有測站的網路、ID 與座標 (向量化取樣用的平行陣列)。"""
+
+    def __init__(self, networks, ids, lons, lats):
+        self.networks = networks
+        self.ids = ids
+        self.lons = np.asarray(lons, dtype=np.float64)
+        self.lats = np.asarray(lats, dtype=np.float64)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+@lru_cache(maxsize=None)
+def load_stations(directory=data_dir):
+    """讀取三個測站 GeoJSON，缺少的檔案略過；同一網路內重複的 ID 只保留第一筆。"""
+    networks, ids, lons, lats = [], [], [], []
+    for network, (filename, id_field) in STATION_FILES.items():
+        path = os.path.join(directory, filename)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                features = json.load(f).get("features", [])
+        except (OSError, ValueError) as e:
+            print(f"略過測站檔案 {filename}: {e}")
+            continue
+
+        seen = set()
+        for feature in features:
+            station_id = (feature.get("properties") or {}).get(id_field)
+            geometry = feature.get("geometry") or {}
+            if station_id is None or geometry.get("type") != "Point":
+                continue
+            station_id = str(station_id)
+            if station_id in seen:
+                continue
+            seen.add(station_id)
+            lon, lat = geometry["coordinates"][:2]
+            networks.append(network)
+            ids.append(station_id)
+            lons.append(lon)
+            lats.append(lat)
+
+    print(f"載入 {len(ids)} 個測站")
+    return Stations(networks, ids, lons, lats)
+
+
+def pixel_indices(stations, bounds, shape):
+    """測站座標 → 北→南格網的 (rows, cols, inside)，格網外的測站 inside 為 False。"""
+    west, south, east, north = bounds
+    height, width = shape
+    cols = np.floor((stations.lons - west) / ((east - west) / width)).astype(np.int64)
+    rows = np.floor((north - stations.lats) / ((north - south) / height)).astype(np.int64)
+    inside = (cols >= 0) & (cols < width) & (rows >= 0) & (rows < height)
+    return rows, cols, inside
+
+
+def sample_grid(grid, bounds, stations=None):
+    """從記憶體中的北→南格網取樣所有測站，格網外或無資料為 NaN。"""
+    if stations is None:
+        stations = load_stations()
+    rows, cols, inside = pixel_indices(stations, bounds, grid.shape)
+    values = np.full(len(stations), np.nan)
+    values[inside] = grid[rows[inside], cols[inside]]
+    return values
+
+
+def sample_lazy(data, lat_name, lats, bounds, stations=None):
+    """從延遲載入的 NetCDF 變數取樣 (串流模式)，只讀取測站所在的格點。"""
+    if stations is None:
+        stations = load_stations()
+    lon_name = next(dim for dim in data.dims if dim != lat_name)
+    shape = (data.sizes[lat_name], data.sizes[lon_name])
+    rows, cols, inside = pixel_indices(stations, bounds, shape)
+    if bool(np.all(np.diff(lats) > 0)):
+        # 原始資料為南→北
+        rows = shape[0] - 1 - rows
+
+    values = np.full(len(stations), np.nan)
+    if inside.any():
+        picked = data.isel({
+            lat_name: xr.DataArray(rows[inside], dims="station"),
+            lon_name: xr.DataArray(cols[inside], dims="station"),
+        }).values
+        values[inside] = picked
+    return values
+
+
+def write_station_samples(path, values, granule, observed=None, stations=None):
+    """寫出 {網路: {測站 ID: 數值或 null}} 的精簡 JSON，回傳有數值的測站數。"""
+    if stations is None:
+        stations = load_stations()
+    samples = {network: {} for network in STATION_FILES}
+    valid = 0
+    for network, station_id, value in zip(stations.networks, stations.ids, values):
+        if np.isfinite(value):
+            samples[network][station_id] = float(f"{value:.{SIGNIFICANT_DIGITS}g}")
+            valid += 1
+        else:
+            samples[network][station_id] = None
+
+    payload = {
+        "granule": granule,
+        "time": observed,
+        "unit": "molecules/cm^2",
+        **samples,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, separators=(",", ":"))
+    os.replace(tmp_path, path)
+    print(f"✓ 測站取樣: {valid}/{len(stations)} 個測站有數值 → {path}")
+    return valid
@@ -0,0 +1,581 @@
+"""TEMPO NO2 原生 XYZ tiler
+
+直接從記憶體中的格網 (EPSG:4326, 北→南) 建立 Web Mercator tile 金字塔，
+取代 gdal_translate + gdal2tiles.py 的子程序流程。
+
+- 最高 zoom 以 NumPy 向量化的方式重投影 (最近鄰取樣)
+- 較低 zoom 由上一層的 2×2 區塊平均產生 (忽略無資料像素)
+- 以 metatile 為單位分配到 process pool，PNG 編碼與寫入交給背景執行緒與計算重疊
+- 著色 tile 寫成 8-bit 索引色 PNG (見 tempo_png)，不展開成 RGBA
+- 每個 granule 先算一次有效資料的 tile 覆蓋範圍 (Footprint)，沒有資料的子樹不重投影，
+  完全透明的 tile 不寫出 (前端把缺少的 tile 當成無資料)
+- 以 manifest.json 記錄每張 tile 的內容雜湊，內容未變的 tile 不重寫，
+  不再產生的 tile 會被刪除，並輸出 <tiles>-changes.json 變更清單供發佈使用
+- 指定 archive_path 時改為輸出單一 PMTiles 封存檔 (見 tempo_pmtiles)
+- 指定 data_tiles_dir 時同一趟另外輸出數值編碼 tile (類似 terrain-RGB)，
+  value = offset + scale × (R × 65536 + G × 256 + B)，alpha = 0 代表無資料
+"""
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+import tempo_pmtiles
+import tempo_png
+
+TILE_SIZE = 256
+MAX_LATITUDE = 85.05112878  # Web Mercator 有效緯度範圍
+
+# 每個 worker 一次處理的 zoom 層數：(2^3)^2 = 64 張最高 zoom tile
+META_LEVELS = 3
+
+# 允許透過環境變數覆寫 tiling 的 process 數量
+TILE_PROCESSES = int(os.environ.get("TEMPO_TILE_PROCESSES", os.cpu_count() or 2))
+# PNG 寫入執行緒數量
+TILE_WRITER_THREADS = int(os.environ.get("TEMPO_TILE_WRITER_THREADS", 4))
+
+MANIFEST_NAME = "manifest.json"
+DATA_METADATA_NAME = "metadata.json"
+
+# 數值編碼 tile 的量化間距與偏移 (molecules/cm²)：24 bits 可涵蓋 -1e16 ~ 1.58e17
+DATA_TILE_SCALE = float(os.environ.get("TEMPO_DATA_TILE_SCALE", 1e10))
+DATA_TILE_OFFSET = float(os.environ.get("TEMPO_DATA_TILE_OFFSET", -1e16))
+DATA_TILE_MAX_CODE = (1 << 24) - 1
+
+
+def lonlat_to_tile(lon, lat, zoom):
+    """經緯度 → 所在 tile 的 (x, y)。"""
+    lat = min(max(lat, -MAX_LATITUDE), MAX_LATITUDE)
+    n = 2 ** zoom
+    x = int(math.floor((lon + 180.0) / 360.0 * n))
+    lat_rad = math.radians(lat)
+    y = int(math.floor((1.0 - math.asinh(math.tan(lat_rad)) / math.pi) / 2.0 * n))
+    return min(max(x, 0), n - 1), min(max(y, 0), n - 1)
+
+
+def tile_range(bounds, zoom):
+    """回傳覆蓋 bounds (west, south, east, north) 的 tile 範圍 (x_min, x_max, y_min, y_max)。"""
+    west, south, east, north = bounds
+    x_min, y_min = lonlat_to_tile(west, north, zoom)
+    x_max, y_max = lonlat_to_tile(east, south, zoom)
+    return x_min, x_max, y_min, y_max
+
+
+def tile_pixel_lonlat(zoom, x, y):
+    """計算 tile 內每個像素中心的經度 (欄) 與緯度 (列)。"""
+    world = float(TILE_SIZE * 2 ** zoom)
+    offsets = np.arange(TILE_SIZE, dtype=np.float64) + 0.5
+    lons = (x * TILE_SIZE + offsets) / world * 360.0 - 180.0
+    merc = np.pi * (1.0 - 2.0 * (y * TILE_SIZE + offsets) / world)
+    lats = np.degrees(np.arctan(np.sinh(merc)))
+    return lons, lats
+
+
+class GridSource:
+    """北→南排列的規則經緯度格網，負責把 tile 像素對應回原始格點。"""
+
+    def __init__(self, grid, bounds):
+        self.grid = grid
+        self.west, self.south, self.east, self.north = bounds
+        self.height, self.width = grid.shape
+        self.xres = (self.east - self.west) / self.width
+        self.yres = (self.north - self.south) / self.height
+
+    def sample_tile(self, zoom, x, y):
+        """以最近鄰取樣重投影單一 tile，格網外的像素為 NaN。"""
+        lons, lats = tile_pixel_lonlat(zoom, x, y)
+        cols = np.floor((lons - self.west) / self.xres).astype(np.int64)
+        rows = np.floor((self.north - lats) / self.yres).astype(np.int64)
+        col_ok = (cols >= 0) & (cols < self.width)
+        row_ok = (rows >= 0) & (rows < self.height)
+
+        tile = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+        if col_ok.any() and row_ok.any():
+            # 經度只與欄有關、緯度只與列有關，可直接用外積索引
+            tile[np.ix_(row_ok, col_ok)] = self.grid[np.ix_(rows[row_ok], cols[col_ok])]
+        return tile
+
+
+class Footprint:
+    """有效資料在各 zoom 的 tile 覆蓋範圍，用來略過整棵沒有資料的子樹。
+
+    最高 zoom 的每張 tile 以它實際取樣的格網列、欄範圍判斷是否含有效像素 (不會漏掉資料，
+    最多把取樣間隙中的資料算成有)；較低 zoom 由 2×2 子 tile 取 OR。
+    """
+
+    def __init__(self, source, min_zoom, max_zoom):
+        valid = np.isfinite(source.grid)
+        bounds = (source.west, source.south, source.east, source.north)
+        x_min, x_max, y_min, y_max = tile_range(bounds, max_zoom)
+
+        col_spans = self._spans(
+            [np.floor((tile_pixel_lonlat(max_zoom, x, 0)[0] - source.west) / source.xres)
+             for x in range(x_min, x_max + 1)], source.width)
+        row_spans = self._spans(
+            [np.floor((source.north - tile_pixel_lonlat(max_zoom, 0, y)[1]) / source.yres)
+             for y in range(y_min, y_max + 1)], source.height)
+
+        # 先依 tile 列把格網列合併，再依 tile 欄合併，整體只掃過格網一次
+        covered = np.zeros((len(row_spans), len(col_spans)), dtype=bool)
+        for ty, (r0, r1) in enumerate(row_spans):
+            if r0 >= r1:
+                continue
+            rows_any = valid[r0:r1].any(axis=0)
+            for tx, (c0, c1) in enumerate(col_spans):
+                covered[ty, tx] = c0 < c1 and rows_any[c0:c1].any()
+
+        # levels[zoom] = (x0, y0, bool 陣列)，座標為絕對 tile 座標
+        self.levels = {max_zoom: (x_min, y_min, covered)}
+        for zoom in range(max_zoom - 1, min_zoom - 1, -1):
+            x0, y0, child = self.levels[zoom + 1]
+            child = np.pad(child, ((y0 % 2, 0), (x0 % 2, 0)))
+            child = np.pad(child, ((0, child.shape[0] % 2), (0, child.shape[1] % 2)))
+            parent = child.reshape(child.shape[0] // 2, 2, child.shape[1] // 2, 2).any(axis=(1, 3))
+            self.levels[zoom] = (x0 // 2, y0 // 2, parent)
+
+    @staticmethod
+    def _spans(indices, size):
+        """每張 tile 取樣到的格網索引範圍 [start, stop)，完全在格網外時為空範圍。"""
+        spans = []
+        for index in indices:
+            index = index[(index >= 0) & (index < size)]
+            spans.append((int(index.min()), int(index.max()) + 1) if index.size else (0, 0))
+        return spans
+
+    def covers(self, zoom, x, y):
+        x0, y0, covered = self.levels[zoom]
+        row, col = y - y0, x - x0
+        return 0 <= row < covered.shape[0] and 0 <= col < covered.shape[1] and bool(covered[row, col])
+
+    def count(self, zoom):
+        return int(self.levels[zoom][2].sum())
+
+
+def downsample_2x2(block):
+    """將 (512, 512) 的子 tile 拼圖以 2×2 平均縮成 (256, 256)，NaN 不參與平均。"""
+    valid = ~np.isnan(block)
+    filled = np.where(valid, block, np.float32(0))
+    total = filled[0::2, 0::2] + filled[1::2, 0::2] + filled[0::2, 1::2] + filled[1::2, 1::2]
+    flags = valid.view(np.uint8)
+    count = flags[0::2, 0::2] + flags[1::2, 0::2] + flags[0::2, 1::2] + flags[1::2, 1::2]
+    out = np.full((TILE_SIZE, TILE_SIZE), np.nan, dtype=np.float32)
+    np.divide(total, count, out=out, where=count > 0)
+    return out
+
+
+def palette_from_colormap(colormap):
+    """把 {索引: (r, g, b, a)} 形式的顏色表轉成 (256, 4) uint8 查找表。"""
+    palette = np.zeros((256, 4), dtype=np.uint8)
+    for index, rgba in colormap.items():
+        palette[index] = rgba
+    return palette
+
+
+def to_palette_index(values, value_range=None):
+    """把 tile 數值轉成 0-255 的調色盤索引 (0 = 無資料)。
+
+    value_range 為 None 時，數值本身即為著色 GeoTIFF 的索引 (平均後四捨五入)；
+    否則與 create_colored_geotiff 相同，線性正規化到 0-255。
+    """
+    finite = np.isfinite(values)
+    if value_range is None:
+        index = np.rint(np.where(finite, values, 0))
+    else:
+        data_min, data_max = value_range
+        span = data_max - data_min
+        if span <= 0:
+            index = np.zeros_like(values)
+        else:
+            index = np.where(finite, np.clip((values - data_min) / span, 0, 1) * 255, 0)
+    return np.clip(index, 0, 255).astype(np.uint8)
+
+
+def encode_data_tile(values, scale=None, offset=None):
+    """把 tile 數值量化成 24-bit 整數並拆到 RGB，alpha 255 = 有資料、0 = 無資料。"""
+    scale = DATA_TILE_SCALE if scale is None else scale
+    offset = DATA_TILE_OFFSET if offset is None else offset
+    finite = np.isfinite(values)
+    code = np.rint((np.where(finite, values, offset).astype(np.float64) - offset) / scale)
+    code = np.clip(code, 0, DATA_TILE_MAX_CODE).astype(np.uint32)
+    rgba = np.empty(values.shape + (4,), dtype=np.uint8)
+    rgba[..., 0] = code >> 16
+    rgba[..., 1] = (code >> 8) & 0xFF
+    rgba[..., 2] = code & 0xFF
+    rgba[..., 3] = np.where(finite, 255, 0)
+    return rgba
+
+
+def decode_data_tile(rgba, scale=None, offset=None):
+    """encode_data_tile 的反運算，無資料像素為 NaN。"""
+    scale = DATA_TILE_SCALE if scale is None else scale
+    offset = DATA_TILE_OFFSET if offset is None else offset
+    rgba = np.asarray(rgba)
+    code = (rgba[..., 0].astype(np.uint32) << 16) | (rgba[..., 1].astype(np.uint32) << 8) | rgba[..., 2]
+    return np.where(rgba[..., 3] > 0, offset + scale * code.astype(np.float64), np.nan)
+
+
+def data_tile_metadata(bounds, min_zoom, max_zoom):
+    """數值編碼 tile 的解碼參數，寫在 data tiles 目錄 (或封存檔 metadata) 供前端使用。"""
+    return {
+        'encoding': 'rgb24',
+        'formula': 'value = offset + scale * (R * 65536 + G * 256 + B)',
+        'scale': DATA_TILE_SCALE,
+        'offset': DATA_TILE_OFFSET,
+        'nodata': 'alpha == 0',
+        'unit': 'molecules/cm^2',
+        'minzoom': min_zoom,
+        'maxzoom': max_zoom,
+        'bounds': list(bounds),
+    }
+
+
+class TileLayer:
+    """一組 tile 輸出 (目錄 + manifest，或封存檔) 的寫入結果。"""
+
+    def __init__(self, tiles_dir, previous=None, archive=False):
+        self.tiles_dir = tiles_dir
+        self.previous = previous or {}
+        self.archive = archive
+        self.entries = {}
+        self.changes = {'added': [], 'updated': []}
+        # 封存模式下保留編碼後的 PNG，最後一次寫進封存檔
+        self.blobs = {}
+        # 完全透明而未寫出的 tile 數
+        self.blank = 0
+
+    def task(self, key, encode, *arrays):
+        """回傳 (函式, 參數...)，可直接執行或交給寫入執行緒；encode(*arrays) 產生 PNG bytes。"""
+        if self.archive:
+            return (encode_tile, key, encode, arrays)
+        return (store_tile, self.tiles_dir, key, encode, arrays, self.previous.get(key))
+
+    def record(self, result):
+        key, digest, status, data = result
+        self.entries[key] = digest
+        if status in self.changes:
+            self.changes[status].append(key)
+        if data is not None:
+            self.blobs[key] = data
+
+    def results(self):
+        """可跨 process 回傳的寫入結果。"""
+        return self.entries, self.changes, self.blobs, self.blank
+
+    def merge(self, results):
+        entries, changes, blobs, blank = results
+        self.entries.update(entries)
+        self.blobs.update(blobs)
+        self.blank += blank
+        for status in self.changes:
+            self.changes[status].extend(changes[status])
+
+
+class PyramidBuilder:
+    """單一 process 內的 tile 金字塔建構器。
+
+    layers: {'color': TileLayer, 'data': TileLayer (可省略)}
+    footprint: Footprint，提供時略過沒有資料的 tile
+    """
+
+    def __init__(self, source, layers, palette, min_zoom, max_zoom, value_range=None, writer=None,
+                 footprint=None):
+        self.source = source
+        self.footprint = footprint
+        self.layers = layers
+        self.palette = palette
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.value_range = value_range
+        self.writer = writer
+        self.ranges = {
+            z: tile_range((source.west, source.south, source.east, source.north), z)
+            for z in range(min_zoom, max_zoom + 1)
+        }
+        self.pending = []
+        self.tile_count = 0
+
+    def in_range(self, zoom, x, y):
+        x_min, x_max, y_min, y_max = self.ranges[zoom]
+        return (x_min <= x <= x_max and y_min <= y <= y_max
+                and (self.footprint is None or self.footprint.covers(zoom, x, y)))
+
+    def render(self, zoom, x, y):
+        """遞迴建立 (zoom, x, y) 以下的子樹，回傳此 tile 的數值陣列。"""
+        if not self.in_range(zoom, x, y):
+            return None
+
+        if zoom == self.max_zoom:
+            values = self.source.sample_tile(zoom, x, y)
+        else:
+            values = self.merge_children(
+                [[self.render(zoom + 1, 2 * x + dx, 2 * y + dy) for dx in (0, 1)] for dy in (0, 1)]
+            )
+
+        self.emit(zoom, x, y, values)
+        return values
+
+    @staticmethod
+    def merge_children(children):
+        """把 2×2 子 tile 拼成一張再縮小，缺少的子 tile 視為無資料。"""
+        block = np.full((2 * TILE_SIZE, 2 * TILE_SIZE), np.nan, dtype=np.float32)
+        for dy in (0, 1):
+            for dx in (0, 1):
+                child = children[dy][dx]
+                if child is not None:
+                    block[dy * TILE_SIZE:(dy + 1) * TILE_SIZE, dx * TILE_SIZE:(dx + 1) * TILE_SIZE] = child
+        return downsample_2x2(block)
+
+    def emit(self, zoom, x, y, values):
+        """著色 (與數值編碼) 後交給寫入執行緒，與下一張 tile 的計算重疊；完全透明的 tile 不寫出。"""
+        key = f"{zoom}/{x}/{y}.png"
+        index = to_palette_index(values, self.value_range)
+        if self.palette[index, 3].any():
+            self._submit(self.layers['color'], key, tempo_png.encode_indexed, index, self.palette)
+        else:
+            self.layers['color'].blank += 1
+        if 'data' in self.layers:
+            if np.isfinite(values).any():
+                self._submit(self.layers['data'], key, tempo_png.encode_rgba, encode_data_tile(values))
+            else:
+                self.layers['data'].blank += 1
+        self.tile_count += 1
+
+    def _submit(self, layer, key, encode, *arrays):
+        task = layer.task(key, encode, *arrays)
+        if self.writer is None:
+            layer.record(task[0](*task[1:]))
+        else:
+            self.pending.append((layer, self.writer.submit(*task)))
+
+    def wait(self):
+        """等待所有 PNG 寫入完成，並把寫入錯誤往上拋出。"""
+        for layer, future in self.pending:
+            layer.record(future.result())
+        self.pending = []
+
+
+def store_tile(tiles_dir, key, encode, arrays, previous_digest=None):
+    """編碼並寫出 tile；內容雜湊與上次相同時略過寫入。
+
+    回傳 (key, digest, status, None)，status 為 'added'、'updated' 或 'unchanged'。
+    """
+    data = encode(*arrays)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    if digest == previous_digest:
+        return key, digest, 'unchanged', None
+
+    path = os.path.join(tiles_dir, *key.split('/'))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return key, digest, 'added' if previous_digest is None else 'updated', None
+
+
+def encode_tile(key, encode, arrays):
+    """封存模式：只編碼不寫檔，回傳 (key, digest, 'archived', PNG bytes)。"""
+    data = encode(*arrays)
+    return key, hashlib.blake2b(data, digest_size=16).hexdigest(), 'archived', data
+
+
+def load_manifest(tiles_dir):
+    """讀取上次輸出的 {tile 路徑: 內容雜湊}，不存在或損毀時回傳空 dict。"""
+    path = os.path.join(tiles_dir, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('tiles', {})
+    except (OSError, ValueError):
+        return {}
+
+
+def changes_path(tiles_dir):
+    """變更清單放在 tiles 目錄旁 (不會被一起發佈)。"""
+    tiles_dir = os.path.normpath(tiles_dir)
+    return os.path.join(os.path.dirname(tiles_dir), f"{os.path.basename(tiles_dir)}-changes.json")
+
+
+def finalize_manifest(tiles_dir, previous, entries, changes):
+    """刪除不再產生的 tile，寫出新的 manifest 與變更清單。"""
+    removed = sorted(set(previous) - set(entries))
+    for key in removed:
+        path = os.path.join(tiles_dir, *key.split('/'))
+        try:
+            os.remove(path)
+            # 順便移除因此變空的 z/x 目錄
+            os.removedirs(os.path.dirname(path))
+        except OSError:
+            pass
+
+    with open(os.path.join(tiles_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({'tiles': dict(sorted(entries.items()))}, f, separators=(',', ':'))
+
+    summary = {
+        'added': sorted(changes['added']),
+        'updated': sorted(changes['updated']),
+        'removed': removed,
+        'unchanged': len(entries) - len(changes['added']) - len(changes['updated']),
+    }
+    with open(changes_path(tiles_dir), 'w', encoding='utf-8') as f:
+        json.dump(summary, f, indent=2)
+    return summary
+
+
+# worker process 的共享狀態 (fork 時直接繼承，不需序列化整個格網)
+_WORKER = {}
+
+
+def _init_worker(grid, bounds, palette, min_zoom, max_zoom, value_range, layer_specs, footprint=None):
+    _WORKER['args'] = (GridSource(grid, bounds), palette, min_zoom, max_zoom, value_range)
+    _WORKER['footprint'] = footprint
+    # layer_specs: {名稱: (tiles_dir, previous, archive)}
+    _WORKER['layers'] = layer_specs
+
+
+def _render_metatile(zoom, x, y):
+    """worker 入口：建立一個 metatile 的完整子樹，回傳其根 tile 數值與各 layer 的寫入結果。"""
+    source, palette, _, max_zoom, value_range = _WORKER['args']
+    layers = {name: TileLayer(*spec) for name, spec in _WORKER['layers'].items()}
+    with ThreadPoolExecutor(max_workers=TILE_WRITER_THREADS) as writer:
+        builder = PyramidBuilder(source, layers, palette, zoom, max_zoom, value_range, writer,
+                                 _WORKER['footprint'])
+        values = builder.render(zoom, x, y)
+        builder.wait()
+    return (x, y), values, {name: layer.results() for name, layer in layers.items()}
+
+
+def _data_archive_path(archive_path):
+    root, ext = os.path.splitext(archive_path)
+    return f"{root}_data{ext or '.pmtiles'}"
+
+
+def _finalize_layer(name, layer, previous, bounds, min_zoom, max_zoom):
+    """寫出封存檔或 manifest，回傳該 layer 的摘要。"""
+    if layer.archive:
+        tiles = {tuple(int(part) for part in key[:-len('.png')].split('/')): data
+                 for key, data in layer.blobs.items()}
+        if name == 'data':
+            metadata = dict(data_tile_metadata(bounds, min_zoom, max_zoom), name='TEMPO NO2 values',
+                            format='png', type='overlay')
+        else:
+            metadata = {
+                'name': 'TEMPO NO2',
+                'format': 'png',
+                'type': 'overlay',
+                'bounds': ','.join(str(v) for v in bounds),
+            }
+        return tempo_pmtiles.write_pmtiles(layer.tiles_dir, tiles, bounds, min_zoom, max_zoom, metadata)
+
+    summary = finalize_manifest(layer.tiles_dir, previous, layer.entries, layer.changes)
+    if name == 'data':
+        with open(os.path.join(layer.tiles_dir, DATA_METADATA_NAME), 'w', encoding='utf-8') as f:
+            json.dump(data_tile_metadata(bounds, min_zoom, max_zoom), f, indent=2)
+    print(f"  [{name}] 新增 {len(summary['added'])}、更新 {len(summary['updated'])}、"
+          f"刪除 {len(summary['removed'])}、未變 {summary['unchanged']}、略過空白 {layer.blank}")
+    return summary
+
+
+def build_tile_pyramid(grid, bounds, tiles_dir, palette, min_zoom=2, max_zoom=8,
+                       processes=None, value_range=None, incremental=True, archive_path=None,
+                       data_tiles_dir=None):
+    """從記憶體格網建立 XYZ tile 金字塔。
+
+    grid: 2D 陣列 (北→南)，NaN 或索引 0 代表無資料
+    bounds: (west, south, east, north)，EPSG:4326
+    palette: (256, 4) uint8 顏色表
+    incremental: 依 manifest 略過內容未變的 tile；False 時全部重寫
+    archive_path: 指定時輸出單一 PMTiles 檔，不寫個別 PNG 與 manifest
+    data_tiles_dir: 同一趟另外輸出數值編碼 tile；grid 須為實際數值並提供 value_range。
+        封存模式下數值 tile 寫到 <archive>_data.pmtiles
+    回傳著色 tile 的變更摘要 (added/updated/removed/unchanged)；封存模式回傳封存統計。
+    """
+    processes = TILE_PROCESSES if processes is None else processes
+    grid = np.asarray(grid, dtype=np.float32)
+    if value_range is None:
+        # 著色 GeoTIFF 的索引 0 代表無資料，平均前轉為 NaN
+        grid = np.where(grid == 0, np.nan, grid).astype(np.float32)
+
+    if data_tiles_dir is not None and value_range is None:
+        raise ValueError("數值編碼 tile 需要實際數值的格網與 value_range")
+
+    archive = archive_path is not None
+    targets = {'color': archive_path if archive else tiles_dir}
+    if data_tiles_dir is not None:
+        targets['data'] = _data_archive_path(archive_path) if archive else data_tiles_dir
+
+    previous = {}
+    layer_specs = {}
+    for name, target in targets.items():
+        if archive:
+            previous[name] = {}
+        else:
+            os.makedirs(target, exist_ok=True)
+            previous[name] = load_manifest(target)
+        # 非增量模式仍需上次的 manifest 來刪除不再產生的 tile
+        layer_specs[name] = (target, previous[name] if incremental else {}, archive)
+    layers = {name: TileLayer(*spec) for name, spec in layer_specs.items()}
+
+    started = time.perf_counter()
+    source = GridSource(grid, bounds)
+    footprint = Footprint(source, min_zoom, max_zoom)
+    x_min, x_max, y_min, y_max = tile_range(bounds, max_zoom)
+    print(f"資料範圍: zoom {max_zoom} 有 {footprint.count(max_zoom)}/"
+          f"{(x_max - x_min + 1) * (y_max - y_min + 1)} 張 tile 含有效資料")
+
+    meta_zoom = max(min_zoom, max_zoom - META_LEVELS)
+    x_min, x_max, y_min, y_max = tile_range(bounds, meta_zoom)
+    jobs = [(meta_zoom, x, y) for x in range(x_min, x_max + 1) for y in range(y_min, y_max + 1)
+            if footprint.covers(meta_zoom, x, y)]
+    init_args = (grid, bounds, palette, meta_zoom, max_zoom, value_range, layer_specs, footprint)
+
+    print(f"Tile 金字塔: zoom {min_zoom}-{max_zoom}，{len(jobs)} 個 metatile (zoom {meta_zoom})，"
+          f"{processes} 個 process，manifest 內 {len(previous['color'])} 張 tile"
+          + ("，含數值編碼 tile" if 'data' in layers else ""))
+
+    roots = {}
+
+    def collect(result):
+        key, values, layer_results = result
+        roots[key] = values
+        for name, results in layer_results.items():
+            layers[name].merge(results)
+
+    if processes <= 1:
+        _init_worker(*init_args)
+        for job in jobs:
+            collect(_render_metatile(*job))
+    else:
+        with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker,
+                                 initargs=init_args) as pool:
+            futures = [pool.submit(_render_metatile, *job) for job in jobs]
+            for future in futures:
+                collect(future.result())
+
+    # metatile 以下的低 zoom 層數很少，直接在主 process 由根 tile 逐層平均
+    with ThreadPoolExecutor(max_workers=TILE_WRITER_THREADS) as writer:
+        builder = PyramidBuilder(source, layers, palette, min_zoom, max_zoom, value_range, writer, footprint)
+        level = roots
+        for zoom in range(meta_zoom - 1, min_zoom - 1, -1):
+            parents = {}
+            for (cx, cy) in level:
+                parents.setdefault((cx // 2, cy // 2), None)
+            next_level = {}
+            for (px, py) in parents:
+                children = [[level.get((2 * px + dx, 2 * py + dy)) for dx in (0, 1)] for dy in (0, 1)]
+                values = builder.merge_children(children)
+                builder.emit(zoom, px, py, values)
+                next_level[(px, py)] = values
+            level = next_level
+        builder.wait()
+
+    summaries = {
+        name: _finalize_layer(name, layer, previous[name], bounds, min_zoom, max_zoom)
+        for name, layer in layers.items()
+    }
+
+    elapsed = time.perf_counter() - started
+    count = len(layers['color'].entries)
+    print(f"✓ 產生 {count} 張 tiles，耗時 {elapsed:.2f}s ({count / max(elapsed, 1e-9):.0f} tiles/s)")
+    return summaries['color']